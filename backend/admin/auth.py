@@ -1,13 +1,43 @@
+import hashlib
+import time
 import typing as t
 
 from fastapi import HTTPException
 from starlette.requests import Request
 from starlette.responses import Response
+from starlette_admin import BaseAdmin
 from starlette_admin.auth import AdminUser, AuthProvider
 from starlette_admin.exceptions import FormValidationError, LoginFailed
+from tortoise.signals import post_delete, post_save
 
 import models
-from core import security
+from conf import settings
+from core import hashing, security, throttling
+from core.cache import LRUCache
+
+# Session token digest -> (user id, token version) of verified superadmin, spares JWT verification on every admin
+# request. Entries expire with the token, user is still checked on every hit: local invalidation below reaches only
+# current worker
+session_cache = LRUCache(maxsize=settings().ADMIN_AUTH_CACHE_SIZE, ttl=settings().ADMIN_AUTH_CACHE_TTL)
+
+
+def _session_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def invalidate_user_sessions(*user_ids: t.Union[int, str]):
+    user_ids = {int(one) for one in user_ids}
+    session_cache.delete_if(lambda key, value: value[0] in user_ids)
+
+
+@post_save(models.User)
+async def _invalidate_saved_user_sessions(sender, instance: models.User, created, using_db, update_fields):
+    invalidate_user_sessions(instance.pk)
+
+
+@post_delete(models.User)
+async def _invalidate_deleted_user_sessions(sender, instance: models.User, using_db):
+    invalidate_user_sessions(instance.pk)
 
 
 class EmailAndPasswordProvider(AuthProvider):
@@ -41,6 +71,8 @@ class EmailAndPasswordProvider(AuthProvider):
             request: Request,
             response: Response,
     ) -> Response:
+        await throttling.admin_login.check(username, request)
+
         user = await models.User.get_or_none(email=username)
         if user is None:
             raise LoginFailed("Invalid username or password")
@@ -48,25 +80,58 @@ class EmailAndPasswordProvider(AuthProvider):
         if user.role != models.User.Role.SUPER_ADMIN:
             raise FormValidationError({"username": "User has no access to admin panel"})
 
-        is_valid = security.verify_password(password, user.password)
+        is_valid = await hashing.verify_password(password, user.password)
         if not is_valid:
             raise LoginFailed("Invalid username or password")
 
+        rehashed_password = await hashing.rehash_password(password, user.password)
+        if rehashed_password is not None:
+            user.password = rehashed_password
+            await user.save(update_fields=["password"])
+
         timezone: str = (await request.form()).get("timezone", "UTC")
         request.session.update({
-            "token": security.Authorize().create_access_token(user.id),
+            "token": security.Authorize().create_user_access_token(user),
             "timezone": timezone,  # store user timezone on initial login
         })
         return response
 
+    async def render_login(self, request: Request, admin: BaseAdmin) -> Response:
+        try:
+            return await super().render_login(request, admin)
+        except throttling.Throttled as e:
+            return admin.templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Too many login attempts, try again later", "_is_login_path": True},
+                status_code=e.status_code,
+                headers=e.headers,
+            )
+
     async def is_authenticated(self, request) -> bool:
         token = request.session.get("token", None)
 
         if token is None:
             return False
 
+        key = _session_key(token)
+        cached = session_cache.get(key)
+
+        if cached is not None:
+            user_id, token_version = cached
+            # Shared user cache is invalidated for all workers on save
+            user = await security.user_cache.get_or_load(user_id)
+
+            if user is None or user.role != models.User.Role.SUPER_ADMIN or user.token_version != token_version:
+                session_cache.delete(key)
+                return False
+
+            request.state.user = user
+            return True
+
+        authorize = security.Authorize(request)
+
         try:
-            user = await security.Authorize(request).user_or_401(strategy=security.Authorize.Strategy.SESSION)
+            user = await authorize.user_or_401(strategy=security.Authorize.Strategy.SESSION)
         except HTTPException as e:
             if e.status_code == 401:
                 return False
@@ -77,6 +142,15 @@ class EmailAndPasswordProvider(AuthProvider):
             return False
 
         request.state.user = user
+        ttl = session_cache.ttl
+        exp = authorize.get_raw_jwt().get("exp")
+
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+
+        if ttl > 0:
+            session_cache.set(key, (user.pk, user.token_version), ttl=ttl)
+
         return True
 
     def get_admin_user(self, request: Request) -> AdminUser:
@@ -84,5 +158,10 @@ class EmailAndPasswordProvider(AuthProvider):
         return AdminUser(username=user.email)
 
     async def logout(self, request: Request, response: Response) -> Response:
+        token = request.session.get("token", None)
+
+        if token is not None:
+            session_cache.delete(_session_key(token))
+
         request.session.clear()
         return response
@@ -8,7 +8,7 @@ from tortoise import Model
 from tortoise.exceptions import OperationalError
 
 import models
-from core import security
+from core import hashing
 
 
 def extract_fields(
@@ -96,7 +96,7 @@ async def create_superadmin(email, password):
     Utility to create superadmin if not exists
     :return:
     """
-    password = security.hash_password(password)
+    password = await hashing.hash_password(password)
 
     try:
         await models.User.create(email=email, password=password, role=models.User.Role.SUPER_ADMIN)
@@ -1,8 +1,13 @@
+import typing as t
+
+from fastapi import Request
 from starlette_admin import fields
 
 import models
+from admin.auth import invalidate_user_sessions
 from admin.fields import ContainerField, DateField, DateTimeField, EnumField
 from admin.views.base import TortoiseModelView
+from core import security
 from translations import lazy_gettext as _
 
 
@@ -38,3 +43,19 @@ class UserView(TortoiseModelView):
         queryset = super().get_queryset(request)
         queryset = queryset.select_related("country")
         return queryset
+
+    async def edit(self, request: Request, pk: int, data: t.Dict[str, t.Any]) -> models.User:
+        user = await self.find_by_pk(request, pk)
+
+        # Role is part of access token claims, so tokens issued with previous role have to be invalidated
+        if data.get("role") and models.User.Role(data["role"]) != user.role:
+            data["token_version"] = user.token_version + 1
+
+        return await super().edit(request, pk, data)
+
+    async def delete(self, request: Request, pks: t.List[int]) -> t.Optional[int]:
+        # Bulk delete bypasses model signals, so cached users have to be dropped explicitly
+        deleted_count = await super().delete(request, pks)
+        await security.user_cache.invalidate(*pks)
+        invalidate_user_sessions(*pks)
+        return deleted_count
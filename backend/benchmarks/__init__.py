@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks, run as modules from backend folder, e.g. `python -m benchmarks.jwt_cache`
+"""
@@ -0,0 +1,121 @@
+"""
+Camp search latency: icontains over name and location vs. full-text search by indexed search_document
+
+Runs against the database from settings with migrations applied (search_document column and index),
+seeded rows are deleted afterwards unless --keep is passed
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+import typer
+from tortoise import Tortoise
+
+import db
+import models
+import schemas.camps
+import services.camps
+from db.routing import PRIMARY
+
+cli = typer.Typer()
+
+SEED_PREFIX = "benchmark-camp-search"
+
+WORDS = [
+    "lake", "forest", "mountain", "river", "scout", "summer", "winter", "hiking", "canoe", "survival",
+    "озеро", "ліс", "гори", "річка", "пластуни", "літо", "зима", "похід", "байдарки", "виживання",
+]
+LOCATIONS = ["Shatsk", "Carpathians", "Polissia", "Dnipro", "Карпати", "Поділля", "Волинь", "Полісся"]
+
+QUERIES = ["lake", "Carpathians", "canoe survival", "похід гори", "байдар", "nonexistent"]
+
+
+async def seed(count: int, batch_size: int = 20000):
+    client = Tortoise.get_connection(PRIMARY)
+    random.seed(0)
+    columns = ["created_at", "name", "location", "description"]
+
+    for start in range(0, count, batch_size):
+        records = [
+            (
+                datetime.now(timezone.utc),
+                f"{SEED_PREFIX} {' '.join(random.sample(WORDS, 2))} {index}",
+                random.choice(LOCATIONS),
+                # Mostly filler vocabulary, so topic words are selective as in real descriptions
+                " ".join([*random.sample(WORDS, 2), *(f"word{random.randrange(5000)}" for _ in range(60))]),
+            )
+            for index in range(start, min(start + batch_size, count))
+        ]
+
+        async with client.acquire_connection() as connection:
+            await connection.copy_records_to_table("camp", records=records, columns=columns)
+
+    # Moves new rows from GIN pending list to the index, as autovacuum would
+    await client.execute_script('VACUUM ANALYZE "camp"')
+
+
+def icontains_search(search: str) -> models.QuerySet:
+    # Filter before search_document was added
+    return models.Camp.filter(
+        models.Q(location__icontains=search, name__icontains=search, join_type=models.Q.OR)
+    ).order_by("name")
+
+
+def text_search(search: str) -> models.QuerySet:
+    service = services.camps.Filter()
+    queryset = service.search(models.Camp.all(), search)
+    return queryset.order_by(*service.format_order([schemas.camps.FilterOrder.RANK], is_ranked=True), "name")
+
+
+async def measure(queryset: models.QuerySet, repeat: int) -> float:
+    started_at = time.perf_counter()
+
+    for _ in range(repeat):
+        await queryset.limit(20).values("id")
+        await queryset.count()
+
+    return (time.perf_counter() - started_at) / repeat * 1000
+
+
+async def plan(queryset: models.QuerySet) -> str:
+    client = Tortoise.get_connection(PRIMARY)
+    rows = await client.execute_query_dict(f"EXPLAIN (FORMAT JSON) {queryset.count().sql()}")
+    node = json.loads(rows[0]["QUERY PLAN"])[0]["Plan"]
+
+    while node.get("Plans") and node["Node Type"] not in ("Seq Scan", "Bitmap Heap Scan", "Index Scan"):
+        node = node["Plans"][0]
+
+    return node["Node Type"]
+
+
+async def run(camps: int, repeat: int, keep: bool):
+    await db.init_db()
+
+    try:
+        if not await models.Camp.filter(name__startswith=SEED_PREFIX).exists():
+            await seed(camps)
+
+        for search in QUERIES:
+            icontains_ms = await measure(icontains_search(search), repeat)
+            text_search_ms = await measure(text_search(search), repeat)
+            matched = await text_search(search).count()
+            typer.echo(
+                f"{search!r:>18} icontains: {icontains_ms:7.1f} ms ({await plan(icontains_search(search))}), "
+                f"full-text: {text_search_ms:7.1f} ms ({await plan(text_search(search))}), {matched} matched"
+            )
+    finally:
+        if not keep:
+            await models.Camp.filter(name__startswith=SEED_PREFIX).delete()
+
+        await db.close_db()
+
+
+@cli.command()
+def main(camps: int = 100_000, repeat: int = 5, keep: bool = False):
+    asyncio.run(run(camps, repeat, keep))
+
+
+if __name__ == "__main__":
+    cli()
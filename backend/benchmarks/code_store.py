@@ -0,0 +1,48 @@
+"""
+Throughput of verification codes issued and consumed per second against FakeRedis nodes or real Redis from settings
+"""
+import asyncio
+import time
+
+import typer
+from fakeredis.aioredis import FakeRedis
+
+from core import redis
+from core.hash_ring import HashRing
+
+cli = typer.Typer()
+
+
+async def run(count: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def issue(user_id: int) -> str:
+        async with semaphore:
+            return await redis.generate_code(user_id, redis.CodeType.FORGOT_PASSWORD)
+
+    async def consume(code: str):
+        async with semaphore:
+            return await redis.consume_code(code, redis.CodeType.FORGOT_PASSWORD)
+
+    started_at = time.perf_counter()
+    codes = await asyncio.gather(*(issue(one) for one in range(count)))
+    issued_at = time.perf_counter()
+    user_ids = await asyncio.gather(*(consume(one) for one in codes))
+    consumed_at = time.perf_counter()
+
+    assert user_ids == [str(one) for one in range(count)]
+    typer.echo(f"  issued: {count / (issued_at - started_at):.0f} codes/s")
+    typer.echo(f"consumed: {count / (consumed_at - issued_at):.0f} codes/s")
+
+
+@cli.command()
+def main(count: int = 10000, concurrency: int = 50, fake: bool = True, fake_nodes: int = 1):
+    if fake:
+        redis._ring = HashRing(f"fake-{index}" for index in range(fake_nodes))
+        redis._connections.update({node: FakeRedis(decode_responses=True) for node in redis._ring.nodes})
+
+    asyncio.run(run(count, concurrency))
+
+
+if __name__ == "__main__":
+    cli()
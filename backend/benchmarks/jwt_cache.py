@@ -0,0 +1,45 @@
+"""
+Per-request cost of access token verification with and without decoded token cache
+"""
+import timeit
+
+import typer
+from starlette.requests import Request
+
+from core import security
+
+cli = typer.Typer()
+
+
+def make_request(token: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"authorization", f"Bearer {token}".encode("utf-8"))],
+    })
+
+
+def authorize_once(token: str):
+    authorize = security.Authorize(make_request(token))
+    authorize.jwt_required()
+    authorize.get_jwt_subject()
+
+
+def uncached(token: str):
+    security.token_cache.clear()
+    authorize_once(token)
+
+
+@cli.command()
+def main(number: int = 20000, repeat: int = 5):
+    security.configure_jwt(None)  # type: ignore
+    token = security.Authorize().create_access_token(1)
+
+    for title, func in (("uncached", uncached), ("cached", authorize_once)):
+        best = min(timeit.repeat(lambda: func(token), number=number, repeat=repeat))
+        typer.echo(f"{title:>10}: {best / number * 1e6:.2f} us per request")
+
+
+if __name__ == "__main__":
+    cli()
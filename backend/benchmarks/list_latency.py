@@ -0,0 +1,101 @@
+"""
+Latency of /camps and /users with count and page queries run one after another vs. concurrently
+
+Runs against the database from settings, seeded rows are deleted afterwards
+"""
+import asyncio
+import statistics
+import time
+from unittest.mock import patch
+
+import typer
+from httpx import AsyncClient
+
+import db
+import models
+from core import security
+from db.client import Connection
+from main import app
+
+cli = typer.Typer()
+
+SEED_PREFIX = "benchmark-list-latency"
+
+
+async def sequentially(*coroutines) -> list:
+    return [await one for one in coroutines]
+
+
+def with_latency(latency: float):
+    execute = Connection._execute
+
+    async def slow_execute(self, *args, **kwargs):
+        # Emulates network round trip to the database
+        await asyncio.sleep(latency)
+        return await execute(self, *args, **kwargs)
+
+    return patch.object(Connection, "_execute", slow_execute)
+
+
+async def seed(count: int) -> int:
+    await models.User.bulk_create([models.User(email=f"{SEED_PREFIX}-{one}@example.com") for one in range(count)])
+    await models.Camp.bulk_create([
+        models.Camp(name=f"{SEED_PREFIX}-{one}", location="", description="x" * 1024)
+        for one in range(count)
+    ])
+    user = await models.User.get(email=f"{SEED_PREFIX}-0@example.com")
+    return user.id
+
+
+async def cleanup():
+    await models.User.filter(email__startswith=SEED_PREFIX).delete()
+    await models.Camp.filter(name__startswith=SEED_PREFIX).delete()
+
+
+async def measure(client: AsyncClient, url: str, requests: int) -> list:
+    latencies = []
+
+    for _ in range(requests):
+        started_at = time.perf_counter()
+        resp = await client.get(url, params={"page_size": 50, "count": "EXACT"})
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        assert resp.status_code == 200, resp.text
+
+    return latencies
+
+
+async def run_requests(client_token: str, requests: int):
+    async with AsyncClient(app=app, base_url="http://benchmark") as client:
+        client.headers["Authorization"] = f"Bearer {client_token}"
+
+        for url in ("/camps", "/users"):
+            for mode, helper in (("sequential", sequentially), ("concurrent", db.concurrently)):
+                with patch.object(db, "concurrently", helper):
+                    await measure(client, url, 5)
+                    latencies = await measure(client, url, requests)
+
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                typer.echo(f"{url:>7} {mode:>10}: mean {statistics.mean(latencies):.2f} ms, p95 {p95:.2f} ms")
+
+
+async def run(requests: int, seed_count: int, latency_ms: float):
+    await db.init_db()
+
+    try:
+        user_id = await seed(seed_count)
+        token = security.Authorize().create_access_token(user_id)
+
+        with with_latency(latency_ms / 1000):
+            await run_requests(client_token=token, requests=requests)
+    finally:
+        await cleanup()
+        await db.close_db()
+
+
+@cli.command()
+def main(requests: int = 200, seed: int = 1000, latency_ms: float = 0):
+    asyncio.run(run(requests, seed, latency_ms))
+
+
+if __name__ == "__main__":
+    cli()
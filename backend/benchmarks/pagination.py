@@ -0,0 +1,72 @@
+"""
+Cost of building a page of /camps results from full model instances vs. projected columns (in-memory SQLite)
+"""
+import asyncio
+import time
+
+import typer
+from tortoise import Tortoise
+
+import models
+import schemas.camps
+import schemas.utils
+from services import utils
+
+cli = typer.Typer()
+
+
+async def seed(camps: int, description_length: int):
+    countries = [
+        await models.Country.create(name_ukr=f"Country {one}", name_orig=f"Country {one}")
+        for one in range(10)
+    ]
+    await models.Camp.bulk_create([
+        models.Camp(
+            name=f"Camp {one}",
+            location="Lake",
+            description="x" * description_length,
+            country=countries[one % len(countries)] if one % 5 else None,
+        )
+        for one in range(camps)
+    ])
+
+
+async def from_models(queryset: models.QuerySet) -> list:
+    return [schemas.camps.FilterItemResponse.from_orm(one) for one in await queryset.select_related("country")]
+
+
+async def from_projection(queryset: models.QuerySet) -> list:
+    schema = schemas.camps.FilterItemResponse
+    return [utils.build_result(one, schema) for one in await utils.fetch_rows(queryset, schema)]
+
+
+async def run(camps: int, page_size: int, iterations: int, description_length: int):
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["models"]})
+    await Tortoise.generate_schemas()
+    schemas.utils.init_schemas()
+
+    try:
+        await seed(camps, description_length)
+        queryset = models.Camp.all().order_by("-created_at", "id").limit(page_size)
+        expected = [one.dict() for one in await from_models(queryset)]
+        assert [one.dict() for one in await from_projection(queryset)] == expected
+
+        for name, build_page in (("models", from_models), ("projection", from_projection)):
+            started_at = time.perf_counter()
+
+            for _ in range(iterations):
+                await build_page(queryset)
+
+            elapsed = time.perf_counter() - started_at
+            typer.echo(f"{name:>10}: {elapsed / iterations * 1000:.2f} ms per page of {page_size}")
+    finally:
+        await Tortoise.close_connections()
+
+
+@cli.command()
+def main(camps: int = 1000, page_size: int = 50, iterations: int = 500, description_length: int = 1024):
+    asyncio.run(run(camps, page_size, iterations, description_length))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,122 @@
+"""
+User search latency: icontains over names vs. trigram-indexed search_text on a seeded users table
+
+Runs against the database from settings with migrations applied (pg_trgm and search_text index),
+seeded rows are deleted afterwards unless --keep is passed
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+
+import typer
+from tortoise import Tortoise
+
+import db
+import models
+import services.users
+from core import transliteration
+from db.routing import PRIMARY
+
+cli = typer.Typer()
+
+SEED_PREFIX = "benchmark-user-search"
+
+FIRST_NAMES = [
+    "Олександр", "Олена", "Юрій", "Ірина", "Євген", "Марія", "Андрій", "Наталія", "Богдан", "Соломія",
+    "Oleksandr", "Olena", "Yurii", "Iryna", "Yevhen", "Mariia", "Andrii", "Nataliia", "Bohdan", "Solomiia",
+]
+LAST_NAMES = [
+    "Шевченко", "Коваленко", "Бондаренко", "Ткаченко", "Кравченко", "Щербак", "Мельник", "Їжакевич",
+    "Shevchenko", "Kovalenko", "Bondarenko", "Tkachenko", "Kravchenko", "Shcherbak", "Melnyk", "Yizhakevych",
+]
+NICKNAMES = ["", "", "Сокіл", "Вовк", "Lys", "Bober", "Їжак", "Ptakh"]
+
+QUERIES = ["Юрій", "yurii", "щербак", "shcherbak", "Сокіл", "kovalenko olena", "nonexistent"]
+
+
+async def seed(count: int, batch_size: int = 50000):
+    client = Tortoise.get_connection(PRIMARY)
+    random.seed(0)
+    columns = [
+        "created_at", "email", "is_email_verified", "first_name", "last_name", "nickname", "role", "token_version",
+        "search_text",
+    ]
+
+    for start in range(0, count, batch_size):
+        records = []
+
+        for index in range(start, min(start + batch_size, count)):
+            user = models.User(
+                first_name=random.choice(FIRST_NAMES),
+                last_name=random.choice(LAST_NAMES),
+                nickname=f"{random.choice(NICKNAMES)}{index % 1000 or ''}",
+            )
+            records.append((
+                datetime.now(timezone.utc), f"{SEED_PREFIX}-{index}@example.com", False,
+                user.first_name, user.last_name, user.nickname, models.User.Role.BASE.value, 0,
+                user.format_search_text(),
+            ))
+
+        async with client.acquire_connection() as connection:
+            await connection.copy_records_to_table("user", records=records, columns=columns)
+
+    # Moves new rows from GIN pending list to the index, as autovacuum would
+    await client.execute_script('VACUUM ANALYZE "user"')
+
+
+def icontains_search(search: str) -> models.QuerySet:
+    # Filter before search_text was added
+    return models.User.filter(models.Q(
+        first_name__icontains=search,
+        last_name__icontains=search,
+        nickname__icontains=search,
+        join_type=models.Q.OR,
+    )).order_by("-created_at")
+
+
+def trigram_search(search: str) -> models.QuerySet:
+    queryset = services.users.Filter().search(models.User.all(), search)
+    return queryset.order_by("-search_rank", "-created_at")
+
+
+async def measure(queryset: models.QuerySet, repeat: int) -> float:
+    started_at = time.perf_counter()
+
+    for _ in range(repeat):
+        await queryset.limit(20).values("id")
+        await queryset.count()
+
+    return (time.perf_counter() - started_at) / repeat * 1000
+
+
+async def run(users: int, repeat: int, keep: bool):
+    await db.init_db()
+
+    try:
+        if not await models.User.filter(email__startswith=SEED_PREFIX).exists():
+            await seed(users)
+
+        for search in QUERIES:
+            icontains_ms = await measure(icontains_search(search), repeat)
+            trigram_ms = await measure(trigram_search(search), repeat)
+            matched = await trigram_search(search).count()
+            normalized = transliteration.normalize(search)
+            typer.echo(
+                f"{search!r:>18} -> {normalized!r:<18} icontains: {icontains_ms:8.1f} ms, "
+                f"trigram: {trigram_ms:8.1f} ms, {matched} matched"
+            )
+    finally:
+        if not keep:
+            await models.User.filter(email__startswith=SEED_PREFIX).delete()
+
+        await db.close_db()
+
+
+@cli.command()
+def main(users: int = 1_000_000, repeat: int = 5, keep: bool = False):
+    asyncio.run(run(users, repeat, keep))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,241 @@
+"""
+Caching helpers: in-process LRU with TTL and model instance cache optionally backed by Redis
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from datetime import date, datetime
+from enum import Enum
+
+from tortoise.models import Model
+
+from core import metrics, redis
+
+MODEL = t.TypeVar("MODEL", bound=Model)
+
+_MISSING = object()
+_FAILED = object()
+
+INVALIDATE_RETRY_DELAY = 1  # sec., doubled after every failed attempt
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Bounded in-process cache: least recently used entries are evicted first, expired entries are dropped on access
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[t.Hashable, t.Tuple[float, t.Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+
+            if item is _MISSING:
+                return default
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: t.Hashable, value: t.Any, ttl: t.Optional[float] = None):
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: t.Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_if(self, predicate: t.Callable[[t.Hashable, t.Any], bool]):
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _json_default(value: t.Any) -> t.Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    if isinstance(value, Enum):
+        return value.value
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ModelCache(t.Generic[MODEL]):
+    """
+    Cache of model rows keyed by primary key
+
+    Rows (not instances) are cached, so every lookup returns a fresh instance which is safe to modify and save.
+    Invalidation reaches only local layer of current worker, so local_ttl bounds how long other workers serve a changed
+    row. Optional Redis layer shares rows between workers for ttl seconds.
+
+    Excluded fields (e.g. secrets) are not cached, instances without them are partial: save() without update_fields
+    raises IncompleteInstanceError, so callers which save the whole instance or read excluded fields use load()
+    """
+    def __init__(
+            self,
+            model: t.Type[MODEL],
+            maxsize: int,
+            ttl: int,
+            use_redis: bool = False,
+            local_ttl: t.Optional[int] = None,
+            exclude: t.Iterable[str] = (),
+    ):
+        self.model = model
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.exclude = frozenset(exclude)
+        self._retries: t.Set[asyncio.Task] = set()
+
+        if local_ttl is None:
+            local_ttl = ttl
+
+        self.local = LRUCache(maxsize=maxsize, ttl=min(local_ttl, ttl))
+
+    def normalize_pk(self, pk: t.Any) -> t.Any:
+        return self.model._meta.pk.to_python_value(pk)
+
+    def redis_key(self, pk: t.Any) -> str:
+        return f"cache:{self.model.__name__}:{pk}"
+
+    def get_projection(self) -> t.Dict[str, str]:
+        """
+        :return: field name -> column of cached fields
+        """
+        projection = self.model._meta.fields_db_projection
+        return {name: column for name, column in projection.items() if name not in self.exclude}
+
+    def to_row(self, instance: MODEL) -> t.Dict[str, t.Any]:
+        return {column: getattr(instance, name) for name, column in self.get_projection().items()}
+
+    def from_row(self, row: t.Dict[str, t.Any]) -> MODEL:
+        return self.model._init_from_db(**row)
+
+    def decode_row(self, raw: str) -> t.Dict[str, t.Any]:
+        fields_map = self.model._meta.fields_map
+        data = json.loads(raw)
+        return {column: fields_map[name].to_python_value(data[column]) for name, column in self.get_projection().items()}
+
+    async def get(self, pk: t.Any) -> t.Optional[MODEL]:
+        pk = self.normalize_pk(pk)
+        row = self.local.get(pk)
+
+        if row is None and self.use_redis:
+            # Redis layer is optional: when it's down, rows are loaded from DB
+            key = self.redis_key(pk)
+            raw = await redis.call(redis.get_connection(key).get, key, node=redis.node_of(key), fallback=None)
+
+            if raw is not None:
+                row = self.decode_row(raw)
+                self.local.set(pk, row)
+
+        if row is None:
+            return None
+
+        return self.from_row(row)
+
+    async def set(self, instance: MODEL) -> t.Dict[str, t.Any]:
+        row = self.to_row(instance)
+        self.local.set(instance.pk, row)
+
+        if self.use_redis:
+            key = self.redis_key(instance.pk)
+            await redis.call(
+                redis.get_connection(key).set,
+                key,
+                json.dumps(row, default=_json_default),
+                ex=self.ttl,
+                node=redis.node_of(key),
+                fallback=None,
+            )
+
+        return row
+
+    async def load(self, pk: t.Any) -> t.Optional[MODEL]:
+        """
+        Load complete instance from primary, bypassing cache
+        :param pk:
+        :return: instance with all fields, including excluded ones
+        """
+        # Tortoise has limited support for pk keyword, so filter by actual pk attribute
+        return await self.model.get_or_none(**{self.model._meta.pk_attr: pk}).using_db(self.model._meta.db)
+
+    async def get_or_load(self, pk: t.Any) -> t.Optional[MODEL]:
+        instance = await self.get(pk)
+
+        if instance is None:
+            # Misses follow invalidation on save, so they are read from primary: row of a lagging replica
+            # would be cached for the whole ttl
+            instance = await self.load(pk)
+
+            if instance is not None:
+                # Same fields as on hit, e.g. without excluded ones
+                instance = self.from_row(await self.set(instance))
+
+        return instance
+
+    async def invalidate(self, *pks: t.Any):
+        pks = [self.normalize_pk(one) for one in pks]
+
+        for pk in pks:
+            self.local.delete(pk)
+
+        if self.use_redis and pks:
+            keys = [self.redis_key(one) for one in pks]
+
+            if await redis.delete(*keys, fallback=_FAILED) is _FAILED:
+                # Otherwise stale rows are served from Redis for up to ttl seconds once it's back
+                task = asyncio.create_task(self._retry_invalidate(keys))
+                self._retries.add(task)
+                task.add_done_callback(self._retries.discard)
+
+    async def _retry_invalidate(self, keys: t.List[str]):
+        """
+        Delete keys from Redis until it succeeds or keys expire by themselves
+        """
+        metrics.counter("cache.invalidate.failed").inc()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.ttl
+        delay = INVALIDATE_RETRY_DELAY
+
+        while loop.time() + delay < deadline:
+            await asyncio.sleep(delay)
+
+            if await redis.delete(*keys, fallback=_FAILED) is not _FAILED:
+                return
+
+            delay *= 2
+
+        logger.error("Failed to invalidate %s in Redis, stale rows expire within %s sec.", keys, self.ttl)
+
+    def clear(self):
+        self.local.clear()
@@ -0,0 +1,120 @@
+"""
+Circuit breaker for calls to external services which may become slow or unavailable
+"""
+import asyncio
+import time
+import typing as t
+from enum import Enum
+
+from core import metrics
+
+T = t.TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """
+    Call was rejected without trying because the circuit is open
+    """
+    def __init__(self, name: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Circuit {name} is open, retry after {retry_after:.1f}s")
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures (errors and timeouts) of guarded calls
+
+    After failure_threshold failures the circuit opens and calls fail fast for reset_timeout seconds.
+    Then single probe call is let through (half-open): success closes the circuit, failure opens it again
+    """
+    class State(str, Enum):
+        CLOSED = "CLOSED"
+        OPEN = "OPEN"
+        HALF_OPEN = "HALF_OPEN"
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int,
+            reset_timeout: float,
+            call_timeout: t.Optional[float] = None,
+            exceptions: t.Tuple[t.Type[BaseException], ...] = (Exception,),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self.exceptions = exceptions
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at: t.Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> "CircuitBreaker.State":
+        if self.opened_at is None:
+            return self.State.CLOSED
+
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.State.HALF_OPEN
+
+        return self.State.OPEN
+
+    @property
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def check(self):
+        """
+        Raise CircuitOpen if call would be rejected right now
+        """
+        state = self.state
+
+        if state == self.State.OPEN or (state == self.State.HALF_OPEN and self._probing):
+            metrics.counter(f"{self.name}.circuit.rejected").inc()
+            raise CircuitOpen(self.name, self.retry_after)
+
+    async def call(self, func: t.Callable[..., t.Awaitable[T]], *args, **kwargs) -> T:
+        """
+        Await func(*args, **kwargs) within call_timeout and record its outcome
+        :raise CircuitOpen: if the circuit is open or another probe is in progress
+        :raise asyncio.TimeoutError: if the call took longer than call_timeout
+        """
+        self.check()
+        is_probe = self.state == self.State.HALF_OPEN
+
+        if is_probe:
+            self._probing = True
+
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=self.call_timeout)
+        except (asyncio.TimeoutError, *self.exceptions):
+            self.record_failure()
+            raise
+        else:
+            self.record_success()
+            return result
+        finally:
+            if is_probe:
+                self._probing = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            metrics.counter(f"{self.name}.circuit.closed").inc()
+
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        metrics.counter(f"{self.name}.circuit.failures").inc()
+
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            # Failed probe restarts reset timeout
+            self.opened_at = time.monotonic()
+            metrics.counter(f"{self.name}.circuit.opened").inc()
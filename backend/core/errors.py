@@ -4,6 +4,7 @@ List of custom returned API error texts
 
 INVALID_CODE = "Invalid code"
 INVALID_COUNTRY_ID = "Invalid country_id"
+INVALID_CURSOR = "Invalid cursor"
 INVALID_LOGIN = "Invalid email or password"
 INVALID_PASSWORD = "Invalid password"
 UNAUTHORIZED = "Unauthorized"
@@ -11,3 +12,5 @@ BAD_REQUEST = "Bad request"
 NOT_FOUND = "Not found"
 PERMISSION_DENIED = "Permission denied"
 DUPLICATE_EMAIL = "Duplicate email"
+SERVICE_UNAVAILABLE = "Service unavailable"
+TOO_MANY_REQUESTS = "Too many requests"
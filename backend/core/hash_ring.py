@@ -0,0 +1,71 @@
+"""
+Consistent hashing of keys to nodes: adding or removing a node moves only keys of that node
+"""
+import bisect
+import hashlib
+import typing as t
+
+
+def _hash(value: str) -> int:
+    # Stable across processes and Python versions, unlike built-in hash()
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def hash_slot(key: str) -> str:
+    """
+    Part of the key which is hashed: content of the first non-empty {...} if any, as Redis Cluster hash tags
+    """
+    start = key.find("{")
+
+    if start != -1:
+        end = key.find("}", start + 1)
+
+        if end > start + 1:
+            return key[start + 1:end]
+
+    return key
+
+
+class HashRing:
+    """
+    Every node is placed on the ring in `replicas` points, key belongs to the node of the first point after its hash
+    """
+    def __init__(self, nodes: t.Iterable[str] = (), replicas: int = 160):
+        self.replicas = replicas
+        self.nodes: t.Set[str] = set()
+        self._points: t.List[int] = []
+        self._owners: t.Dict[int, str] = {}
+
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+
+        self.nodes.add(node)
+
+        for index in range(self.replicas):
+            point = _hash(f"{node}#{index}")
+            # Skip (practically impossible) collision with a point of another node
+            if point not in self._owners:
+                self._owners[point] = node
+                bisect.insort(self._points, point)
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+
+        self.nodes.remove(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: self._owners[point] for point in self._points}
+
+    def get_node(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("Hash ring has no nodes")
+
+        index = bisect.bisect(self._points, _hash(hash_slot(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
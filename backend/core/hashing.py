@@ -0,0 +1,102 @@
+"""
+Async wrappers around bcrypt hashing which run it in a bounded worker pool instead of the event loop
+"""
+import asyncio
+import time
+import typing as t
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from conf import settings
+from core import errors, metrics, security
+
+
+def _timed_call(func: t.Callable, *args) -> t.Tuple[float, float, t.Any]:
+    # time.monotonic is system-wide, so timestamps are comparable across worker processes
+    started_at = time.monotonic()
+    result = func(*args)
+    return started_at, time.monotonic(), result
+
+
+class HashingPool:
+    """
+    Executor with bounded amount of pending jobs
+
+    Jobs which don't fit into max_workers + max_queue are rejected with 503 instead of piling up
+    """
+    def __init__(self, executor_type: str, max_workers: int, max_queue: int):
+        self.executor_type = executor_type
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self._executor: t.Optional[Executor] = None
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def get_executor(self) -> Executor:
+        if self._executor is None:
+            executor_class = ProcessPoolExecutor if self.executor_type == "process" else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=self.max_workers)
+
+        return self._executor
+
+    async def run(self, func: t.Callable, *args) -> t.Any:
+        if self.pending >= self.capacity:
+            metrics.counter("hashing.rejected").inc()
+            raise HTTPException(status_code=503, detail=errors.SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+        self.pending += 1
+        submitted_at = time.monotonic()
+
+        try:
+            loop = asyncio.get_running_loop()
+            started_at, finished_at, result = await loop.run_in_executor(
+                self.get_executor(), _timed_call, func, *args
+            )
+        finally:
+            # Also when awaiting task is cancelled, e.g. on client disconnect, so slots are never leaked
+            self.pending -= 1
+
+        metrics.timer("hashing.queue_wait").observe(started_at - submitted_at)
+        metrics.timer("hashing.hash_time").observe(finished_at - started_at)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = HashingPool(
+    executor_type=settings().HASHING_EXECUTOR,
+    max_workers=settings().HASHING_MAX_WORKERS,
+    max_queue=settings().HASHING_MAX_QUEUE,
+)
+
+
+async def hash_password(password: str) -> str:
+    return await pool.run(security.hash_password, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await pool.run(security.verify_password, plain_password, hashed_password)
+
+
+async def rehash_password(plain_password: str, hashed_password: str) -> t.Optional[str]:
+    """
+    Rehash already verified password if its cost factor differs from configured one
+    :param plain_password:
+    :param hashed_password:
+    :return: new hash or None if current one is up-to-date
+    """
+    if not security.needs_rehash(hashed_password):
+        return None
+
+    return await hash_password(plain_password)
+
+
+def shutdown():
+    pool.shutdown()
@@ -0,0 +1,58 @@
+"""
+Minimal in-process metrics: counters and timing summaries
+"""
+import threading
+import typing as t
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        return {"value": self.value}
+
+
+class Timer:
+    """
+    Summary of observed durations in seconds
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "total": self.total, "avg": avg, "max": self.max}
+
+
+_registry: t.Dict[str, t.Union[Counter, Timer]] = {}
+
+
+def counter(name: str) -> Counter:
+    return _registry.setdefault(name, Counter())
+
+
+def timer(name: str) -> Timer:
+    return _registry.setdefault(name, Timer())
+
+
+def snapshot() -> t.Dict[str, t.Dict[str, t.Any]]:
+    return {name: one.snapshot() for name, one in sorted(_registry.items())}
+
+
+def reset():
+    _registry.clear()
@@ -1,13 +1,26 @@
 # See issue with stubs https://github.com/redis/redis-py/issues/2249
 # Plugin location https://www.jetbrains.com/help/pycharm/directories-used-by-the-ide-to-store-settings-caches-plugins-and-logs.html#301b9a53
+import asyncio
+import functools
+import logging
+import math
 import secrets
+import time
 import typing as t
+from collections import defaultdict
 from enum import Enum
+from urllib.parse import urlsplit
 
 from fakeredis.aioredis import FakeRedis
+from fastapi import HTTPException
 from redis import asyncio as aioredis
 
 from conf import settings
+from core import errors, metrics
+from core.circuit_breaker import CircuitBreaker, CircuitOpen
+from core.hash_ring import HashRing
+
+T = t.TypeVar("T")
 
 
 class CodeType(str, Enum):
@@ -15,51 +28,403 @@ class CodeType(str, Enum):
     FORGOT_PASSWORD = "FORGOT_PASSWORD"
 
 
-_redis_class = aioredis.Redis
+CODE_ISSUE_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+_ring: t.Optional[HashRing] = None
+_connections: t.Dict[str, aioredis.Redis] = {}
+_breakers: t.Dict[str, CircuitBreaker] = {}
+
+
+def get_node_urls() -> t.List[str]:
+    if settings().REDIS_NODES:
+        return settings().REDIS_NODES
+
+    return [f"redis://{settings().REDIS_HOST}:{settings().REDIS_PORT}/{settings().REDIS_DB}"]
+
+
+def node_name(url: str) -> str:
+    # Name is hashed to place the node on the ring, so it mustn't depend on credentials or options
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}{parts.path or '/0'}"
+
+
+def create_connection(url: str) -> aioredis.Redis:
+    if settings().TEST:
+        # Every FakeRedis instance has its own server, i.e. acts as a separate node
+        return FakeRedis(decode_responses=True, db=settings().REDIS_DB)
+
+    # Password from settings is used unless the URL contains its own one
+    pool = aioredis.BlockingConnectionPool.from_url(
+        url,
+        password=settings().REDIS_PASSWORD,
+        decode_responses=True,
+        max_connections=settings().REDIS_MAX_CONNECTIONS,
+        timeout=settings().REDIS_POOL_TIMEOUT,
+        socket_connect_timeout=settings().REDIS_CONNECT_TIMEOUT,
+        socket_timeout=settings().REDIS_READ_TIMEOUT,
+        health_check_interval=settings().REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_timeout=settings().REDIS_RETRY_ON_TIMEOUT,
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+def get_ring() -> HashRing:
+    global _ring
+
+    if _ring is None:
+        _ring = HashRing((node_name(url) for url in get_node_urls()), replicas=settings().REDIS_RING_REPLICAS)
+
+    return _ring
+
+
+def get_node_connection(node: str) -> aioredis.Redis:
+    """
+    Return shared Redis client of the node, creating its connection pool on first use
+    """
+    if node not in _connections:
+        urls = {node_name(url): url for url in get_node_urls()}
+        _connections[node] = create_connection(urls[node])
+
+    return _connections[node]
+
+
+def node_of(key: str) -> str:
+    """
+    Return name of the node which owns the key, see core.hash_ring.hash_slot() to keep keys together
+    """
+    return get_ring().get_node(key)
+
+
+def get_connection(key: str) -> aioredis.Redis:
+    """
+    Return Redis client of the node which owns the key
+    """
+    return get_node_connection(node_of(key))
 
-if settings().TEST:
-    _redis_class = FakeRedis
 
-connection = _redis_class(
-    host=settings().REDIS_HOST,
-    port=settings().REDIS_PORT,
-    password=settings().REDIS_PASSWORD,
-    decode_responses=True,
-    db=settings().REDIS_DB,
-)
+def get_connections() -> t.Dict[str, aioredis.Redis]:
+    """
+    Return Redis clients of all nodes, e.g. to SCAN or flush them
+    """
+    return {node: get_node_connection(node) for node in sorted(get_ring().nodes)}
+
+
+def group_by_node(keys: t.Iterable[str]) -> t.Dict[str, t.List[str]]:
+    """
+    Split keys of multi-key command into per-node batches
+    """
+    ring = get_ring()
+    groups = defaultdict(list)
+
+    for key in keys:
+        groups[ring.get_node(key)].append(key)
+
+    return dict(groups)
+
+
+async def init_redis_connection():
+    for node, connection in get_connections().items():
+        try:
+            await connection.ping()
+        except aioredis.RedisError as e:
+            # Connections are established lazily, so the app is still able to start and retry later
+            logger.warning("Redis node %s is not accessible on startup: %s", node, e)
 
 
 async def close_redis_connection():
-    await connection.close()
+    global _ring
 
+    connections = list(_connections.values())
+    _connections.clear()
+    _ring = None
 
-async def _create_unique_code(code_type: CodeType) -> str:
-    code = secrets.token_urlsafe(8)
-    token = f"{code_type}:{code}"
+    for connection in connections:
+        await connection.close()
+        await connection.connection_pool.disconnect()
 
-    if await connection.exists(token):
-        return await _create_unique_code(code_type)
 
-    return code
+def _pool_stats(pool: aioredis.ConnectionPool) -> t.Dict[str, t.Any]:
+    if isinstance(pool, aioredis.BlockingConnectionPool):
+        # Queue is pre-filled with None placeholders for connections which are not created yet
+        idle = sum(1 for one in pool.pool._queue if one is not None)
+        return {
+            "max_connections": pool.max_connections,
+            "created": len(pool._connections),
+            "in_use": len(pool._connections) - idle,
+            "idle": idle,
+            "waiting": len(pool.pool._getters),
+        }
 
+    return {
+        "max_connections": pool.max_connections,
+        "created": pool._created_connections,
+        "in_use": len(pool._in_use_connections),
+        "idle": len(pool._available_connections),
+        "waiting": 0,
+    }
 
-async def generate_code(user_id, code_type: CodeType) -> str:
-    code = await _create_unique_code(code_type)
-    token = f"{code_type}:{code}"
 
-    ex = None
+def pool_stats() -> t.Dict[str, t.Dict[str, t.Any]]:
+    """
+    Usage of connection pools of initialized nodes: created, in use, idle connections and tasks waiting for free one
+    """
+    return {node: _pool_stats(connection.connection_pool) for node, connection in sorted(_connections.items())}
+
+
+class RedisUnavailable(HTTPException):
+    """
+    Redis is down or too slow and caller has no fallback
+    """
+    def __init__(self, retry_after: int = 1):
+        super().__init__(status_code=503, detail=errors.SERVICE_UNAVAILABLE, headers={"Retry-After": str(retry_after)})
+
+
+def get_breaker(node: str) -> CircuitBreaker:
+    """
+    Return circuit breaker of the node, creating it on first use: failing node doesn't cut off keys of the others
+    """
+    if node not in _breakers:
+        # Only connectivity problems trip the circuit, errors like WRONGTYPE are bugs and are raised as is
+        _breakers[node] = CircuitBreaker(
+            f"redis.{node}",
+            failure_threshold=settings().REDIS_BREAKER_THRESHOLD,
+            reset_timeout=settings().REDIS_BREAKER_RESET_TIMEOUT,
+            call_timeout=settings().REDIS_COMMAND_TIMEOUT,
+            exceptions=(aioredis.ConnectionError, aioredis.TimeoutError),
+        )
+
+    return _breakers[node]
+
+# Fallback meaning "no fallback": fail with 503
+UNAVAILABLE = object()
+
+
+def _unavailable(node: str) -> RedisUnavailable:
+    return RedisUnavailable(retry_after=max(1, math.ceil(get_breaker(node).retry_after)))
+
+
+def check_available(*keys: str):
+    """
+    Fail fast with 503 while the circuit of a node is open, e.g. before doing work which can't be finished without it
+    :param keys: keys to be used, their nodes are checked; all nodes if keys are not known in advance
+    :return:
+    """
+    nodes = {node_of(key) for key in keys} if keys else get_ring().nodes
+
+    for node in sorted(nodes):
+        try:
+            get_breaker(node).check()
+        except CircuitOpen as e:
+            raise _unavailable(node) from e
+
+
+async def call(
+        func: t.Callable[..., t.Awaitable[T]],
+        *args,
+        node: str,
+        fallback: t.Any = UNAVAILABLE,
+        **kwargs,
+) -> T:
+    """
+    Await Redis operation through the circuit breaker of the node
+    :param func: coroutine function doing one or several Redis commands on the node
+    :param node: node the commands are sent to, see node_of()
+    :param fallback: value to return if the node is down or too slow, 503 is raised if not specified
+    :return:
+    """
+    breaker = get_breaker(node)
+
+    try:
+        return await breaker.call(func, *args, **kwargs)
+    except (CircuitOpen, asyncio.TimeoutError, *breaker.exceptions) as e:
+        if fallback is UNAVAILABLE:
+            raise _unavailable(node) from e
+
+        metrics.counter("redis.fallback").inc()
+        logger.warning("Redis call %s on %s failed, using fallback: %r", getattr(func, "__name__", func), node, e)
+        return fallback
+
+
+def guarded(key: t.Callable[..., str], fallback: t.Any = UNAVAILABLE):
+    """
+    Decorator to run whole coroutine function through the circuit breaker of the node owning its key, see call()
+    :param key: returns the key from arguments of the function
+    :param fallback:
+    :return:
+    """
+    def decorator(func: t.Callable[..., t.Awaitable[T]]) -> t.Callable[..., t.Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            return await call(func, *args, node=node_of(key(*args, **kwargs)), fallback=fallback, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def delete(*keys: str, fallback: t.Any = UNAVAILABLE) -> int:
+    """
+    DEL keys which may belong to different nodes, each node through its circuit breaker
+    :param keys:
+    :param fallback: value to return if any of the nodes is down or too slow, 503 is raised if not specified
+    :return: amount of deleted keys
+    """
+    results = await asyncio.gather(
+        *(call(get_node_connection(node).delete, *batch, node=node) for node, batch in group_by_node(keys).items()),
+        return_exceptions=True,
+    )
+
+    for result in results:
+        if isinstance(result, BaseException):
+            # Keys of available nodes are deleted anyway
+            if fallback is UNAVAILABLE or not isinstance(result, RedisUnavailable):
+                raise result
+
+            return fallback
+
+    return sum(results)
+
+
+def _code_key(code, code_type: CodeType) -> str:
+    return f"{code_type}:{code}"
+
+
+def _code_index_key(user_id, code_type: CodeType) -> str:
+    return f"CODES:{code_type}:{user_id}"
+
+
+def _code_expires(code_type: CodeType) -> int:
     if code_type == CodeType.FORGOT_PASSWORD:
-        ex = settings().RESET_CODE_EXPIRES
+        return settings().RESET_CODE_EXPIRES
+
+    return settings().REGISTER_CODE_EXPIRES
+
+
+def _code_limit(code_type: CodeType) -> int:
+    # Registering again replaces previous registration code instead of adding another one
+    if code_type == CodeType.REGISTER:
+        return 1
+
+    return settings().CODE_LIMIT_PER_USER
+
+
+async def _issue_unique_code(user_id, code_type: CodeType, ex: int) -> str:
+    # SET NX both checks uniqueness and stores code within single round trip
+    for _ in range(CODE_ISSUE_ATTEMPTS):
+        code = secrets.token_urlsafe(8)
 
-    await connection.set(token, user_id, ex=ex)
+        key = _code_key(code, code_type)
+
+        if await call(get_connection(key).set, key, user_id, ex=ex, nx=True, node=node_of(key)):
+            return code
+
+    raise RuntimeError(f"Failed to issue unique {code_type} code in {CODE_ISSUE_ATTEMPTS} attempts")
+
+
+async def _index_code(user_id, code, code_type: CodeType, ex: int):
+    """
+    Remember code in per-user index and revoke oldest codes above per-user limit
+
+    Consumed codes are not removed from the index, they are evicted as any other code
+    """
+    index_key = _code_index_key(user_id, code_type)
+    limit = _code_limit(code_type)
+    # Microseconds keep issue order of codes generated in a row
+    now_us = time.time_ns() // 1000
+
+    async def _update_index() -> t.List[t.Any]:
+        async with get_connection(index_key).pipeline(transaction=True) as pipe:
+            pipe.zadd(index_key, {code: now_us})
+            pipe.zremrangebyscore(index_key, "-inf", now_us - ex * 1_000_000)
+            pipe.zrange(index_key, 0, -limit - 1)
+            pipe.zremrangebyrank(index_key, 0, -limit - 1)
+            pipe.expire(index_key, ex)
+            return await pipe.execute()
+
+    results = await call(_update_index, node=node_of(index_key))
+    evicted_codes = results[2]
+    if evicted_codes:
+        # Codes are spread over nodes independently of the index
+        await delete(*(_code_key(one, code_type) for one in evicted_codes))
+
+
+async def generate_code(user_id, code_type: CodeType) -> str:
+    """
+    Issue code of the user, code and per-user index are stored on different nodes, each through its circuit breaker
+    """
+    ex = _code_expires(code_type)
+    code = await _issue_unique_code(user_id, code_type, ex)
+    await _index_code(user_id, code, code_type, ex)
     return code
 
 
+@guarded(key=_code_key)
 async def check_code(code, code_type: CodeType) -> t.Optional[str]:
-    token = f"{code_type}:{code}"
-    return await connection.get(token)
+    """
+    Return user id of the code without consuming it
+    """
+    key = _code_key(code, code_type)
+    return await get_connection(key).get(key)
+
+
+@guarded(key=_code_key)
+async def consume_code(code, code_type: CodeType) -> t.Optional[str]:
+    """
+    Atomically return user id of the code and delete it, so the code can't be used twice
+    """
+    key = _code_key(code, code_type)
+    return await get_connection(key).getdel(key)
+
+
+async def expire_orphaned_codes(
+        code_type: CodeType,
+        ex: int,
+        batch_size: int = 1000,
+        dry_run: bool = True,
+) -> t.Tuple[int, int]:
+    """
+    SCAN codes of specified type and set expiration on the ones without it, e.g. issued before codes had TTL
+    :param code_type:
+    :param ex: expiration to set, in seconds
+    :param batch_size: SCAN count hint and pipeline size
+    :param dry_run: only count orphaned codes
+    :return: amount of scanned and orphaned codes
+    """
+    scanned_count = 0
+    orphaned_count = 0
+    batch = []
+
+    async def _process_batch(connection: aioredis.Redis):
+        nonlocal orphaned_count
+
+        async with connection.pipeline(transaction=False) as pipe:
+            for key in batch:
+                pipe.ttl(key)
+            ttls = await pipe.execute()
+
+        # -1 means key exists and has no expiration, -2 - key expired / consumed in the meantime
+        orphaned_keys = [key for key, ttl in zip(batch, ttls) if ttl == -1]
+        orphaned_count += len(orphaned_keys)
+
+        if orphaned_keys and not dry_run:
+            async with connection.pipeline(transaction=False) as pipe:
+                for key in orphaned_keys:
+                    pipe.expire(key, ex)
+                await pipe.execute()
+
+        batch.clear()
+
+    for connection in get_connections().values():
+        async for key in connection.scan_iter(match=_code_key("*", code_type), count=batch_size):
+            scanned_count += 1
+            batch.append(key)
+
+            if len(batch) >= batch_size:
+                await _process_batch(connection)
 
+        if batch:
+            await _process_batch(connection)
 
-async def delete_code(code, code_type: CodeType):
-    token = f"{code_type}:{code}"
-    return await connection.delete(token)
+    return scanned_count, orphaned_count
@@ -1,15 +1,21 @@
+import hashlib
+import time
 import typing as t
+from datetime import timedelta
 from enum import Enum
 
 import bcrypt
-from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.security.api_key import APIKeyHeader
 from fastapi_jwt_auth import AuthJWT
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from pydantic import BaseModel
+from tortoise.signals import post_delete, post_save
 
 import models
 from conf import settings
+from core import errors
+from core.cache import LRUCache, ModelCache
 
 
 class JwtConfig(BaseModel):
@@ -17,6 +23,30 @@ class JwtConfig(BaseModel):
     authjwt_access_token_expires: int = settings().ACCESS_TOKEN_EXPIRES
     authjwt_refresh_token_expires: int = settings().REFRESH_TOKEN_EXPIRES
 
+
+# Verified token digest -> decoded claims, lets repeated requests with the same token skip signature verification
+token_cache = LRUCache(maxsize=settings().JWT_CACHE_SIZE, ttl=settings().JWT_CACHE_TTL)
+
+user_cache: ModelCache[models.User] = ModelCache(
+    models.User,
+    maxsize=settings().USER_CACHE_SIZE,
+    ttl=settings().USER_CACHE_TTL,
+    use_redis=settings().USER_CACHE_REDIS,
+    local_ttl=settings().USER_CACHE_LOCAL_TTL,
+    exclude=["password"],
+)
+
+
+@post_save(models.User)
+async def _invalidate_saved_user(sender, instance: models.User, created, using_db, update_fields):
+    await user_cache.invalidate(instance.pk)
+
+
+@post_delete(models.User)
+async def _invalidate_deleted_user(sender, instance: models.User, using_db):
+    await user_cache.invalidate(instance.pk)
+
+
 # Dependency to parse Authorization header
 AuthorizationHeader = APIKeyHeader(name="Authorization", auto_error=False)
 
@@ -31,20 +61,100 @@ class Authorize(AuthJWT):
     def __init__(self, req: Request = None, res: Response = None):
         super().__init__(req=req, res=res)
         self._request = req
+        self._users: t.Dict[int, models.User] = {}
 
     def raise_401(self, detail: t.Optional[str] = None):
         raise HTTPException(status_code=401, detail=detail)
 
-    async def user_or_401(self, strategy: t.Optional[Strategy] = Strategy.ACCESS_TOKEN) -> models.User:
+    def raise_403(self, detail: t.Optional[str] = errors.PERMISSION_DENIED):
+        raise HTTPException(status_code=403, detail=detail)
+
+    def create_user_access_token(self, user: models.User) -> str:
+        """
+        Create access token with claims required to check permissions without loading user
+        :param user:
+        :return:
+        """
+        return self.create_access_token(user.id, user_claims={
+            "role": user.role.value,
+            "is_email_verified": user.is_email_verified,
+            "token_version": user.token_version,
+        })
+
+    async def user_or_401(
+            self,
+            strategy: t.Optional[Strategy] = Strategy.ACCESS_TOKEN,
+            complete: bool = False,
+    ) -> models.User:
+        """
+        Load current user, by default from user cache
+
+        Cached user has no password and save() without update_fields fails on it
+        :param strategy:
+        :param complete: load user with all fields from primary, e.g. to check password or save it
+        :return:
+        """
         self._authorize(strategy)
         user_id = self.get_jwt_subject()
-        user = await models.User.get_or_none(id=user_id)
+        user = await self.get_user(user_id)
+
+        if user is not None and complete:
+            user = await user_cache.load(user.pk)
 
         if user is None:
             self.raise_401()
 
+        token_version = self.get_raw_jwt().get("token_version")
+        if token_version is not None and token_version != user.token_version:
+            self.raise_401()
+
         return user
 
+    async def role_or_403(self, *roles: models.User.Role) -> models.User.Role:
+        """
+        Check that user has one of the roles using access token claims
+
+        Tokens without role claim (issued before claims were introduced) fall back to loading user
+        :param roles:
+        :return: role of current user
+        """
+        self._authorize(Authorize.Strategy.ACCESS_TOKEN)
+        claims = self.get_raw_jwt()
+
+        if claims.get("role") is None or claims.get("token_version") is None:
+            user = await self.user_or_401()
+            role = user.role
+        else:
+            role = models.User.Role(claims["role"])
+
+        if role not in roles:
+            self.raise_403()
+
+        # Permission is granted by claims, make sure token is not outdated, e.g. user was demoted in the meantime.
+        # User is served from cache (or request memo for tokens without claims)
+        await self.user_or_401()
+        return role
+
+    async def get_user(self, user_id) -> t.Optional[models.User]:
+        """
+        Load user via shared user cache, memoizing it for the rest of the request
+        :param user_id:
+        :return:
+        """
+        users = self._users
+
+        if self._request is not None:
+            if not hasattr(self._request.state, "users"):
+                self._request.state.users = {}
+
+            users = self._request.state.users
+
+        user_id = user_cache.normalize_pk(user_id)
+        if user_id not in users:
+            users[user_id] = await user_cache.get_or_load(user_id)
+
+        return users[user_id]
+
     def _authorize(self, strategy: Strategy):
         method_map = {
             Authorize.Strategy.ACCESS_TOKEN: self.jwt_required,
@@ -56,6 +166,36 @@ class Authorize(AuthJWT):
         except AuthJWTException as e:
             self.raise_401()
 
+    def _verified_token(self, encoded_token: str, issuer: t.Optional[str] = None) -> t.Dict[str, t.Any]:
+        """
+        Decode and verify token, reusing previously verified claims until token expires
+
+        Revocation is still checked by the caller (see AuthJWT._verifying_token) on every request
+        :param encoded_token:
+        :param issuer:
+        :return: decoded claims
+        """
+        key = hashlib.sha256(f"{issuer}:{encoded_token}".encode("utf-8")).digest()
+        leeway = self._decode_leeway
+
+        if isinstance(leeway, timedelta):
+            leeway = leeway.total_seconds()
+
+        claims = token_cache.get(key)
+        if claims is not None and claims.get("exp", float("inf")) + leeway > time.time():
+            return claims.copy()
+
+        claims = super()._verified_token(encoded_token, issuer)
+        ttl = token_cache.ttl
+
+        if "exp" in claims:
+            ttl = min(ttl, claims["exp"] + leeway - time.time())
+
+        if ttl > 0:
+            token_cache.set(key, claims.copy(), ttl=ttl)
+
+        return claims
+
     def jwt_session_required(self):
         self._token = self._request.session.get("token", None)
         if self._token is None:
@@ -64,17 +204,82 @@ class Authorize(AuthJWT):
         self._verify_jwt_in_request(self._token, "access", 'cookies')
 
 
+def requires_role(*roles: models.User.Role) -> t.Callable[..., t.Awaitable[Authorize]]:
+    """
+    Dependency factory to allow only users with one of specified roles, e.g. Depends(requires_role(Role.ADMIN))
+    :param roles:
+    :return: dependency which returns Authorize instance
+    """
+    async def dependency(authorize: Authorize = Depends()) -> Authorize:
+        await authorize.role_or_403(*roles)
+        return authorize
+
+    return dependency
+
+
 def configure_jwt(app: FastAPI):
     AuthJWT.load_config(JwtConfig)  # type: ignore
 
 
-def hash_password(password: str) -> str:
+def hash_password(password: str, rounds: t.Optional[int] = None) -> str:
     password = password.encode("utf-8")
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or settings().BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password, salt)
     return hashed_password.decode("utf-8")
 
 
+def get_hash_rounds(hashed_password: str) -> t.Optional[int]:
+    """
+    Extract cost factor from bcrypt hash, e.g. 12 from $2b$12$...
+    :param hashed_password:
+    :return: None for malformed hashes
+    """
+    try:
+        return int(hashed_password.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    rounds = get_hash_rounds(hashed_password)
+    return rounds is not None and rounds != settings().BCRYPT_ROUNDS
+
+
+def calibrate_hash_rounds(
+        budget_ms: float,
+        min_rounds: int = 4,
+        max_rounds: int = 16,
+        samples: int = 3,
+) -> t.Tuple[int, t.Dict[int, float]]:
+    """
+    Benchmark bcrypt on current host and pick the highest cost factor which fits into latency budget
+    :param budget_ms: max median duration of single hash in milliseconds
+    :param min_rounds:
+    :param max_rounds:
+    :param samples: number of hashes per cost factor
+    :return: picked cost factor and median timings in milliseconds per checked cost factor
+    """
+    password = b"calibration-password"
+    timings = {}
+    picked = min_rounds
+
+    for rounds in range(min_rounds, max_rounds + 1):
+        durations = []
+
+        for _ in range(samples):
+            started_at = time.perf_counter()
+            bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+            durations.append((time.perf_counter() - started_at) * 1000)
+
+        timings[rounds] = sorted(durations)[len(durations) // 2]
+        if timings[rounds] > budget_ms:
+            break
+
+        picked = rounds
+
+    return picked, timings
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_password = plain_password.encode("utf-8")
     hashed_password = hashed_password.encode("utf-8")
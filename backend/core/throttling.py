@@ -0,0 +1,145 @@
+"""
+Redis-backed sliding window rate limiting, checked before any expensive work (DB lookup, password hashing)
+"""
+import asyncio
+import math
+import secrets
+import time
+import typing as t
+
+from fastapi import HTTPException, Request
+
+from conf import settings
+from core import errors, metrics, redis
+
+# Sliding window log per key: drop attempts older than window, reject if any key is over its limit,
+# otherwise record attempt for all keys. Returns 0 if allowed or milliseconds to wait until next allowed attempt
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local member = ARGV[3]
+local retry_after = 0
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[3 + i])
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+
+    if redis.call("ZCARD", key) >= limit then
+        local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+        retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+    end
+end
+
+if retry_after > 0 then
+    return retry_after
+end
+
+for i, key in ipairs(KEYS) do
+    redis.call("ZADD", key, now, member)
+    redis.call("PEXPIRE", key, window)
+end
+
+return 0
+"""
+
+
+class Throttled(HTTPException):
+    """
+    Too many requests exception with Retry-After header
+    """
+    def __init__(self, retry_after: int, detail: t.Optional[str] = errors.TOO_MANY_REQUESTS):
+        self.retry_after = retry_after
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class Throttle:
+    """
+    Limits attempts per identity (e.g. email) and per client IP within the same sliding window
+
+    Client IP is the address uvicorn resolves: X-Forwarded-For is used only if the peer is a trusted proxy
+    (FORWARDED_ALLOW_IPS env var, required by run_prod.sh).
+    Limiter fails open: attempts are not limited while Redis is unavailable
+    """
+    def __init__(self, scope: str, identity_limit: int, ip_limit: int, window: int):
+        self.scope = scope
+        self.identity_limit = identity_limit
+        self.ip_limit = ip_limit
+        self.window = window
+
+    def key(self, kind: str, value: str) -> str:
+        return f"THROTTLE:{self.scope}:{kind}:{value}"
+
+    async def record(self, limits: t.Dict[str, int]) -> int:
+        """
+        Run sliding window script on every node owning some of the keys, through circuit breaker of the node
+
+        Fails open: keys of unavailable node are not limited, the fallback is logged and counted as redis.fallback
+        metric. Redis outage doesn't block logins, hashing pool is bounded anyway
+        :param limits: limit per key
+        :return: milliseconds to wait until next allowed attempt or 0 if attempt is allowed
+        """
+        now_ms = int(time.time() * 1000)
+        member = f"{now_ms}:{secrets.token_hex(4)}"
+
+        # Script is atomic within a node only: if keys are on different nodes, attempt is recorded for allowed ones
+        results = await asyncio.gather(*(
+            redis.call(
+                redis.get_node_connection(node).eval,
+                SLIDING_WINDOW_SCRIPT, len(keys), *keys, now_ms, self.window * 1000, member,
+                *(limits[key] for key in keys),
+                node=node,
+                fallback=0,
+            )
+            for node, keys in redis.group_by_node(limits).items()
+        ))
+        return max(int(one) for one in results)
+
+    async def check(self, identity: t.Optional[str] = None, request: t.Optional[Request] = None):
+        """
+        Record attempt or raise Throttled if identity or client IP is over the limit
+        :param identity:
+        :param request: used to get client IP
+        :return:
+        """
+        limits = {}
+
+        if identity:
+            limits[self.key("identity", identity.lower())] = self.identity_limit
+
+        if request is not None and request.client is not None:
+            limits[self.key("ip", request.client.host)] = self.ip_limit
+
+        if not limits:
+            return
+
+        retry_after_ms = await self.record(limits)
+
+        if retry_after_ms:
+            metrics.counter(f"throttling.{self.scope}.rejected").inc()
+            raise Throttled(retry_after=max(1, math.ceil(int(retry_after_ms) / 1000)))
+
+
+login = Throttle(
+    "login",
+    identity_limit=settings().THROTTLE_LOGIN_PER_EMAIL,
+    ip_limit=settings().THROTTLE_LOGIN_PER_IP,
+    window=settings().THROTTLE_WINDOW,
+)
+admin_login = Throttle(
+    "admin_login",
+    identity_limit=settings().THROTTLE_LOGIN_PER_EMAIL,
+    ip_limit=settings().THROTTLE_LOGIN_PER_IP,
+    window=settings().THROTTLE_WINDOW,
+)
+register_resend = Throttle(
+    "register_resend",
+    identity_limit=settings().THROTTLE_REGISTER_RESEND_PER_EMAIL,
+    ip_limit=settings().THROTTLE_REGISTER_RESEND_PER_IP,
+    window=settings().THROTTLE_WINDOW,
+)
+forgot_password = Throttle(
+    "forgot_password",
+    identity_limit=settings().THROTTLE_FORGOT_PASSWORD_PER_EMAIL,
+    ip_limit=settings().THROTTLE_FORGOT_PASSWORD_PER_IP,
+    window=settings().THROTTLE_WINDOW,
+)
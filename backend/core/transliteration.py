@@ -0,0 +1,96 @@
+"""
+Ukrainian to Latin transliteration (KMU 2010 official table) and normalization of text for search
+"""
+import re
+import unicodedata
+
+# Letters with different transliteration at the beginning of a word
+INITIAL = {
+    "є": "ye",
+    "ї": "yi",
+    "й": "y",
+    "ю": "yu",
+    "я": "ya",
+}
+
+LETTERS = {
+    "а": "a",
+    "б": "b",
+    "в": "v",
+    "г": "h",
+    "ґ": "g",
+    "д": "d",
+    "е": "e",
+    "є": "ie",
+    "ж": "zh",
+    "з": "z",
+    "и": "y",
+    "і": "i",
+    "ї": "i",
+    "й": "i",
+    "к": "k",
+    "л": "l",
+    "м": "m",
+    "н": "n",
+    "о": "o",
+    "п": "p",
+    "р": "r",
+    "с": "s",
+    "т": "t",
+    "у": "u",
+    "ф": "f",
+    "х": "kh",
+    "ц": "ts",
+    "ч": "ch",
+    "ш": "sh",
+    "щ": "shch",
+    "ь": "",
+    "ю": "iu",
+    "я": "ia",
+    # Not in Ukrainian alphabet, but common in names typed with Russian layout
+    "ё": "e",
+    "ъ": "",
+    "ы": "y",
+    "э": "e",
+}
+
+APOSTROPHES = "'’ʼ`"
+
+_not_alphanumeric = re.compile(r"[^a-z0-9]+")
+
+
+def transliterate(text: str) -> str:
+    """
+    Transliterate Cyrillic letters of lowercase text, other characters are kept as is
+    :param text:
+    :return:
+    """
+    result = []
+    is_word_start = True
+
+    for index, char in enumerate(text):
+        if char in APOSTROPHES:
+            continue
+
+        if is_word_start and char in INITIAL:
+            result.append(INITIAL[char])
+        elif char == "г" and index > 0 and text[index - 1] == "з":
+            # "зг" is "zgh" to distinguish it from "ж"
+            result.append("gh")
+        else:
+            result.append(LETTERS.get(char, char))
+
+        is_word_start = not char.isalpha()
+
+    return "".join(result)
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase Latin words separated by single spaces: Cyrillic is transliterated, diacritics and punctuation dropped
+    :param text: e.g. "Юрій О'Коннор-Gómez"
+    :return: e.g. "yurii okonnor gomez"
+    """
+    text = transliterate(unicodedata.normalize("NFC", text.lower()))
+    text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return _not_alphanumeric.sub(" ", text).strip()
@@ -1 +1,4 @@
-from .utils import TORTOISE_CONFIG, check_connection, connect_db
+from .client import QueryTimeout
+from .timeouts import statement_timeout
+from .transactions import atomic, concurrently, pin_connection, unpin
+from .utils import TORTOISE_CONFIG, close_db, connect_db, init_db, pool_stats
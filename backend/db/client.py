@@ -0,0 +1,192 @@
+"""
+Tortoise engine for Postgres: asyncpg client with instrumented connection pool
+"""
+import asyncio
+import time
+import typing as t
+from contextvars import ContextVar
+
+import asyncpg
+from tortoise.backends.asyncpg import client
+from tortoise.backends.base.client import TransactionContext
+
+from core import metrics
+
+# Set per request by db.statement_timeout() dependency
+statement_timeout: ContextVar[t.Optional[float]] = ContextVar("db_statement_timeout", default=None)
+
+
+class QueryTimeout(Exception):
+    """
+    Query was cancelled because it ran longer than statement timeout
+    """
+
+
+class InstrumentedPool:
+    """
+    Proxy of asyncpg pool which counts acquired and waiting connections and measures acquire wait time
+    """
+    def __init__(self, pool: asyncpg.Pool, acquire_timeout: t.Optional[float] = None):
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.acquired = 0
+        self.waiting = 0
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self.pool, name)
+
+    async def acquire(self, timeout: t.Optional[float] = None) -> asyncpg.Connection:
+        if timeout is None:
+            timeout = self.acquire_timeout
+
+        self.waiting += 1
+        started_at = time.monotonic()
+
+        try:
+            connection = await self.pool.acquire(timeout=timeout)
+        except Exception:
+            metrics.counter("db.pool.acquire_failed").inc()
+            raise
+        finally:
+            self.waiting -= 1
+            metrics.timer("db.pool.acquire_wait").observe(time.monotonic() - started_at)
+
+        self.acquired += 1
+        return connection
+
+    async def release(self, connection: asyncpg.Connection, *, timeout: t.Optional[float] = None):
+        self.acquired -= 1
+        await self.pool.release(connection, timeout=timeout)
+
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "size": self.pool.get_size(),
+            "acquired": self.acquired,
+            "idle": self.pool.get_idle_size(),
+            "waiting": self.waiting,
+        }
+
+
+class Connection(asyncpg.Connection):
+    """
+    Connection which applies statement timeout of current request to queries without explicit timeout
+
+    On timeout asyncpg cancels the query on the server, so the connection is not held by it anymore
+    """
+    async def _execute(self, query, args, limit, timeout, **kwargs):
+        if timeout is None:
+            timeout = statement_timeout.get()
+
+        try:
+            return await super()._execute(query, args, limit, timeout, **kwargs)
+        except (asyncio.TimeoutError, asyncpg.QueryCanceledError) as e:
+            raise QueryTimeout(str(e) or "Statement timeout") from e
+
+    async def _executemany(self, query, args, timeout):
+        if timeout is None:
+            timeout = statement_timeout.get()
+
+        try:
+            return await super()._executemany(query, args, timeout)
+        except (asyncio.TimeoutError, asyncpg.QueryCanceledError) as e:
+            raise QueryTimeout(str(e) or "Statement timeout") from e
+
+
+class PgBouncerConnection(Connection):
+    """
+    Connection for PgBouncer in transaction pooling mode which doesn't keep session state on the server
+    """
+    def _get_reset_query(self) -> str:
+        # Private asyncpg API, so asyncpg is pinned in requirements.in.
+        # Release would reset session state (RESET ALL, UNLISTEN *, ...) of arbitrary server connection,
+        # app doesn't use session state, so skip the extra round trip
+        return ""
+
+
+class AsyncpgDBClient(client.AsyncpgDBClient):
+    def __init__(self, *args, pool_timeout: t.Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_timeout = pool_timeout
+
+    async def create_connection(self, with_db: bool) -> None:
+        await super().create_connection(with_db)
+        self._pool = InstrumentedPool(self._pool, acquire_timeout=self.pool_timeout)
+
+
+class PinnedConnection(client.TransactionWrapper):
+    """
+    Client which acquires pool connection on first query and runs all following queries on it until released
+
+    Transactions started with in_transaction() run on the same connection
+    """
+    def __init__(self, parent: AsyncpgDBClient):
+        super().__init__(parent)
+        self._connection: t.Optional[asyncpg.Connection] = None
+
+    async def ensure_connection(self) -> asyncpg.Connection:
+        if self._connection is None:
+            self._connection = await self._parent._pool.acquire()
+
+        return self._connection
+
+    async def release(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await self._parent._pool.release(connection)
+
+    def acquire_connection(self) -> "PinnedConnectionContext":
+        return PinnedConnectionContext(self)
+
+    def _in_transaction(self) -> "PinnedTransactionContext":
+        return PinnedTransactionContext(self)
+
+
+class PinnedConnectionContext:
+    def __init__(self, pinned: PinnedConnection):
+        self.pinned = pinned
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        # Queries of concurrent tasks within request wait for each other
+        await self.pinned._lock.acquire()
+
+        try:
+            return await self.pinned.ensure_connection()
+        except BaseException:
+            self.pinned._lock.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.pinned._lock.release()
+
+
+class PinnedTransactionContext(TransactionContext):
+    """
+    Transaction on the pinned connection
+
+    Wrapper has its own lock for queries of the transaction, lock of pinned connection is held until the transaction
+    ends, so queries of concurrent tasks outside of it wait instead of running on the same connection in between
+    """
+    def __init__(self, pinned: PinnedConnection):
+        self.pinned = pinned
+
+    async def __aenter__(self) -> client.TransactionWrapper:
+        await self.pinned._lock.acquire()
+
+        try:
+            await self.pinned.ensure_connection()
+            super().__init__(client.TransactionWrapper(self.pinned))
+            return await super().__aenter__()
+        except BaseException:
+            self.pinned._lock.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await super().__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.pinned._lock.release()
+
+
+client_class = AsyncpgDBClient
@@ -0,0 +1,103 @@
+"""
+Postgres pg_trgm, full-text search and range expressions usable in .annotate(): ranking and index-backed matching
+"""
+import re
+import typing as t
+from datetime import date
+
+from pypika.enums import Comparator
+from pypika.terms import BasicCriterion, Bracket, Field
+from pypika.terms import Function as PypikaFunction
+from pypika.terms import Term, ValueWrapper
+from tortoise.expressions import Function
+from tortoise.filters import Like, escape_like
+from tortoise.models import Model
+
+# Text search configuration without stemming: there is no Ukrainian dictionary in Postgres
+TEXT_SEARCH_CONFIG = "simple"
+
+_word = re.compile(r"\w+")
+
+
+class TrigramComparator(Comparator):
+    word_similar = " <% "
+
+
+class TextSearchComparator(Comparator):
+    match = " @@ "
+
+
+class RangeComparator(Comparator):
+    overlap = " && "
+
+
+class WordSimilarity(Function):
+    """
+    word_similarity(value, field): greatest similarity of value to a continuous part of the field, 0 to 1
+    """
+    def _get_function_field(self, field: Field, *default_values: t.Any) -> PypikaFunction:
+        return PypikaFunction("word_similarity", *default_values, field)
+
+
+def trigram_match(model: t.Type[Model], field: str, value: str) -> Term:
+    """
+    Field contains value or has a part similar to it (above pg_trgm.word_similarity_threshold)
+
+    Both operators are served by GIN index with gin_trgm_ops on the field
+    :param model:
+    :param field:
+    :param value: normalized the same way as the field
+    :return:
+    """
+    column = Field(model._meta.fields_db_projection[field], table=model._meta.basetable)
+    contains = Like(column, ValueWrapper(f"%{escape_like(value)}%"))
+    is_similar = BasicCriterion(TrigramComparator.word_similar, ValueWrapper(value), column)
+    # Brackets keep OR together when tortoise compares the annotation with true
+    return Bracket(contains | is_similar)
+
+
+def prefix_tsquery(text: str) -> t.Optional[Term]:
+    """
+    to_tsquery matching documents with words starting with every word of the text, e.g. "lake cam" -> lake:* & cam:*
+
+    Only word characters are kept, so user input can't inject tsquery operators
+    :param text:
+    :return: None if the text has no words
+    """
+    words = _word.findall(text.lower())
+
+    if not words:
+        return None
+
+    return PypikaFunction("to_tsquery", TEXT_SEARCH_CONFIG, " & ".join(f"{one}:*" for one in words))
+
+
+def text_search_match(model: t.Type[Model], column: str, query: Term) -> Term:
+    """
+    tsvector column matches the query, served by GIN index on the column
+    :param model:
+    :param column: may be a column unknown to the model, e.g. generated one
+    :param query: e.g. prefix_tsquery()
+    :return:
+    """
+    return Bracket(BasicCriterion(TextSearchComparator.match, Field(column, table=model._meta.basetable), query))
+
+
+def text_search_rank(model: t.Type[Model], column: str, query: Term) -> Term:
+    """
+    ts_rank of tsvector column for the query, higher is more relevant
+    """
+    return PypikaFunction("ts_rank", Field(column, table=model._meta.basetable), query)
+
+
+def date_range_overlap(model: t.Type[Model], column: str, lower: t.Optional[date], upper: t.Optional[date]) -> Term:
+    """
+    daterange column overlaps inclusive range [lower, upper], served by GiST index on the column
+    :param model:
+    :param column: may be a column unknown to the model, e.g. generated one
+    :param lower: None for range unbounded from below
+    :param upper: None for range unbounded from above
+    :return:
+    """
+    query_range = PypikaFunction("daterange", lower, upper, "[]")
+    return Bracket(BasicCriterion(RangeComparator.overlap, Field(column, table=model._meta.basetable), query_range))
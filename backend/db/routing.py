@@ -0,0 +1,119 @@
+"""
+Routing of read-only queries to replicas with "read your writes" stickiness to primary
+"""
+import itertools
+import typing as t
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from tortoise.backends.base.client import BaseTransactionWrapper
+from tortoise.transactions import current_transaction_map
+
+from conf import settings
+from db.client import PinnedConnection
+
+PRIMARY = "default"
+REPLICA_PREFIX = "replica_"
+
+STICKY_COOKIE = "db_primary"
+
+
+class RequestState:
+    def __init__(self, use_primary: bool = False):
+        self.use_primary = use_primary
+        self.has_written = False
+
+
+_request_state: ContextVar[t.Optional[RequestState]] = ContextVar("db_request_state", default=None)
+
+
+def replica_names(count: int) -> t.List[str]:
+    return [f"{REPLICA_PREFIX}{index}" for index in range(count)]
+
+
+def use_primary():
+    """
+    Read from primary until the end of current request, e.g. right before re-reading just written data
+    """
+    state = _request_state.get()
+
+    if state is not None:
+        state.use_primary = True
+
+
+def in_transaction() -> bool:
+    # Connection in the map is replaced by transaction wrapper while transaction is active
+    current = current_transaction_map.get(PRIMARY)
+    connection = current.get() if current is not None else None
+    return isinstance(connection, BaseTransactionWrapper) and not isinstance(connection, PinnedConnection)
+
+
+class ReplicaRouter:
+    """
+    Tortoise router: sends reads to replicas round-robin and everything else to primary
+
+    Reads go to primary within transactions and within requests which wrote something or came
+    during stickiness window after a write of the same client
+    """
+    def __init__(self):
+        self._replicas = itertools.cycle(replica_names(len(settings().DB_REPLICA_URLS or [])))
+
+    def db_for_read(self, model) -> t.Optional[str]:
+        state = _request_state.get()
+
+        if state is not None and (state.use_primary or state.has_written):
+            return None
+
+        if in_transaction():
+            return None
+
+        return next(self._replicas, None)
+
+    def db_for_write(self, model) -> t.Optional[str]:
+        state = _request_state.get()
+
+        if state is not None:
+            state.has_written = True
+
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """
+    Tracks writes within request and makes following requests of the client read from primary for
+    DB_REPLICA_STICKINESS seconds using a cookie, so the client doesn't see stale data of lagging replica
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = RequestState(use_primary=self.is_sticky(scope))
+        token = _request_state.set(state)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and state.has_written:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Set-Cookie",
+                    f"{STICKY_COOKIE}=1; Max-Age={settings().DB_REPLICA_STICKINESS}; Path=/; HttpOnly; SameSite=Lax",
+                )
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_state.reset(token)
+
+    @staticmethod
+    def is_sticky(scope: Scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"cookie" and STICKY_COOKIE in cookie_parser(value.decode("latin-1")):
+                return True
+
+        return False
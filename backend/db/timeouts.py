@@ -0,0 +1,75 @@
+"""
+Statement timeouts per route and cancellation of request handling when client disconnects
+"""
+import asyncio
+import contextlib
+import typing as t
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core import metrics
+from db import client
+
+
+def statement_timeout(seconds: float) -> t.Callable[[], t.Awaitable[None]]:
+    """
+    Dependency factory to limit duration of every query of the route, e.g. Depends(statement_timeout(5))
+    """
+    async def dependency():
+        # Async dependency runs in the request task, so the value is visible to the endpoint
+        client.statement_timeout.set(seconds)
+
+    return dependency
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    Cancels request handling with its in-flight query as soon as the client disconnects
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Messages are read here to notice disconnect and then passed to the app through the queue
+        queue: "asyncio.Queue[Message]" = asyncio.Queue()
+        response_complete = False
+
+        async def listen():
+            while True:
+                message = await receive()
+                queue.put_nowait(message)
+
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def send_wrapper(message: Message):
+            nonlocal response_complete
+
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+
+            await send(message)
+
+        listener = asyncio.create_task(listen())
+        handler = asyncio.create_task(self.app(scope, queue.get, send_wrapper))
+
+        try:
+            await asyncio.wait({listener, handler}, return_when=asyncio.FIRST_COMPLETED)
+
+            # Server reports disconnect after complete response too, background tasks have to finish then
+            if not handler.done() and not response_complete:
+                metrics.counter("http.cancelled_on_disconnect").inc()
+                handler.cancel()
+
+                with contextlib.suppress(asyncio.CancelledError):
+                    await handler
+
+                return
+
+            await handler
+        finally:
+            listener.cancel()
+            handler.cancel()
@@ -0,0 +1,104 @@
+"""
+Request-scoped connection and transactions on it
+"""
+import asyncio
+import functools
+import typing as t
+from contextlib import asynccontextmanager
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+from tortoise import Tortoise
+from tortoise.transactions import current_transaction_map, in_transaction
+
+from conf import settings
+from db import routing
+from db.client import AsyncpgDBClient, PinnedConnection
+
+F = t.TypeVar("F", bound=t.Callable[..., t.Awaitable[t.Any]])
+T = t.TypeVar("T")
+
+
+@asynccontextmanager
+async def pin_connection(connection_name: str = routing.PRIMARY) -> t.AsyncIterator[t.Optional[PinnedConnection]]:
+    """
+    Run all queries of the block to the connection on single pool connection, acquired on first query
+    """
+    parent = Tortoise._connections.get(connection_name)
+
+    # Clients without pool (SQLite in tests) already use single connection
+    if not isinstance(parent, AsyncpgDBClient):
+        yield None
+        return
+
+    pinned = PinnedConnection(parent)
+    token = current_transaction_map[connection_name].set(pinned)
+
+    try:
+        yield pinned
+    finally:
+        current_transaction_map[connection_name].reset(token)
+        await pinned.release()
+
+
+def unpin(connection_name: str = routing.PRIMARY):
+    """
+    Run following queries of current task (and tasks started from it) on own pool connections instead of pinned one
+    """
+    current = current_transaction_map.get(connection_name)
+
+    # Transaction keeps its connection: its queries must not leave it
+    if current is not None and isinstance(current.get(), PinnedConnection):
+        current.set(current.get()._parent)
+
+
+async def _unpinned(coroutine: t.Awaitable[T]) -> T:
+    unpin()
+    return await coroutine
+
+
+async def concurrently(*coroutines: t.Awaitable[t.Any]) -> t.List[t.Any]:
+    """
+    Run independent queries concurrently: the first on pinned connection, others on own pool connections
+
+    If any of them fails, the rest are cancelled and the error is raised
+    :param coroutines:
+    :return: results in the same order
+    """
+    first, *others = coroutines
+    tasks = [asyncio.ensure_future(first), *(asyncio.ensure_future(_unpinned(one)) for one in others)]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def atomic(func: F) -> F:
+    """
+    Run service method in transaction on primary DB
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with in_transaction(routing.PRIMARY):
+            return await func(*args, **kwargs)
+
+    return t.cast(F, wrapper)
+
+
+class PinnedConnectionMiddleware:
+    """
+    Pins single primary DB connection per request, so its queries don't acquire and release pool connection each
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings().DB_PIN_CONNECTION:
+            return await self.app(scope, receive, send)
+
+        async with pin_connection():
+            await self.app(scope, receive, send)
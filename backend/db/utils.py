@@ -1,46 +1,140 @@
 import asyncio
+import typing as t
+from urllib.parse import unquote, urlsplit
 
 import asyncpg
 from fastapi import FastAPI
 from tortoise import Tortoise
-from tortoise.contrib.fastapi import register_tortoise
+from tortoise.exceptions import DBConnectionError
 from tortoise.log import logger
 
 from conf import settings
+from db import routing, timeouts, transactions
+from db.client import Connection, InstrumentedPool, PgBouncerConnection
 
-TORTOISE_CONFIG = {
-    'connections': {'default': settings().DB_URL},
-    'apps': {"models": {"models": ["models", "aerich.models"]}},
-}
+
+def get_connection_config(url: t.Optional[str] = None) -> t.Union[str, t.Dict[str, t.Any]]:
+    """
+    Tortoise connection config with pool settings
+    :param url: postgres:// URL of the DB, primary DB from settings by default
+    :return:
+    """
+    if url is None and settings().TEST:
+        return settings().DB_URL
+
+    if url is None:
+        credentials = {
+            "host": settings().DB_HOST,
+            "port": settings().DB_PORT,
+            "user": settings().DB_USER,
+            "password": settings().DB_PASSWORD,
+            "database": settings().DB_NAME,
+        }
+    else:
+        parts = urlsplit(url)
+        credentials = {
+            "host": parts.hostname,
+            "port": parts.port or 5432,
+            "user": unquote(parts.username or ""),
+            "password": unquote(parts.password or ""),
+            "database": parts.path.lstrip("/"),
+        }
+
+    credentials.update(
+        minsize=settings().DB_POOL_MIN_SIZE,
+        maxsize=settings().DB_POOL_MAX_SIZE,
+        pool_timeout=settings().DB_POOL_TIMEOUT,
+        # Passed to asyncpg.create_pool as is
+        statement_cache_size=settings().DB_STATEMENT_CACHE_SIZE,
+        max_queries=settings().DB_POOL_MAX_QUERIES,
+        max_inactive_connection_lifetime=settings().DB_POOL_MAX_INACTIVE_LIFETIME,
+        # Default for queries without statement timeout of the route
+        command_timeout=settings().DB_STATEMENT_TIMEOUT,
+        connection_class=Connection,
+    )
+
+    if settings().DB_PGBOUNCER:
+        # In transaction pooling mode every transaction may run on another server connection, so statements
+        # prepared on one of them are unknown to others: asyncpg uses unnamed statements without the cache
+        credentials.update(statement_cache_size=0, connection_class=PgBouncerConnection)
+
+    return {"engine": "db.client", "credentials": credentials}
+
+
+def get_tortoise_config() -> t.Dict[str, t.Any]:
+    connections = {routing.PRIMARY: get_connection_config()}
+    routers = []
+
+    if settings().DB_REPLICA_URLS and not settings().TEST:
+        replica_urls = settings().DB_REPLICA_URLS
+        connections.update(zip(routing.replica_names(len(replica_urls)), map(get_connection_config, replica_urls)))
+        routers.append(routing.ReplicaRouter)
+
+    return {
+        'connections': connections,
+        'apps': {"models": {"models": ["models", "aerich.models"], "default_connection": routing.PRIMARY}},
+        'routers': routers,
+    }
 
 
-async def check_connection(attempts=10, timeout=1):
+TORTOISE_CONFIG = get_tortoise_config()
+
+
+async def init_db(
+        attempts: t.Optional[int] = None,
+        backoff: t.Optional[float] = None,
+        max_backoff: t.Optional[float] = None,
+):
     """
-    Utility to check if DB is accessible
+    Init Tortoise with its connection pools, retrying with exponential backoff while DB is not accessible
     :param attempts:
-    :param timeout:
+    :param backoff: delay after the first failed attempt, doubled after every next one
+    :param max_backoff:
     :return:
     """
-    async def _check_once():
+    attempts = attempts or settings().DB_CONNECT_ATTEMPTS
+    backoff = backoff or settings().DB_CONNECT_BACKOFF
+    max_backoff = max_backoff or settings().DB_CONNECT_BACKOFF_MAX
+
+    for attempt in range(1, attempts + 1):
         try:
-            conn = await asyncpg.connect(settings().DB_URL)
-        except Exception:
-            return False
+            await Tortoise.init(config=TORTOISE_CONFIG)
+            break
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, DBConnectionError) as e:
+            if attempt == attempts:
+                raise
 
-        await conn.close()
-        return True
+            delay = min(backoff * 2 ** (attempt - 1), max_backoff)
+            logger.info("Connection attempt to DB failed (%s), retrying in %.1fs...", e, delay)
+            await asyncio.sleep(delay)
 
-    for _ in range(attempts):
-        is_connected = await _check_once()
+    if settings().TEST:
+        await Tortoise.generate_schemas()
 
-        if is_connected:
-            break
 
-        logger.info("Connection attempt to DB failed, retrying...")
-        await asyncio.sleep(timeout)
+async def close_db():
+    await Tortoise.close_connections()
+
+
+def get_pools() -> t.Dict[str, InstrumentedPool]:
+    return {
+        name: connection._pool
+        for name, connection in Tortoise._connections.items()
+        if isinstance(getattr(connection, "_pool", None), InstrumentedPool)
+    }
+
+
+def pool_stats() -> t.Dict[str, t.Dict[str, int]]:
+    """
+    Usage of DB connection pools by connection name: size, acquired, idle and waiting connections
+    """
+    return {name: pool.stats() for name, pool in get_pools().items()}
 
 
 def connect_db(app: FastAPI):
     Tortoise.init_models(["models", "aerich.models"], "models")
-    app.on_event("startup")(check_connection)
-    register_tortoise(app, config=TORTOISE_CONFIG, generate_schemas=settings().TEST)
+    app.add_middleware(transactions.PinnedConnectionMiddleware)
+    app.add_middleware(timeouts.CancelOnDisconnectMiddleware)
+    app.add_middleware(routing.ReadYourWritesMiddleware)
+    app.on_event("startup")(init_db)
+    app.on_event("shutdown")(close_db)
@@ -2,11 +2,22 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from tortoise.exceptions import IntegrityError
 
+from core import errors, metrics
+from db import QueryTimeout
+
 
 def add_db_exception_handler(app: FastAPI):
     app.exception_handler(IntegrityError)(_on_integrity_error)
+    app.exception_handler(QueryTimeout)(_on_query_timeout)
 
 
 async def _on_integrity_error(request: Request, err: IntegrityError):
     detail = str(err).split("\n")[-1].replace("DETAIL: ", "")
     return JSONResponse(status_code=400, content={"detail": detail})
+
+
+async def _on_query_timeout(request: Request, err: QueryTimeout):
+    route = request.scope.get("route")
+    path = route.path if route is not None else request.url.path
+    metrics.counter(f"db.statement_timeout.{request.method} {path}").inc()
+    return JSONResponse(status_code=503, content={"detail": errors.SERVICE_UNAVAILABLE}, headers={"Retry-After": "1"})
@@ -9,7 +9,7 @@ import db
 import exceptions
 from admin import mount_admin
 from conf import settings
-from core import redis, security
+from core import hashing, redis, security
 from routes import include_routes
 from schemas import init_schemas
 
@@ -47,9 +47,15 @@ include_routes(app)
 mount_admin(app)
 
 
+@app.on_event("startup")
+async def on_startup():
+    await redis.init_redis_connection()
+
+
 @app.on_event("shutdown")
 async def on_shutdown():
     await redis.close_redis_connection()
+    hashing.shutdown()
 
 # For swagger tutorials: https://fastapi.tiangolo.com/advanced/sub-applications/
 # https://github.com/tiangolo/fastapi/issues/3047
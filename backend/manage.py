@@ -6,8 +6,11 @@ import typer
 from tortoise import Tortoise
 
 from admin import utils as admin_utils
+from conf import settings
+from core import redis, security
 from db import TORTOISE_CONFIG
 from migrations.utils import command as migration_command
+from models import User
 
 cli = typer.Typer(rich_markup_mode="rich")
 
@@ -53,5 +56,79 @@ def create_superadmin(
     run_async(_run())
 
 
+@cli.command(help=(
+        "Benchmark bcrypt on current host and print the highest cost factor within latency budget, "
+        "set it as [green]BCRYPT_ROUNDS[/green] env variable"
+))
+def calibrate_bcrypt(
+        budget_ms: t.Annotated[int, typer.Option(help="Max duration of single hash")] = settings().BCRYPT_BUDGET_MS,
+):
+    rounds, timings = security.calibrate_hash_rounds(budget_ms)
+
+    for one, duration in timings.items():
+        typer.echo(f"rounds={one}: {duration:.1f} ms")
+
+    typer.echo(f"BCRYPT_ROUNDS={rounds}")
+
+
+@cli.command(help=(
+        "Find registration codes without expiration (issued before codes had TTL) and set "
+        "[green]REGISTER_CODE_EXPIRES[/green] on them"
+))
+def expire_register_codes(
+        batch_size: t.Annotated[int, typer.Option(help="SCAN count hint and pipeline size")] = 1000,
+        dry_run: t.Annotated[bool, typer.Option(help="Only report orphaned codes")] = True,
+):
+    async def _run():
+        try:
+            return await redis.expire_orphaned_codes(
+                redis.CodeType.REGISTER,
+                ex=settings().REGISTER_CODE_EXPIRES,
+                batch_size=batch_size,
+                dry_run=dry_run,
+            )
+        finally:
+            await redis.close_redis_connection()
+
+    scanned_count, orphaned_count = run_async(_run())
+    action = "Found" if dry_run else "Expired"
+    typer.echo(f"Scanned {scanned_count} registration codes. {action} {orphaned_count} codes without expiration")
+
+
+@cli.command(help=(
+        "Recompute [green]search_text[/green] of all users after changing transliteration. Deploy runs it with "
+        "[green]--missing-only[/green] to fill users saved without it, e.g. before the migration adding it"
+))
+def update_user_search_text(
+        batch_size: t.Annotated[int, typer.Option(help="Users updated per query")] = 1000,
+        missing_only: t.Annotated[bool, typer.Option(help="Only users with empty search text")] = False,
+):
+    async def _run():
+        await Tortoise.init(config=TORTOISE_CONFIG)
+        updated_count = 0
+        last_id = 0
+        # Primary, replicas may not have latest users yet
+        queryset = User.all().using_db(User._meta.db)
+
+        if missing_only:
+            queryset = queryset.filter(search_text="")
+
+        try:
+            while users := await queryset.filter(id__gt=last_id).order_by("id").limit(batch_size):
+                for user in users:
+                    user.search_text = user.format_search_text()
+
+                await User.bulk_update(users, fields=["search_text"])
+                updated_count += len(users)
+                last_id = users[-1].id
+        finally:
+            await Tortoise.close_connections()
+
+        return updated_count
+
+    updated_count = run_async(_run())
+    typer.echo(f"Updated search text of {updated_count} users")
+
+
 if __name__ == "__main__":
     cli()
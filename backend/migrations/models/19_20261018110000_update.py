@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        ALTER TABLE "user" ADD IF NOT EXISTS "search_text" TEXT NOT NULL DEFAULT '';
+        COMMENT ON COLUMN "user"."search_text" IS 'Normalized and transliterated names for trigram search, maintained on save';
+        CREATE INDEX IF NOT EXISTS "idx_user_search_text_trgm" ON "user" USING GIN ("search_text" gin_trgm_ops);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_user_search_text_trgm";
+        ALTER TABLE "user" DROP COLUMN "search_text";"""
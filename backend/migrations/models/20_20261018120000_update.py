@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "camp" ADD IF NOT EXISTS "search_document" TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', "name"), 'A')
+            || setweight(to_tsvector('simple', "location"), 'B')
+            || setweight(to_tsvector('simple', "description"), 'C')
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS "idx_camp_search_document" ON "camp" USING GIN ("search_document");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_camp_search_document";
+        ALTER TABLE "camp" DROP COLUMN "search_document";"""
@@ -0,0 +1,20 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "camp" ADD IF NOT EXISTS "date_range" DATERANGE GENERATED ALWAYS AS (
+            CASE WHEN "date_start" > "date_end" THEN NULL
+            WHEN "date_start" IS NOT NULL OR "date_end" IS NOT NULL
+            THEN daterange(LEAST("date_start", "date_end"), GREATEST("date_start", "date_end"), '[]') END
+        ) STORED;
+        COMMENT ON COLUMN "camp"."date_range" IS 'Inclusive [date_start, date_end], a single day if one of them is unknown, NULL if both are unknown or date_start > date_end';
+        CREATE INDEX IF NOT EXISTS "idx_camp_date_range" ON "camp" USING GIST ("date_range");
+        CREATE INDEX IF NOT EXISTS "idx_camp_reversed_dates" ON "camp" ("date_start", "date_end") WHERE "date_start" > "date_end";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_camp_reversed_dates";
+        DROP INDEX IF EXISTS "idx_camp_date_range";
+        ALTER TABLE "camp" DROP COLUMN "date_range";"""
@@ -0,0 +1,31 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_camp_name_5c456c" ON "camp" ("name", "id");
+        CREATE INDEX IF NOT EXISTS "idx_camp_created_76c27d" ON "camp" ("created_at", "id");
+        CREATE INDEX IF NOT EXISTS "idx_camp_date_st_2c1b0b" ON "camp" ("date_start", "id");
+        CREATE INDEX IF NOT EXISTS "idx_camp_country_f76ce8" ON "camp" ("country_id", "name", "id");
+        CREATE INDEX IF NOT EXISTS "idx_user_created_5e2aef" ON "user" ("created_at", "id");
+        CREATE INDEX IF NOT EXISTS "idx_user_date_of_237bd3" ON "user" ("date_of_birth", "id");
+        CREATE INDEX IF NOT EXISTS "idx_user_role_065004" ON "user" ("role", "id");
+        CREATE INDEX IF NOT EXISTS "idx_user_role_759251" ON "user" ("role", "created_at", "id");
+        CREATE INDEX IF NOT EXISTS "idx_user_country_2f2123" ON "user" ("country_id", "created_at", "id");
+        CREATE INDEX IF NOT EXISTS "idx_campmember_user_id_762cf2" ON "campmember" ("user_id", "created_at", "id");
+        CREATE INDEX IF NOT EXISTS "idx_campmember_camp_id_42f5d1" ON "campmember" ("camp_id", "role", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_camp_name_5c456c";
+        DROP INDEX IF EXISTS "idx_camp_created_76c27d";
+        DROP INDEX IF EXISTS "idx_camp_date_st_2c1b0b";
+        DROP INDEX IF EXISTS "idx_camp_country_f76ce8";
+        DROP INDEX IF EXISTS "idx_user_created_5e2aef";
+        DROP INDEX IF EXISTS "idx_user_date_of_237bd3";
+        DROP INDEX IF EXISTS "idx_user_role_065004";
+        DROP INDEX IF EXISTS "idx_user_role_759251";
+        DROP INDEX IF EXISTS "idx_user_country_2f2123";
+        DROP INDEX IF EXISTS "idx_campmember_user_id_762cf2";
+        DROP INDEX IF EXISTS "idx_campmember_camp_id_42f5d1";"""
@@ -6,6 +6,11 @@ from aerich.enums import Color
 
 from db import TORTOISE_CONFIG
 
+# Schema generated from models on fresh DB includes changes of migrations up to this one. Later migrations are applied
+# by aerich upgrade on top of it, so they create objects unknown to models (extensions, generated columns and their
+# indexes) and tolerate ones known to models, e.g. with IF NOT EXISTS
+MODELS_SCHEMA_VERSION = 17
+
 
 class ZeroCommand(aerich.Command):
     async def upgrade_zero(self):
@@ -18,9 +23,12 @@ class ZeroCommand(aerich.Command):
         migrations_dir = os.path.join(self.location, self.app)
         _, _, migration_names = next(os.walk(migrations_dir))
 
-        try:
-            version = next(one for one in migration_names if one.startswith("0_"))
-        except StopIteration:
+        versions = sorted(
+            (one for one in migration_names if one.endswith(".py") and int(one.split("_")[0]) <= MODELS_SCHEMA_VERSION),
+            key=lambda one: int(one.split("_")[0]),
+        )
+
+        if not versions or not versions[0].startswith("0_"):
             click.secho(f"{migrations_dir} does not contain zero migration")
             return
 
@@ -32,12 +40,13 @@ class ZeroCommand(aerich.Command):
             click.secho(f"Already upgraded", fg=Color.red)
             return
 
-        await aerich.Aerich.create(
-            version=version,
-            app=self.app,
-            content={},
-        )
-        click.secho(f"Success upgrade {version}", fg=Color.green)
+        for version in versions:
+            await aerich.Aerich.create(
+                version=version,
+                app=self.app,
+                content={},
+            )
+            click.secho(f"Success upgrade {version}", fg=Color.green)
 
 
 command = ZeroCommand(tortoise_config=TORTOISE_CONFIG, app="models")
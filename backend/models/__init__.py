@@ -1,4 +1,4 @@
-from tortoise.expressions import Subquery
+from tortoise.expressions import F, Subquery
 from tortoise.models import Q, QuerySet
 
 from models.camps import Camp, CampMember
@@ -23,6 +23,15 @@ class Camp(models.Model):
     country = fields.ForeignKeyField("models.Country", on_delete=fields.SET_NULL, null=True, default=None)
     # TODO: add url to badge image if any
 
+    class Meta:
+        # Orders of camp list with id tiebreaker, and country filter followed by default order
+        indexes = (
+            ("name", "id"),
+            ("created_at", "id"),
+            ("date_start", "id"),
+            ("country_id", "name", "id"),
+        )
+
     async def __admin_repr__(self, request: Request) -> str:
         return self.name
 
@@ -64,6 +73,8 @@ class CampMember(models.Model):
 
     class Meta:
         unique_together = ("camp_id", "user_id")
+        # Membership of a user by default order, members of a camp by role
+        indexes = (("user_id", "created_at", "id"), ("camp_id", "role", "id"))
 
     async def __admin_repr__(self, request: Request) -> str:
         user = self.user
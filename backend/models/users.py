@@ -1,8 +1,10 @@
+import typing as t
 from enum import Enum
 
 from fastapi import Request
 from tortoise import fields, models
 
+from core import transliteration
 from translations import lazy_gettext as _
 
 
@@ -40,13 +42,40 @@ class User(models.Model):
     last_name = fields.CharField(max_length=127, default="")
     nickname = fields.CharField(max_length=127, default="")
     date_of_birth = fields.DateField(null=True)
+    search_text = fields.TextField(
+        default="", description="Normalized and transliterated names for trigram search, maintained on save"
+    )
 
     role = fields.CharEnumField(Role, max_length=64, default=Role.BASE)
+    token_version = fields.IntField(
+        default=0, description="Incremented to invalidate issued access tokens, e.g. when role is changed"
+    )
 
     country = fields.ForeignKeyField(
         "models.Country", null=True, default=None, on_delete=fields.SET_NULL, related_name="users"
     )
 
+    class Meta:
+        # Orders of user list with id tiebreaker, and its filters followed by default order
+        indexes = (
+            ("created_at", "id"),
+            ("date_of_birth", "id"),
+            ("role", "id"),
+            ("role", "created_at", "id"),
+            ("country_id", "created_at", "id"),
+        )
+
+    async def save(self, *args, update_fields: t.Optional[t.Iterable[str]] = None, **kwargs):
+        self.search_text = self.format_search_text()
+
+        if update_fields is not None:
+            update_fields = {*update_fields, "search_text"}
+
+        await super().save(*args, update_fields=update_fields, **kwargs)
+
+    def format_search_text(self) -> str:
+        return transliteration.normalize(" ".join((self.first_name, self.last_name, self.nickname)))
+
     def full_name(self) -> str:
         return " ".join(one for one in (self.first_name, self.last_name) if one)
 
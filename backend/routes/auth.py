@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 
 import schemas.auth
 import services.auth
@@ -21,16 +21,30 @@ async def register(body: schemas.auth.RegisterBody):
 async def confirm_registration(body: schemas.auth.ConfirmRegistrationBody):
     """
     Confirm registration using unique secret code from email
+
+    Previously issued access tokens are invalidated, login again to get token of verified user
     """
     return await services.auth.ConfirmRegistration().patch(body)
 
 
+@router.post("/register/resend", status_code=204)
+async def resend_registration_code(body: schemas.auth.ResendRegistrationCodeBody, request: Request):
+    """
+    Send new registration code via email to registered user with unconfirmed email, previous code is revoked
+
+    Attempts are limited per email and per client IP, see Retry-After header of 429 response
+    """
+    return await services.auth.ResendRegistrationCode(request).post(body)
+
+
 @router.post("/login", response_model=schemas.auth.LoginResponse)
-async def login(body: schemas.auth.LoginBody):
+async def login(body: schemas.auth.LoginBody, request: Request):
     """
     Login existing user using email and password
+
+    Attempts are limited per email and per client IP, see Retry-After header of 429 response
     """
-    return await services.auth.Login().post(body)
+    return await services.auth.Login(request).post(body)
 
 
 @router.patch("/password/change", status_code=204)
@@ -42,11 +56,13 @@ async def change_password(body: schemas.auth.ChangePasswordBody, authorize: secu
 
 
 @router.post("/password/reset/request", status_code=204)
-async def forgot_password(body: schemas.auth.ForgotPasswordBody):
+async def forgot_password(body: schemas.auth.ForgotPasswordBody, request: Request):
     """
     Send secret code via email to reset password
+
+    Attempts are limited per email and per client IP, see Retry-After header of 429 response
     """
-    return await services.auth.ForgotPassword().post(body)
+    return await services.auth.ForgotPassword(request).post(body)
 
 
 @router.post("/password/reset", status_code=204)
@@ -1,28 +1,39 @@
 from fastapi import APIRouter, Depends, Query
 
+import db
+import models
 import schemas.camps
 import services.camps
+from conf import settings
 from core import security
 
 router = APIRouter(tags=["camps"])
 
+requires_camp_manager = security.requires_role(models.User.Role.ADMIN, models.User.Role.SUPER_ADMIN)
+filter_statement_timeout = db.statement_timeout(settings().DB_FILTER_STATEMENT_TIMEOUT)
+
 
 @router.get("/{camp_id}", response_model=schemas.camps.DetailResponse)
 async def detail(camp_id: int, authorize: security.Authorize = Depends()):
     return await services.camps.Detail().get(camp_id=camp_id, authorize=authorize)
 
 
-@router.post("", response_model=schemas.camps.DetailResponse, status_code=201)
-async def create(body: schemas.camps.CreateBody, authorize: security.Authorize = Depends()):
-    return await services.camps.Create().post(body=body, authorize=authorize)
+@router.post(
+    "",
+    response_model=schemas.camps.DetailResponse,
+    status_code=201,
+    dependencies=[Depends(requires_camp_manager)],
+)
+async def create(body: schemas.camps.CreateBody):
+    return await services.camps.Create().post(body=body)
 
 
-@router.delete("/{camp_id}", status_code=204)
-async def delete(camp_id: int, authorize: security.Authorize = Depends()):
-    return await services.camps.Delete().delete(camp_id=camp_id, authorize=authorize)
+@router.delete("/{camp_id}", status_code=204, dependencies=[Depends(requires_camp_manager)])
+async def delete(camp_id: int):
+    return await services.camps.Delete().delete(camp_id=camp_id)
 
 
-@router.get("", response_model=schemas.camps.FilterResponse)
+@router.get("", response_model=schemas.camps.FilterResponse, dependencies=[Depends(filter_statement_timeout)])
 async def filter(
         order_by: list[schemas.camps.FilterOrder] = Query(default=[schemas.camps.FilterOrder.NAME_ASC]),
         query: schemas.camps.FilterQuery = Depends(),
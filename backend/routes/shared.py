@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends
 
+import db
+import models
 import schemas.shared
-from core import security
+from core import metrics, redis, security
 
 router = APIRouter(tags=["shared"])
 
@@ -12,3 +14,12 @@ async def country_filter(
         authorize: security.Authorize = Depends()
 ):
     pass
+
+
+@router.get(
+    "/stats",
+    response_model=schemas.shared.StatsResponse,
+    dependencies=[Depends(security.requires_role(models.User.Role.SUPER_ADMIN))],
+)
+async def stats():
+    return {"metrics": metrics.snapshot(), "redis_pools": redis.pool_stats(), "db_pools": db.pool_stats()}
@@ -1,11 +1,17 @@
 from fastapi import APIRouter, Depends, Query
 
+import db
+import models
 import schemas.users
 import services.users
+from conf import settings
 from core import security
 
 router = APIRouter(tags=["users"])
 
+requires_super_admin = security.requires_role(models.User.Role.SUPER_ADMIN)
+filter_statement_timeout = db.statement_timeout(settings().DB_FILTER_STATEMENT_TIMEOUT)
+
 
 @router.get("/me", response_model=schemas.users.MeResponse)
 async def me(authorize: security.Authorize = Depends()):
@@ -17,7 +23,12 @@ async def detail(user_id: int, authorize: security.Authorize = Depends()):
     return await services.users.Detail().get(user_id=user_id, authorize=authorize)
 
 
-@router.get("", response_model=schemas.users.FilterResponse, response_model_by_alias=False)
+@router.get(
+    "",
+    response_model=schemas.users.FilterResponse,
+    response_model_by_alias=False,
+    dependencies=[Depends(filter_statement_timeout)],
+)
 async def filter(
         order_by: list[schemas.users.FilterOrder] = Query(default=[schemas.users.FilterOrder.CREATED_AT_DESC]),
         query: schemas.users.FilterQuery = Depends(),
@@ -26,17 +37,26 @@ async def filter(
     return await services.users.Filter().get(query=query, order_by=order_by, authorize=authorize)
 
 
-@router.post("", response_model=schemas.users.CreateResponse, status_code=201)
-async def create(body: schemas.users.CreateBody, authorize: security.Authorize = Depends()):
-    return await services.users.Create().post(body=body, authorize=authorize)
+@router.post(
+    "",
+    response_model=schemas.users.CreateResponse,
+    status_code=201,
+    dependencies=[Depends(requires_super_admin)],
+)
+async def create(body: schemas.users.CreateBody):
+    return await services.users.Create().post(body=body)
 
 
-@router.delete("/{user_id}", status_code=204)
-async def delete(user_id: int, authorize: security.Authorize = Depends()):
-    return await services.users.Delete().delete(user_id, authorize)
+@router.delete("/{user_id}", status_code=204, dependencies=[Depends(requires_super_admin)])
+async def delete(user_id: int):
+    return await services.users.Delete().delete(user_id)
 
 
-@router.get("/{user_id}/membership", response_model=schemas.users.MembershipResponse)
+@router.get(
+    "/{user_id}/membership",
+    response_model=schemas.users.MembershipResponse,
+    dependencies=[Depends(filter_statement_timeout)],
+)
 async def membership(
         user_id: int,
         order_by: list[schemas.users.MembershipOrder] = Query(default=[schemas.users.MembershipOrder.CREATED_AT_DESC]),
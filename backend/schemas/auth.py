@@ -42,6 +42,14 @@ class ConfirmRegistrationBody(BaseModel):
     code: str
 
 
+class ResendRegistrationCodeBody(BaseModel):
+    email: EmailStr
+
+    @validator("email")
+    def validate_email(cls, value: str):
+        return value.lower()
+
+
 class LoginBody(BaseModel):
     email: str
     password: str
@@ -97,6 +97,9 @@ class FilterOrder(str, Enum):
     COUNTRY_ASC = "COUNTRY_ASC"
     COUNTRY_DESC = "COUNTRY_DESC"
 
+    # Relevance to search, most relevant first. Ignored without search
+    RANK = "RANK"
+
 
 class FilterResponse(PaginatedResponse[FilterItemResponse]):
     pass
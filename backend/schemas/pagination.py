@@ -1,4 +1,5 @@
 import typing as t
+from enum import Enum
 
 from pydantic import BaseModel, conint
 from pydantic.generics import GenericModel
@@ -8,9 +9,24 @@ from conf import settings
 ResultType = t.TypeVar("ResultType")
 
 
+class CountStrategy(str, Enum):
+    """
+    How total_count of paginated response is obtained
+    """
+    EXACT = "EXACT"  # separate COUNT(*) query
+    WINDOW = "WINDOW"  # exact, COUNT(*) OVER() in the same query as the page
+    ESTIMATE = "ESTIMATE"  # Postgres planner estimate, approximate
+    CACHED = "CACHED"  # exact count cached per filter for a short time, may be stale
+    NONE = "NONE"  # no total_count and total_pages
+
+
 class PaginatedQuery(BaseModel):
     page: t.Optional[conint(gt=0)] = 1
     page_size: t.Optional[conint(gt=0, le=settings().MAX_PAGE_SIZE)] = settings().DEFAULT_PAGE_SIZE
+    # Opaque next_cursor of previous response: seek after its last row instead of skipping (page-1) pages
+    cursor: t.Optional[str] = None
+    # Overrides total count strategy of the endpoint (EXACT unless the endpoint opts into another one)
+    count: t.Optional[CountStrategy] = None
 
     def page_fields(self) -> t.Dict:
         return {"page": self.page, "page_size": self.page_size}
@@ -43,6 +59,8 @@ class PaginatedQuery(BaseModel):
         exclude = {*exclude}
         exclude.add("page")
         exclude.add("page_size")
+        exclude.add("cursor")
+        exclude.add("count")
 
         return self.dict(
             include=include,
@@ -59,10 +77,13 @@ class PaginatedResponse(GenericModel, t.Generic[ResultType]):
     page: int
     page_size: int
 
-    total_pages: int
-    total_count: int
+    total_pages: t.Optional[int]
+    total_count: t.Optional[int]
+    count_strategy: CountStrategy
 
     results: t.List[ResultType]
+    # Pass as cursor to get the next page, None on the last page or for ordering by relevance, which is paged by page
+    next_cursor: t.Optional[str] = None
 
     @classmethod
     def get_result_type(cls) -> t.Type[ResultType]:
@@ -33,3 +33,26 @@ class CountryFilterItemResponse(pydantic.BaseModel):
 
 class CountryFilterResponse(PaginatedResponse[CountryFilterItemResponse]):
     pass
+
+
+class RedisPoolStats(pydantic.BaseModel):
+    max_connections: int
+    created: int
+    in_use: int
+    idle: int
+    waiting: int
+
+
+class DBPoolStats(pydantic.BaseModel):
+    min_size: int
+    max_size: int
+    size: int
+    acquired: int
+    idle: int
+    waiting: int
+
+
+class StatsResponse(pydantic.BaseModel):
+    metrics: t.Dict[str, t.Dict[str, t.Any]]
+    redis_pools: t.Dict[str, RedisPoolStats]  # by node, only nodes with initialized pools are listed
+    db_pools: t.Dict[str, DBPoolStats]  # by Tortoise connection name
@@ -2,13 +2,15 @@ import redis
 
 import models
 import schemas.auth
-from core import errors, mail, redis, security
+from core import errors, hashing, mail, redis, security, throttling
 from services.base import BaseService
 
 
 class Register(BaseService):
     async def post(self, body: schemas.auth.RegisterBody) -> schemas.auth.RegisterResponse:
-        body.password = security.hash_password(body.password)
+        # User without registration code couldn't confirm email, so don't create one while Redis is down
+        redis.check_available()
+        body.password = await hashing.hash_password(body.password)
         user = await self.get_or_create_user(body)
 
         code = await redis.generate_code(user.id, redis.CodeType.REGISTER)
@@ -16,7 +18,7 @@ class Register(BaseService):
 
         authorize = security.Authorize()
         return schemas.auth.RegisterResponse(
-            access_token=authorize.create_access_token(user.id),
+            access_token=authorize.create_user_access_token(user),
             refresh_token=authorize.create_refresh_token(user.id),
         )
 
@@ -36,16 +38,16 @@ class ConfirmRegistration(BaseService):
         user_id = await self.user_id_or_400(body.code)
         user = await self.user_or_400(user_id)
         user.is_email_verified = True
+        # Verification status is part of access token claims, so tokens issued before confirmation are invalidated
+        user.token_version += 1
         await user.save()
 
     async def user_id_or_400(self, code) -> int:
-        user_id = await redis.check_code(code, redis.CodeType.REGISTER)
+        user_id = await redis.consume_code(code, redis.CodeType.REGISTER)
 
         if user_id is None:
             raise self.HttpException400(errors.INVALID_CODE)
 
-        await redis.delete_code(code, redis.CodeType.REGISTER)
-
         try:
             user_id = int(user_id)
         except ValueError:
@@ -62,14 +64,30 @@ class ConfirmRegistration(BaseService):
         return user
 
 
+class ResendRegistrationCode(BaseService):
+    async def post(self, body: schemas.auth.ResendRegistrationCodeBody) -> None:
+        await throttling.register_resend.check(body.email, self.request)
+        user = await models.User.get_or_none(email=body.email, is_email_verified=False, password__isnull=False)
+
+        # Users without password get the code by registering
+        if user is None:
+            return
+
+        # Replaces previous registration code of the user
+        code = await redis.generate_code(user.id, redis.CodeType.REGISTER)
+        await mail.send(mail.EmailType.REGISTRATION, code=code)
+
+
 class Login(BaseService):
     async def post(self, body: schemas.auth.LoginBody) -> schemas.auth.LoginResponse:
+        await throttling.login.check(body.email, self.request)
         user = await self.user_or_401(body.email)
-        self.validate_password(body.password, user.password)
+        await self.validate_password(body.password, user.password)
+        await self.rehash_password(user, body.password)
 
         authorize = security.Authorize()
         return schemas.auth.LoginResponse(
-            access_token=authorize.create_access_token(user.id),
+            access_token=authorize.create_user_access_token(user),
             refresh_token=authorize.create_refresh_token(user.id),
         )
 
@@ -81,22 +99,29 @@ class Login(BaseService):
 
         return user
 
-    def validate_password(self, plain_password: str, hashed_password: str):
-        is_valid = security.verify_password(plain_password, hashed_password)
+    async def validate_password(self, plain_password: str, hashed_password: str):
+        is_valid = await hashing.verify_password(plain_password, hashed_password)
 
         if not is_valid:
             raise self.HttpException401(errors.INVALID_LOGIN)
 
+    async def rehash_password(self, user: models.User, plain_password: str):
+        password = await hashing.rehash_password(plain_password, user.password)
+
+        if password is not None:
+            user.password = password
+            await user.save(update_fields=["password"])
+
 
 class ChangePassword(BaseService):
     async def patch(self, body: schemas.auth.ChangePasswordBody, authorize: security.Authorize) -> None:
-        user = await authorize.user_or_401()
-        self.validate_password(body.old_password, user.password)
-        user.password = security.hash_password(body.new_password)
+        user = await authorize.user_or_401(complete=True)
+        await self.validate_password(body.old_password, user.password)
+        user.password = await hashing.hash_password(body.new_password)
         await user.save()
 
-    def validate_password(self, plain_password: str, hashed_password: str):
-        is_valid = security.verify_password(plain_password, hashed_password)
+    async def validate_password(self, plain_password: str, hashed_password: str):
+        is_valid = await hashing.verify_password(plain_password, hashed_password)
 
         if not is_valid:
             raise self.HttpException401(errors.INVALID_PASSWORD)
@@ -104,6 +129,7 @@ class ChangePassword(BaseService):
 
 class ForgotPassword(BaseService):
     async def post(self, body: schemas.auth.ForgotPasswordBody) -> None:
+        await throttling.forgot_password.check(body.email, self.request)
         user = await models.User.get_or_none(email=body.email)
 
         if user is None:
@@ -117,18 +143,16 @@ class ResetPassword(BaseService):
     async def post(self, body: schemas.auth.ResetPasswordBody) -> None:
         user_id = await self.user_id_or_400(body.code)
         user = await self.user_or_400(user_id)
-        user.password = security.hash_password(body.password)
+        user.password = await hashing.hash_password(body.password)
         await user.save()
 
     # noinspection DuplicatedCode
     async def user_id_or_400(self, code):
-        user_id = await redis.check_code(code, redis.CodeType.FORGOT_PASSWORD)
+        user_id = await redis.consume_code(code, redis.CodeType.FORGOT_PASSWORD)
 
         if user_id is None:
             raise self.HttpException400(errors.INVALID_CODE)
 
-        await redis.delete_code(code, redis.CodeType.FORGOT_PASSWORD)
-
         try:
             user_id = int(user_id)
         except ValueError:
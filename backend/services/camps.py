@@ -1,9 +1,11 @@
 import typing as t
 from datetime import date
 
+import db
 import models
 import schemas.camps
 from core import errors, security
+from db.functions import date_range_overlap, prefix_tsquery, text_search_match, text_search_rank
 from services import utils
 from services.base import BaseService
 
@@ -20,13 +22,8 @@ class Detail(BaseService):
 
 
 class Create(BaseService):
-    async def post(self, body: schemas.camps.CreateBody, authorize: security.Authorize) -> schemas.camps.DetailResponse:
-        user = await authorize.user_or_401()
-
-        can_create = user.role in (models.User.Role.ADMIN, models.User.Role.SUPER_ADMIN)
-        if not can_create:
-            raise self.HttpException403()
-
+    @db.atomic
+    async def post(self, body: schemas.camps.CreateBody) -> schemas.camps.DetailResponse:
         await self.validate_country(body.country_id)
 
         camp = await models.Camp.create(**body.dict(exclude_none=True))
@@ -44,13 +41,7 @@ class Create(BaseService):
 
 
 class Delete(BaseService):
-    async def delete(self, camp_id: int, authorize: security.Authorize) -> None:
-        user = await authorize.user_or_401()
-
-        can_delete = user.role in (models.User.Role.ADMIN, models.User.Role.SUPER_ADMIN)
-        if not can_delete:
-            raise self.HttpException403()
-
+    async def delete(self, camp_id: int) -> None:
         deleted_count = await models.Camp.filter(id=camp_id).delete()
         if not deleted_count:
             raise self.HttpException404()
@@ -73,13 +64,12 @@ class Filter(BaseService):
         queryset = models.Camp.filter(**filter_kwargs).select_related("country")
 
         if query.search:
-            queryset = queryset.filter(self.format_search_filter(query.search))
+            queryset = self.search(queryset, query.search)
 
         if query.date_from or query.date_till:
-            queryset = queryset.filter(self.format_date_range_filter(query.date_from, query.date_till))
+            queryset = self.filter_date_range(queryset, query.date_from, query.date_till)
 
-        queryset = queryset.order_by(*self.format_order(order_by))
-        queryset = utils.paginate_queryset(queryset, query)
+        queryset = queryset.order_by(*self.format_order(order_by, is_ranked="search_rank" in queryset._annotations))
 
         return await utils.paginate_response(queryset, query, schemas.camps.FilterResponse)
 
@@ -88,8 +78,58 @@ class Filter(BaseService):
         if not exists:
             raise self.HttpException400(errors.INVALID_COUNTRY_ID)
 
+    def search(self, queryset: models.QuerySet, search: str) -> models.QuerySet:
+        """
+        Full-text search over name, location and description by search_document generated column on Postgres
+        :param queryset:
+        :param search:
+        :return: queryset annotated with search_rank on Postgres
+        """
+        if models.Camp._meta.db.capabilities.dialect != "postgres":
+            return queryset.filter(self.format_search_filter(search))
+
+        tsquery = prefix_tsquery(search)
+
+        if tsquery is None:
+            return queryset
+
+        return queryset.annotate(
+            search_match=text_search_match(models.Camp, "search_document", tsquery),
+            search_rank=text_search_rank(models.Camp, "search_document", tsquery),
+        ).filter(search_match=True)
+
     def format_search_filter(self, search: str) -> models.Q:
-        return models.Q(location__icontains=search, name__icontains=search, join_type=models.Q.OR)
+        return models.Q(
+            location__icontains=search,
+            name__icontains=search,
+            description__icontains=search,
+            join_type=models.Q.OR,
+        )
+
+    def filter_date_range(
+            self, queryset: models.QuerySet, date_from: t.Optional[date], date_till: t.Optional[date]
+    ) -> models.QuerySet:
+        """
+        Camps with [date_start, date_end] overlapping [date_from, date_till] by date_range generated column on Postgres
+
+        Camp with only one of the dates is treated as a single day camp, camp without dates never matches.
+        Camp with date_start > date_end has no date_range and matches by either of its dates as before
+        :param queryset:
+        :param date_from: None for no lower limit
+        :param date_till: None for no upper limit
+        :return:
+        """
+        date_range_filter = self.format_date_range_filter(date_from, date_till)
+
+        if models.Camp._meta.db.capabilities.dialect != "postgres":
+            return queryset.filter(date_range_filter)
+
+        # Rare reversed camps are read by partial index idx_camp_reversed_dates
+        reversed_filter = models.Q(models.Q(date_start__gt=models.F("date_end")), date_range_filter)
+
+        return queryset.annotate(
+            date_range_match=date_range_overlap(models.Camp, "date_range", date_from, date_till),
+        ).filter(models.Q(date_range_match=True) | reversed_filter)
 
     def format_date_range_filter(self, date_from: t.Optional[date], date_till: t.Optional[date]) -> models.Q:
         date_from = date_from or date.min
@@ -105,7 +145,7 @@ class Filter(BaseService):
         date_range_overlaps = models.Q(date_start__lte=date_from, date_end__gte=date_till, join_type=models.Q.AND)
         return models.Q(date_start_overlaps, date_end_overlaps, date_range_overlaps, join_type=models.Q.OR)
 
-    def format_order(self, order_by: list[schemas.camps.FilterOrder]) -> list[str]:
+    def format_order(self, order_by: list[schemas.camps.FilterOrder], is_ranked: bool = False) -> list[str]:
         # noinspection PyPep8Naming
         Order = schemas.camps.FilterOrder
 
@@ -121,5 +161,7 @@ class Filter(BaseService):
 
             Order.NAME_ASC: "name",
             Order.NAME_DESC: "-name",
+
+            Order.RANK: "-search_rank",
         }
-        return [order_map[one] for one in order_by]
+        return [order_map[one] for one in order_by if is_ranked or one != Order.RANK]
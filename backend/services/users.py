@@ -3,9 +3,11 @@ from datetime import date, timedelta
 
 from dateutil.relativedelta import relativedelta
 
+import db
 import models
 import schemas.users
-from core import errors, security
+from core import errors, security, transliteration
+from db.functions import WordSimilarity, trigram_match
 from services import utils
 from services.base import BaseService
 
@@ -49,7 +51,7 @@ class Filter(BaseService):
             queryset = queryset.filter(self.format_membership__role_filter(query.membership__role))
 
         if query.search:
-            queryset = queryset.filter(self.format_search_filter(query.search))
+            queryset = self.search(queryset, query.search)
 
         if query.age:
             queryset = queryset.filter(self.format_age_filter(query.age))
@@ -57,9 +59,18 @@ class Filter(BaseService):
         if query.age__gte or query.age__lte:
             queryset = queryset.filter(self.format_age_range_filter(age__gte=query.age__gte, age__lte=query.age__lte))
 
-        queryset = queryset.order_by(*self.format_order(order_by))
+        ordering = self.format_order(order_by)
+
+        if "search_rank" in queryset._annotations:
+            ordering = ["-search_rank", *ordering]
 
-        return await utils.paginate_response(queryset, request_query=query, response_model=schemas.users.FilterResponse)
+        queryset = queryset.order_by(*ordering)
+
+        return await utils.paginate_response(
+            queryset,
+            request_query=query,
+            response_model=schemas.users.FilterResponse,
+        )
 
     async def validate(self, query: schemas.users.FilterQuery, authorize: security.Authorize):
         await authorize.user_or_401()
@@ -95,13 +106,25 @@ class Filter(BaseService):
         user_id_subquery = models.CampMember.filter(role=role).group_by("user_id").values("user_id")
         return models.Q(id__in=models.Subquery(user_id_subquery))
 
-    def format_search_filter(self, search: str) -> models.Q:
-        return models.Q(
-            first_name__icontains=search,
-            last_name__icontains=search,
-            nickname__icontains=search,
-            join_type=models.Q.OR,
-        )
+    def search(self, queryset: models.QuerySet, search: str) -> models.QuerySet:
+        """
+        Match names in either alphabet by normalized search_text, on Postgres also by trigram similarity
+        :param queryset:
+        :param search:
+        :return: queryset annotated with search_rank on Postgres
+        """
+        search = transliteration.normalize(search)
+
+        if not search:
+            return queryset
+
+        if models.User._meta.db.capabilities.dialect != "postgres":
+            return queryset.filter(search_text__contains=search)
+
+        return queryset.annotate(
+            search_match=trigram_match(models.User, "search_text", search),
+            search_rank=WordSimilarity("search_text", search),
+        ).filter(search_match=True)
 
     def format_order(self, order_by: list[schemas.users.FilterOrder]) -> list[str]:
         # noinspection PyPep8Naming
@@ -123,10 +146,8 @@ class Filter(BaseService):
 
 
 class Create(BaseService):
-    async def post(self, body: schemas.users.CreateBody, authorize: security.Authorize) -> schemas.users.CreateResponse:
-        creator = await authorize.user_or_401()
-        await self.validate_permission(creator)
-
+    @db.atomic
+    async def post(self, body: schemas.users.CreateBody) -> schemas.users.CreateResponse:
         if body.email:
             await self.validate_email(body.email)
 
@@ -151,18 +172,9 @@ class Create(BaseService):
         if not is_valid:
             raise self.HttpException400(errors.INVALID_COUNTRY_ID)
 
-    async def validate_permission(self, user: models.User):
-        if user.role != models.User.Role.SUPER_ADMIN:
-            raise self.HttpException403()
-
 
 class Delete(BaseService):
-    async def delete(self, user_id: int, authorize: security.Authorize) -> None:
-        creator = await authorize.user_or_401()
-
-        if creator.role != models.User.Role.SUPER_ADMIN:
-            raise self.HttpException403()
-
+    async def delete(self, user_id: int) -> None:
         user = await models.User.get_or_none(id=user_id)
         if user is None:
             raise self.HttpException404()
@@ -188,7 +200,9 @@ class Membership(BaseService):
         queryset = queryset.order_by(*self.format_order(order_by))
 
         return await utils.paginate_response(
-            queryset, request_query=query, response_model=schemas.users.MembershipResponse
+            queryset,
+            request_query=query,
+            response_model=schemas.users.MembershipResponse,
         )
 
     def format_order(self, order_by: list[schemas.users.MembershipOrder]) -> list[str]:
@@ -1,47 +1,453 @@
+import base64
+import binascii
+import hashlib
+import json
 import typing as t
+from datetime import date, datetime
+from functools import lru_cache
 
+import pydantic
+from pypika import Order
+from tortoise.expressions import RawSQL
+from tortoise.fields import Field
+from tortoise.models import Model
+
+import db
 import models
 import schemas.pagination
+from conf import settings
+from core import errors, redis
+from services.base import BaseService
 
 ResponseModel = t.TypeVar("ResponseModel", bound=schemas.pagination.PaginatedResponse)
+CountStrategy = schemas.pagination.CountStrategy
+
+TIEBREAKER = "id"
+WINDOW_COUNT = "window_total_count"
+
+
+def get_orderings(queryset: models.QuerySet) -> t.List[t.Tuple[str, Order]]:
+    """
+    Orderings of the queryset with id as the last one, so every row has unique sort key
+
+    Id follows direction of the last sort key, so (key, id) index is scanned in one direction without sorting
+    :param queryset:
+    :return: list of (field, order) tuples
+    """
+    orderings = list(queryset._orderings)
+
+    if not any(field == TIEBREAKER for field, _ in orderings):
+        orderings.append((TIEBREAKER, orderings[-1][1] if orderings else Order.asc))
+
+    return orderings
+
+
+def _encode_value(value: t.Any) -> t.Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    return value
+
+
+def _get_field(model: t.Type[Model], path: str) -> t.Optional[Field]:
+    """
+    :param model:
+    :param path: field of the model or of related ones, e.g. country__name_ukr
+    :return: model field or None for annotations, e.g. search_rank
+    """
+    *relations, name = path.split("__")
+
+    for relation in relations:
+        model = model._meta.fields_map[relation].related_model
+
+    return model._meta.fields_map.get(name)
+
+
+def _is_nullable(model: t.Type[Model], path: str) -> bool:
+    """
+    :param model:
+    :param path: field of the model or of related ones, e.g. country__name_ukr
+    :return: whether sort key may be NULL: nullable column, column of optional relation or annotation
+    """
+    *relations, name = path.split("__")
+
+    for relation in relations:
+        field = model._meta.fields_map[relation]
+
+        if field.null:
+            return True
+
+        model = field.related_model
+
+    field = model._meta.fields_map.get(name)
+    return field is None or field.null
+
+
+def _decode_value(field: t.Optional[Field], value: t.Any) -> t.Any:
+    if value is None:
+        return None
+
+    # Only scalars are encoded, the rest would be compared as whatever the database makes of them
+    if not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid sort key value {value!r}")
+
+    if field is None:
+        return value
+
+    return field.to_python_value(value)
+
+
+def is_seekable(model: t.Type[Model], orderings: t.List[t.Tuple[str, Order]]) -> bool:
+    """
+    Whether cursor can seek by the ordering: every sort key is a model field. Annotations such as float search_rank
+    don't survive JSON round trip of the cursor exactly, so rows with close or equal rank would be skipped or repeated
+    :param model:
+    :param orderings:
+    :return:
+    """
+    return all(_get_field(model, field) is not None for field, _ in orderings)
+
+
+def _ordering_key(orderings: t.List[t.Tuple[str, Order]]) -> t.List[str]:
+    return [f"{'-' if order == Order.desc else ''}{field}" for field, order in orderings]
+
+
+def encode_cursor(row: t.Dict[str, t.Any], orderings: t.List[t.Tuple[str, Order]]) -> str:
+    """
+    Opaque cursor pointing after the row: its sort key values along with the ordering they belong to
+    :param row: last row of the page as returned by .values(), sort fields included
+    :param orderings:
+    :return:
+    """
+    values = [_encode_value(row[field]) for field, _ in orderings]
+    payload = json.dumps({"order": _ordering_key(orderings), "values": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, orderings: t.List[t.Tuple[str, Order]], model: t.Type[Model]) -> t.List[t.Any]:
+    """
+    :param cursor:
+    :param orderings: ordering of the current query, must be the same as the cursor was created with
+    :param model: model of the query, its fields convert sort key values
+    :return: sort key values
+    :raise BaseService.HttpException400: if cursor is malformed, belongs to other ordering or has values of wrong type
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        is_valid = payload["order"] == _ordering_key(orderings) and len(payload["values"]) == len(orderings)
+        values = [
+            _decode_value(_get_field(model, field), value)
+            for (field, _), value in zip(orderings, payload["values"])
+        ]
+    except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+        is_valid = False
+
+    if not is_valid:
+        raise BaseService.HttpException400(errors.INVALID_CURSOR)
+
+    return values
+
+
+def _seek_bound(field: str, order: Order, value: t.Any, nulls_after: bool) -> t.Optional[models.Q]:
+    """
+    Leading sort key of following rows is the same as or after the value: implied by the seek filter, but unlike
+    its disjunction Postgres uses it as start of the ordered index scan
+    :param field:
+    :param order:
+    :param value:
+    :param nulls_after: whether NULLs of nullable key follow other values in this ordering
+    :return: condition or None if all rows match it
+    """
+    if value is None:
+        return models.Q(**{f"{field}__isnull": True}) if nulls_after else None
+
+    bound = models.Q(**{f"{field}__{'lte' if order == Order.desc else 'gte'}": value})
+
+    if nulls_after:
+        # Disjunction again, so cursor pages of nullable ascending keys (descending in SQLite) aren't bounded by index
+        bound = models.Q(bound, models.Q(**{f"{field}__isnull": True}), join_type=models.Q.OR)
+
+    return bound
+
+
+def format_seek_filter(
+        orderings: t.List[t.Tuple[str, Order]],
+        values: t.List[t.Any],
+        nulls_last: bool,
+        model: t.Type[Model],
+) -> models.Q:
+    """
+    Rows following the row with given sort key: a > x OR (a = x AND id > y) expanded per column, so it works for
+    mixed ascending / descending orderings and nullable columns, AND a >= x bound of the leading column for index scan
+    :param orderings:
+    :param values: sort key values of the last seen row
+    :param nulls_last: whether the database puts NULLs after other values in ascending order (Postgres does, SQLite not)
+    :param model: model of the query, NULLs are considered only for its nullable sort keys
+    :return:
+    """
+    conditions = []
+    # Whether NULLs follow other values of the sort key
+    nulls_after = [nulls_last != (order == Order.desc) and _is_nullable(model, field) for field, order in orderings]
+
+    for index, ((field, order), value) in enumerate(zip(orderings, values)):
+        is_desc = order == Order.desc
+
+        if value is None:
+            after = models.Q(**{f"{field}__isnull": False}) if not nulls_after[index] else None
+        else:
+            after = models.Q(**{f"{field}__{'lt' if is_desc else 'gt'}": value})
+
+            if nulls_after[index]:
+                after = models.Q(after, models.Q(**{f"{field}__isnull": True}), join_type=models.Q.OR)
+
+        if after is not None:
+            equal = [
+                models.Q(**{f"{prev_field}__isnull": True} if prev_value is None else {prev_field: prev_value})
+                for (prev_field, _), prev_value in zip(orderings[:index], values[:index])
+            ]
+            conditions.append(models.Q(*equal, after, join_type=models.Q.AND))
+
+    if not conditions:
+        # Cursor points after the last row
+        return models.Q(id__isnull=True)
+
+    seek_filter = models.Q(*conditions, join_type=models.Q.OR)
+
+    if len(conditions) == 1:
+        return seek_filter
+
+    (field, order), value = orderings[0], values[0]
+    bound = _seek_bound(field, order, value, nulls_after[0])
+
+    if bound is None:
+        return seek_filter
+
+    return models.Q(bound, seek_filter, join_type=models.Q.AND)
 
 
 def paginate_queryset(queryset: models.QuerySet, paginated_query: schemas.pagination.PaginatedQuery) -> models.QuerySet:
     """
     Paginate query according to provided schemas.pagination.PaginatedQuery instance (or instance of subclass)
+
+    With cursor the page starts right after the row the cursor points to, otherwise (page-1) pages are skipped
     :param queryset:
     :param paginated_query:
     :return: paginated queryset
+    :raise BaseService.HttpException400: if cursor is given for ordering which is not seekable, e.g. by search_rank
     """
+    orderings = get_orderings(queryset)
+    queryset = queryset.order_by(*_ordering_key(orderings))
+
+    if paginated_query.cursor:
+        if not is_seekable(queryset.model, orderings):
+            raise BaseService.HttpException400(errors.INVALID_CURSOR)
+
+        values = decode_cursor(paginated_query.cursor, orderings, queryset.model)
+        nulls_last = queryset.model._meta.db.capabilities.dialect == "postgres"
+        seek_filter = format_seek_filter(orderings, values, nulls_last, queryset.model)
+        return queryset.filter(seek_filter).limit(paginated_query.page_size)
+
     offset = (paginated_query.page - 1) * paginated_query.page_size
     return queryset.offset(offset).limit(paginated_query.page_size)
 
 
+def _nested_schema(field: pydantic.fields.ModelField) -> t.Optional[t.Type[pydantic.BaseModel]]:
+    if isinstance(field.type_, type) and issubclass(field.type_, pydantic.BaseModel):
+        return field.type_
+
+    return None
+
+
+@lru_cache()
+def get_projection(schema: t.Type[pydantic.BaseModel], prefix: str = "") -> t.Tuple[str, ...]:
+    """
+    Fields to fetch with .values() for the schema, nested schemas are fetched from related models
+    :param schema: e.g. schemas.camps.FilterItemResponse -> ("id", ..., "country__id", "country__name_ukr", ...)
+    :param prefix:
+    :return:
+    """
+    fields = []
+
+    for name, field in schema.__fields__.items():
+        nested = _nested_schema(field)
+
+        if nested is not None:
+            fields.extend(get_projection(nested, f"{prefix}{name}__"))
+        else:
+            fields.append(f"{prefix}{name}")
+
+    return tuple(fields)
+
+
+def build_result(row: t.Dict[str, t.Any], schema: t.Type[pydantic.BaseModel], prefix: str = "") -> pydantic.BaseModel:
+    """
+    Schema instance from a row of .values() without validation: values are already converted by model fields
+    :param row:
+    :param schema:
+    :param prefix:
+    :return:
+    """
+    data = {}
+
+    for name, field in schema.__fields__.items():
+        nested = _nested_schema(field)
+
+        if nested is None:
+            data[name] = row[f"{prefix}{name}"]
+            continue
+
+        nested_prefix = f"{prefix}{name}__"
+        # Related row is missing (LEFT JOIN on nullable foreign key) when all of its columns are NULL
+        is_missing = all(row[one] is None for one in get_projection(nested, nested_prefix))
+        data[name] = None if is_missing else build_result(row, nested, nested_prefix)
+
+    return schema.construct(**data)
+
+
+async def fetch_rows(queryset: models.QuerySet, schema: t.Type[pydantic.BaseModel], *extra_fields: str) -> t.List[dict]:
+    """
+    Fetch only columns of the schema (and extra fields, e.g. sort keys) instead of full model instances
+    :param queryset:
+    :param schema:
+    :param extra_fields:
+    :return: rows with related fields flattened as relation__field
+    """
+    fields = dict.fromkeys([*get_projection(schema), *extra_fields])
+    return await queryset.values(*fields)
+
+
+async def estimate_count(queryset: models.QuerySet) -> t.Optional[int]:
+    """
+    Row count estimated by Postgres planner without running the query
+    :param queryset:
+    :return: estimate or None if database is not Postgres
+    """
+    connection = queryset._choose_db()
+
+    if connection.capabilities.dialect != "postgres":
+        return None
+
+    rows = await connection.execute_query_dict(f"EXPLAIN (FORMAT JSON) {queryset._clone().sql()}")
+    plan = rows[0]["QUERY PLAN"]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def cached_count(queryset: models.QuerySet) -> int:
+    """
+    Exact count cached in Redis for PAGINATION_COUNT_CACHE_TTL seconds, keyed by hash of the count query
+    :param queryset:
+    :return:
+    """
+    sql = queryset.count().sql()
+    key = f"count:{queryset.model.__name__}:{hashlib.sha1(sql.encode()).hexdigest()}"
+    connection, node = redis.get_connection(key), redis.node_of(key)
+
+    cached = await redis.call(connection.get, key, node=node, fallback=None)
+    if cached is not None:
+        return int(cached)
+
+    total_count = await queryset.count()
+    await redis.call(
+        connection.set, key, total_count, ex=settings().PAGINATION_COUNT_CACHE_TTL, node=node, fallback=None
+    )
+    return total_count
+
+
+async def get_total_count(
+        queryset: models.QuerySet,
+        strategy: CountStrategy,
+) -> t.Tuple[t.Optional[int], CountStrategy]:
+    """
+    Total count of the queryset with given strategy, falling back to exact count where the strategy can't be applied
+    :param queryset: not paginated queryset
+    :param strategy: any but WINDOW, which is counted within the page query
+    :return: total count and actually used strategy
+    """
+    if strategy == CountStrategy.NONE:
+        return None, strategy
+
+    if strategy == CountStrategy.ESTIMATE:
+        estimate = await estimate_count(queryset)
+
+        # Estimates of small result sets are too rough to show while exact count is cheap
+        if estimate is not None and estimate >= settings().PAGINATION_ESTIMATE_THRESHOLD:
+            return estimate, strategy
+
+    if strategy == CountStrategy.CACHED:
+        return await cached_count(queryset), strategy
+
+    return await queryset.count(), CountStrategy.EXACT
+
+
 async def paginate_response(
         queryset: models.QuerySet,
         request_query: schemas.pagination.PaginatedQuery,
         response_model: t.Type[schemas.pagination.PaginatedResponse],
+        count_strategy: CountStrategy = CountStrategy.EXACT,
 ) -> ResponseModel:
     """
     Return standardized paginated response
     :param queryset:
     :param request_query:
     :param response_model:
+    :param count_strategy: default of the endpoint, request may override it with count query param.
+    Approximate (ESTIMATE) and possibly stale (CACHED) counts or none at all are opt-in
     :return:
     """
-    total_count = await queryset.count()
-    total_pages = total_count // request_query.page_size
+    strategy = request_query.count or count_strategy
+
+    if strategy == CountStrategy.WINDOW and request_query.cursor:
+        # Window after the seek would count only following rows
+        strategy = CountStrategy.EXACT
+
+    # One extra row tells whether there is a next page
+    page_queryset = paginate_queryset(queryset, request_query).limit(request_query.page_size + 1)
+
+    if strategy == CountStrategy.WINDOW:
+        # Window is computed before LIMIT, so it counts all rows matching the filters
+        page_queryset = page_queryset.annotate(**{WINDOW_COUNT: RawSQL("COUNT(*) OVER()")})
+
+    result_type = response_model.get_result_type()
+    orderings = get_orderings(queryset)
+    extra_fields = [field for field, _ in orderings]
+
+    if strategy == CountStrategy.WINDOW:
+        rows = await fetch_rows(page_queryset, result_type, *extra_fields, WINDOW_COUNT)
+        total_count = rows[0][WINDOW_COUNT] if rows else 0
+
+        if not rows and request_query.page > 1:
+            # Page is past the end, count it separately
+            total_count, strategy = await get_total_count(queryset, CountStrategy.EXACT)
+    else:
+        # Count doesn't depend on the page, so both queries run at the same time on separate connections
+        rows, (total_count, strategy) = await db.concurrently(
+            fetch_rows(page_queryset, result_type, *extra_fields),
+            get_total_count(queryset, strategy),
+        )
+
+    rows, has_next = rows[:request_query.page_size], len(rows) > request_query.page_size
+
+    total_pages = None
+    if total_count is not None:
+        total_pages = total_count // request_query.page_size
+
+        if total_count % request_query.page_size:
+            total_pages += 1
 
-    if total_count % request_query.page_size:
-        total_pages += 1
+    results = [build_result(one, result_type) for one in rows]
+    next_cursor = None
+    if has_next and is_seekable(queryset.model, orderings):
+        next_cursor = encode_cursor(rows[-1], orderings)
 
-    results = [
-        response_model.get_result_type().from_orm(one)
-        for one in await paginate_queryset(queryset, request_query)
-    ]
     return response_model(
         results=results,
         total_count=total_count,
         total_pages=total_pages,
+        count_strategy=strategy,
+        next_cursor=next_cursor,
         **request_query.page_fields(),
     )
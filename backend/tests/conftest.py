@@ -1,11 +1,22 @@
 import asyncio
+import os
 
 import pytest
+from fakeredis.aioredis import FakeRedis
 from httpx import AsyncClient
+from tortoise import Tortoise
+from tortoise.backends.base.config_generator import generate_config
+from tortoise.backends.base.executor import EXECUTOR_CACHE
+from tortoise.contrib import test as tortoise_test
 from tortoise.contrib.test import finalizer, initializer
+from tortoise.router import router as tortoise_router
+from tortoise.transactions import current_transaction_map
 
+import models
 from conf import settings
 from core import redis, security
+from core.hash_ring import HashRing
+from db import routing
 from main import app
 
 BASE_TEST_CLIENT_URL = "http://test"
@@ -16,6 +27,10 @@ class TestClient(AsyncClient):
         token = security.Authorize().create_access_token(user_id)
         self.headers["Authorization"] = f"Bearer {token}"
 
+    def authorize_with_claims(self, user):
+        token = security.Authorize().create_user_access_token(user)
+        self.headers["Authorization"] = f"Bearer {token}"
+
     # noinspection SpellCheckingInspection
     def unauthorize(self):
         self.headers.pop("Authorization", None)
@@ -25,12 +40,71 @@ class TestClient(AsyncClient):
         return "Authorization" in self.headers
 
 
+def init_test_db(db_url: str, monkeypatch):
+    """
+    Test initializer names connection after the app, name it as app config does instead, see routing.PRIMARY
+    :param db_url:
+    :param monkeypatch:
+    :return:
+    """
+    def get_db_config(app_label: str, modules) -> dict:
+        return generate_config(db_url, app_modules={app_label: modules}, testing=True, connection_label=routing.PRIMARY)
+
+    monkeypatch.setattr(tortoise_test, "getDBConfig", get_db_config)
+    initializer(["models"], db_url=db_url)
+
+
 # Issue with newer Tortoise versions https://github.com/tortoise/tortoise-orm/issues/1110
 @pytest.fixture()
-def db():
-    initializer(["models"], db_url=settings().DB_URL)
+def db(monkeypatch):
+    init_test_db(settings().DB_URL, monkeypatch)
+    yield
+    finalizer()
+    # Every test starts with fresh DB and reuses ids
+    security.user_cache.clear()
+    security.token_cache.clear()
+
+
+@pytest.fixture()
+async def stale_replica(db, monkeypatch):
+    """
+    Reads are routed by ReplicaRouter to separate SQLite DB, which gets data of primary only on catch_up() call
+    :return: catch_up coroutine function
+    """
+    monkeypatch.setattr(settings(), "DB_REPLICA_URLS", ["sqlite://:memory:"])
+    name = routing.replica_names(1)[0]
+    primary = models.User._meta.db
+
+    await Tortoise._init_connections({name: "sqlite://:memory:"}, create_db=False)
+    replica = Tortoise.get_connection(name)
+    # Test initializer leaves no registered connections, unrouted queries are ambiguous with two of them
+    monkeypatch.setitem(Tortoise._connections, primary.connection_name, primary)
+    monkeypatch.setattr(tortoise_router, "_routers", [routing.ReplicaRouter()])
+
+    async def catch_up():
+        await primary._connection.backup(replica._connection)
+
+    yield catch_up
+
+    await replica.close()
+    Tortoise._connections.pop(name)
+    current_transaction_map.pop(name)
+
+
+# Run with `make test-postgres` for features SQLite doesn't have, schema is generated from models as for `db`
+@pytest.fixture()
+def postgres_db(monkeypatch):
+    db_url = os.environ.get("POSTGRES_URL")
+
+    if not db_url:
+        pytest.skip("POSTGRES_URL is not set")
+
+    # Queries are cached by connection name, which is the same for SQLite of other tests
+    EXECUTOR_CACHE.clear()
+    init_test_db(db_url, monkeypatch)
     yield
     finalizer()
+    EXECUTOR_CACHE.clear()
 
 
 @pytest.fixture(scope="session")
@@ -46,10 +120,43 @@ def event_loop():
 @pytest.fixture()
 async def redis_cleanup(event_loop):
     yield
-    await redis.connection.flushdb()
+    for connection in redis.get_connections().values():
+        await connection.flushdb()
+
+    redis._breakers.clear()
+
+
+@pytest.fixture()
+def sharded_redis(redis_cleanup, monkeypatch):
+    """
+    Spread keys over several FakeRedis nodes
+    """
+    ring = HashRing(f"fake-{index}" for index in range(3))
+    monkeypatch.setattr(redis, "_ring", ring)
+    monkeypatch.setattr(redis, "_connections", {node: FakeRedis(decode_responses=True) for node in ring.nodes})
+    monkeypatch.setattr(redis, "_breakers", {})
+
+
+@pytest.fixture()
+def slow_redis(redis_cleanup, monkeypatch):
+    """
+    Inject latency into every Redis command, so that it's longer than timeout of guarded calls
+    """
+    def slow(execute_command):
+        async def slow_execute_command(*args, **options):
+            await asyncio.sleep(0.2)
+            return await execute_command(*args, **options)
+
+        return slow_execute_command
+
+    for connection in redis.get_connections().values():
+        monkeypatch.setattr(connection, "execute_command", slow(connection.execute_command))
+    # Breakers are created on first use with timeout from settings
+    monkeypatch.setattr(settings(), "REDIS_COMMAND_TIMEOUT", 0.05)
+    monkeypatch.setattr(redis, "_breakers", {})
 
 
 @pytest.fixture()
-async def client(db, event_loop) -> TestClient:
+async def client(db, event_loop, redis_cleanup) -> TestClient:
     async with TestClient(app=app, base_url=BASE_TEST_CLIENT_URL) as client:
         yield client
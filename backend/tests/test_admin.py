@@ -0,0 +1,88 @@
+import time
+from unittest.mock import patch
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import models
+from admin.auth import EmailAndPasswordProvider, _session_key, session_cache
+from core import security
+from tests import factories
+
+
+def make_request(session: dict) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/admin", "headers": [], "session": session})
+
+
+async def test_is_authenticated_cached(db):
+    user = factories.SuperAdminUserFactory()
+    session = {"token": security.Authorize().create_user_access_token(user)}
+    provider = EmailAndPasswordProvider()
+
+    assert await provider.is_authenticated(make_request(session))
+
+    with patch.object(models.User, "get_or_none", side_effect=AssertionError("User is loaded")), \
+            patch("fastapi_jwt_auth.auth_jwt.jwt.decode", side_effect=AssertionError("Token is decoded")):
+        request = make_request(session)
+        assert await provider.is_authenticated(request)
+
+    assert request.state.user.id == user.id
+
+
+async def test_is_authenticated_demoted(db):
+    user = factories.SuperAdminUserFactory()
+    session = {"token": security.Authorize().create_user_access_token(user)}
+    provider = EmailAndPasswordProvider()
+
+    assert await provider.is_authenticated(make_request(session))
+
+    user.role = models.User.Role.ADMIN
+    await user.save()
+
+    assert not await provider.is_authenticated(make_request(session))
+
+
+async def test_is_authenticated_logout(db):
+    user = factories.SuperAdminUserFactory()
+    token = security.Authorize().create_user_access_token(user)
+    session = {"token": token}
+    provider = EmailAndPasswordProvider()
+
+    assert await provider.is_authenticated(make_request(session))
+    assert session_cache.get(_session_key(token))
+
+    await provider.logout(make_request(session), Response())
+    assert not session
+    assert session_cache.get(_session_key(token)) is None
+
+
+async def test_is_authenticated_changed_by_other_worker(db):
+    user = factories.SuperAdminUserFactory()
+    token = security.Authorize().create_user_access_token(user)
+    session = {"token": token}
+    provider = EmailAndPasswordProvider()
+
+    assert await provider.is_authenticated(make_request(session))
+
+    # Other worker saves the user: shared user cache is invalidated, local session cache of this one isn't
+    await models.User.filter(id=user.id).update(role=models.User.Role.ADMIN, token_version=user.token_version + 1)
+    await security.user_cache.invalidate(user.id)
+
+    assert not await provider.is_authenticated(make_request(session))
+    assert session_cache.get(_session_key(token)) is None
+
+
+async def test_is_authenticated_expired(db):
+    user = factories.SuperAdminUserFactory()
+    token = security.Authorize().create_access_token(user.id, expires_time=1, user_claims={
+        "role": user.role.value,
+        "token_version": user.token_version,
+    })
+    session = {"token": token}
+    provider = EmailAndPasswordProvider()
+
+    assert await provider.is_authenticated(make_request(session))
+
+    # Session isn't cached longer than the token is valid
+    expires_at, _ = session_cache._data[_session_key(token)]
+    assert expires_at - time.monotonic() <= 1
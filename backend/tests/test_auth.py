@@ -1,18 +1,25 @@
+import asyncio
+import threading
 from datetime import date
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from redis import asyncio as aioredis
 
 import models
-from core import redis, security
+from conf import settings
+from core import hashing, redis, security, throttling
+from core.circuit_breaker import CircuitBreaker
 from tests import factories
 
 REGISTER_URL = "/auth/register"
 CONFIRM_REGISTRATION_URL = "/auth/register/confirm"
+RESEND_REGISTRATION_CODE_URL = "/auth/register/resend"
 LOGIN_URL = "/auth/login"
 CHANGE_PASSWORD_URL = "/auth/password/change"
 FORGOT_PASSWORD_URL = "/auth/password/reset/request"
 RESET_PASSWORD_URL = "/auth/password/reset"
+ME_URL = "/users/me"
 
 MOCKED_USER_CODE = "abcd"
 
@@ -118,6 +125,184 @@ async def test_confirm_registration(client, redis_cleanup):
     assert user.is_email_verified == True
 
 
+async def test_confirm_registration_invalidates_tokens(client, redis_cleanup):
+    user = factories.UserFactory(is_email_verified=False)
+    client.authorize_with_claims(user)
+    code = await redis.generate_code(user.id, redis.CodeType.REGISTER)
+
+    resp = await client.patch(CONFIRM_REGISTRATION_URL, json={"code": code})
+    assert resp.status_code == 204
+
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 401
+
+    await user.refresh_from_db()
+    client.authorize_with_claims(user)
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 200
+
+
+async def test_confirm_registration_code_reused(client, redis_cleanup):
+    user = factories.UserFactory(is_email_verified=False)
+    code = await redis.generate_code(user.id, redis.CodeType.REGISTER)
+
+    payload = {"code": code}
+    resp = await client.patch(CONFIRM_REGISTRATION_URL, json=payload)
+    assert resp.status_code == 204
+
+    resp = await client.patch(CONFIRM_REGISTRATION_URL, json=payload)
+    assert resp.status_code == 400
+
+
+async def test_resend_registration_code(client, redis_cleanup):
+    user = factories.UserFactory(is_email_verified=False)
+    first_code = await redis.generate_code(user.id, redis.CodeType.REGISTER)
+
+    with patch("core.redis.secrets.token_urlsafe", return_value=MOCKED_USER_CODE):
+        resp = await client.post(RESEND_REGISTRATION_CODE_URL, json={"email": user.email})
+        assert resp.status_code == 204
+
+    assert await redis.check_code(first_code, redis.CodeType.REGISTER) is None
+    assert await redis.check_code(MOCKED_USER_CODE, redis.CodeType.REGISTER) == str(user.id)
+
+    resp = await client.patch(CONFIRM_REGISTRATION_URL, json={"code": MOCKED_USER_CODE})
+    assert resp.status_code == 204
+
+
+@pytest.mark.parametrize("is_email_verified,password", [(True, "password"), (False, None)])
+@patch("core.redis.secrets.token_urlsafe", return_value=MOCKED_USER_CODE)
+async def test_resend_registration_code_skipped(redis_code_mock, is_email_verified, password, client, redis_cleanup):
+    user = factories.BaseUserFactory(is_email_verified=is_email_verified, password=password)
+
+    for email in (user.email, "test@email.com"):
+        resp = await client.post(RESEND_REGISTRATION_CODE_URL, json={"email": email})
+        assert resp.status_code == 204
+
+    assert await redis.check_code(MOCKED_USER_CODE, redis.CodeType.REGISTER) is None
+
+
+async def test_resend_registration_code_throttled(client):
+    user = factories.UserFactory(is_email_verified=False)
+    payload = {"email": user.email}
+
+    with patch.object(throttling.register_resend, "identity_limit", 1):
+        resp = await client.post(RESEND_REGISTRATION_CODE_URL, json=payload)
+        assert resp.status_code == 204
+
+        resp = await client.post(RESEND_REGISTRATION_CODE_URL, json=payload)
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"]
+
+
+async def test_generate_code_collision(redis_cleanup):
+    with patch("core.redis.secrets.token_urlsafe", side_effect=["a", "a", "b"]):
+        first_code = await redis.generate_code(1, redis.CodeType.FORGOT_PASSWORD)
+        second_code = await redis.generate_code(2, redis.CodeType.FORGOT_PASSWORD)
+
+    assert (first_code, second_code) == ("a", "b")
+    assert await redis.check_code(first_code, redis.CodeType.FORGOT_PASSWORD) == "1"
+    assert await redis.check_code(second_code, redis.CodeType.FORGOT_PASSWORD) == "2"
+
+
+async def test_generate_code_limit_per_user(redis_cleanup):
+    codes = [await redis.generate_code(1, redis.CodeType.FORGOT_PASSWORD) for _ in range(4)]
+    other_code = await redis.generate_code(2, redis.CodeType.FORGOT_PASSWORD)
+
+    with patch.object(settings(), "CODE_LIMIT_PER_USER", 2):
+        codes.append(await redis.generate_code(1, redis.CodeType.FORGOT_PASSWORD))
+
+    assert [await redis.check_code(one, redis.CodeType.FORGOT_PASSWORD) for one in codes] == [
+        None, None, None, "1", "1"
+    ]
+    assert await redis.check_code(other_code, redis.CodeType.FORGOT_PASSWORD) == "2"
+
+
+async def test_register_code_replaced(redis_cleanup):
+    first_code = await redis.generate_code(1, redis.CodeType.REGISTER)
+    second_code = await redis.generate_code(1, redis.CodeType.REGISTER)
+
+    assert await redis.check_code(first_code, redis.CodeType.REGISTER) is None
+    assert await redis.check_code(second_code, redis.CodeType.REGISTER) == "1"
+
+    second_key = redis._code_key(second_code, redis.CodeType.REGISTER)
+    ttl = await redis.get_connection(second_key).ttl(second_key)
+    assert 0 < ttl <= settings().REGISTER_CODE_EXPIRES
+
+
+async def test_expire_orphaned_register_codes(redis_cleanup):
+    await redis.generate_code(1, redis.CodeType.REGISTER)
+    orphaned_key = redis._code_key("orphaned", redis.CodeType.REGISTER)
+    await redis.get_connection(orphaned_key).set(orphaned_key, 2)
+    await redis.generate_code(3, redis.CodeType.FORGOT_PASSWORD)
+
+    result = await redis.expire_orphaned_codes(redis.CodeType.REGISTER, ex=60, batch_size=1)
+    assert result == (2, 1)
+    assert await redis.get_connection(orphaned_key).ttl(orphaned_key) == -1
+
+    result = await redis.expire_orphaned_codes(redis.CodeType.REGISTER, ex=60, batch_size=1, dry_run=False)
+    assert result == (2, 1)
+    assert 0 < await redis.get_connection(orphaned_key).ttl(orphaned_key) <= 60
+
+
+async def test_register_redis_unavailable(client, slow_redis, monkeypatch):
+    monkeypatch.setattr(settings(), "REDIS_BREAKER_THRESHOLD", 1)
+    payload = {
+        "email": "test@user.com",
+        "password": "1234abcd!",
+    }
+    resp = await client.post(REGISTER_URL, json=payload)
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"]
+    node, = redis.get_ring().nodes
+    assert redis.get_breaker(node).state == CircuitBreaker.State.OPEN
+
+    # Open circuit fails fast, before new user is created
+    payload["email"] = "another@user.com"
+    with patch.object(hashing, "hash_password", side_effect=AssertionError("Password is hashed")):
+        resp = await client.post(REGISTER_URL, json=payload)
+    assert resp.status_code == 503
+
+    assert not await models.User.filter(email=payload["email"]).exists()
+
+
+async def test_codes_sharded(sharded_redis):
+    codes = [await redis.generate_code(user_id, redis.CodeType.FORGOT_PASSWORD) for user_id in range(30)]
+
+    for connection in redis.get_connections().values():
+        assert await connection.dbsize()
+
+    for user_id, code in enumerate(codes):
+        assert await redis.consume_code(code, redis.CodeType.FORGOT_PASSWORD) == str(user_id)
+
+
+async def test_codes_sharded_node_unavailable(sharded_redis, monkeypatch):
+    monkeypatch.setattr(settings(), "REDIS_BREAKER_THRESHOLD", 1)
+    codes = [await redis.generate_code(user_id, redis.CodeType.FORGOT_PASSWORD) for user_id in range(30)]
+    failing_node = redis.get_ring().get_node(redis._code_key(codes[0], redis.CodeType.FORGOT_PASSWORD))
+    connection = redis.get_node_connection(failing_node)
+    monkeypatch.setattr(connection, "execute_command", AsyncMock(side_effect=aioredis.ConnectionError()))
+
+    with pytest.raises(redis.RedisUnavailable):
+        await redis.check_code(codes[0], redis.CodeType.FORGOT_PASSWORD)
+    assert redis.get_breaker(failing_node).state == CircuitBreaker.State.OPEN
+
+    # Circuits of other nodes stay closed
+    for user_id, code in enumerate(codes):
+        if redis.get_ring().get_node(redis._code_key(code, redis.CodeType.FORGOT_PASSWORD)) != failing_node:
+            assert await redis.check_code(code, redis.CodeType.FORGOT_PASSWORD) == str(user_id)
+
+
+async def test_register_code_replaced_sharded(sharded_redis):
+    codes = [await redis.generate_code(1, redis.CodeType.REGISTER) for _ in range(10)]
+    nodes = {redis.get_ring().get_node(redis._code_key(one, redis.CodeType.REGISTER)) for one in codes}
+    assert len(nodes) > 1
+
+    for code in codes[:-1]:
+        assert await redis.check_code(code, redis.CodeType.REGISTER) is None
+
+    assert await redis.check_code(codes[-1], redis.CodeType.REGISTER) == "1"
+
+
 async def test_confirm_registration_invalid_code(client):
     payload = {"code": "abcd"}
     resp = await client.patch(CONFIRM_REGISTRATION_URL, json=payload)
@@ -139,6 +324,11 @@ async def test_login(client):
     assert data["access_token"]
     assert data["refresh_token"]
 
+    claims = security.Authorize().get_raw_jwt(data["access_token"])
+    assert claims["role"] == user.role
+    assert claims["is_email_verified"] == user.is_email_verified
+    assert claims["token_version"] == user.token_version
+
 
 @pytest.mark.parametrize("fields", [
     {"email": "invalid@email.com"},
@@ -158,6 +348,120 @@ async def test_login_invalid(fields, client):
     assert resp.status_code == 401
 
 
+async def test_login_rehash(client):
+    password = "abcd1234!"
+    rounds = settings().BCRYPT_ROUNDS - 1
+    user = factories.UserFactory(password=security.hash_password(password, rounds=rounds))
+
+    payload = {
+        "email": user.email,
+        "password": password,
+    }
+    resp = await client.post(LOGIN_URL, json=payload)
+    assert resp.status_code == 200
+
+    await user.refresh_from_db()
+    assert security.get_hash_rounds(user.password) == settings().BCRYPT_ROUNDS
+    assert security.verify_password(password, user.password)
+
+
+async def test_login_hashing_pool_saturated(client):
+    password = "abcd1234!"
+    user = factories.UserFactory(password=security.hash_password(password))
+
+    payload = {
+        "email": user.email,
+        "password": password,
+    }
+    with patch.object(hashing.pool, "max_workers", 0), patch.object(hashing.pool, "max_queue", 0):
+        resp = await client.post(LOGIN_URL, json=payload)
+
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"]
+
+
+async def test_hashing_pool_cancelled():
+    pool = hashing.HashingPool(executor_type="thread", max_workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_hash(password):
+        started.set()
+        release.wait(timeout=5)
+        return password
+
+    task = asyncio.create_task(pool.run(blocking_hash, "abcd1234!"))
+    await asyncio.to_thread(started.wait, 5)
+    assert pool.pending == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert pool.pending == 0
+    release.set()
+    assert await pool.run(blocking_hash, "abcd1234!") == "abcd1234!"
+    pool.shutdown()
+
+
+async def test_login_throttled(client):
+    password = "abcd1234!"
+    user = factories.UserFactory(password=security.hash_password(password))
+
+    payload = {
+        "email": user.email,
+        "password": "invalid",
+    }
+    with patch.object(throttling.login, "identity_limit", 2):
+        for _ in range(2):
+            resp = await client.post(LOGIN_URL, json=payload)
+            assert resp.status_code == 401
+
+        payload["password"] = password
+        with patch.object(hashing, "verify_password", side_effect=AssertionError("Password is verified")):
+            resp = await client.post(LOGIN_URL, json=payload)
+
+    assert resp.status_code == 429
+    assert 0 < int(resp.headers["Retry-After"]) <= throttling.login.window
+
+
+async def test_login_throttled_ip(client):
+    payload = {
+        "email": "invalid@email.com",
+        "password": "invalid",
+    }
+    with patch.object(throttling.login, "ip_limit", 2):
+        for index in range(3):
+            payload["email"] = f"invalid{index}@email.com"
+            resp = await client.post(LOGIN_URL, json=payload)
+
+    assert resp.status_code == 429
+
+
+async def test_login_redis_unavailable(client, slow_redis):
+    password = "abcd1234!"
+    user = factories.UserFactory(password=security.hash_password(password))
+
+    payload = {
+        "email": user.email,
+        "password": password,
+    }
+    resp = await client.post(LOGIN_URL, json=payload)
+    # Throttling is skipped while Redis is unavailable
+    assert resp.status_code == 200
+
+
+async def test_login_throttled_sharded(client, sharded_redis):
+    payload = {
+        "email": "invalid@email.com",
+        "password": "invalid",
+    }
+    with patch.object(throttling.login, "identity_limit", 2):
+        for _ in range(3):
+            resp = await client.post(LOGIN_URL, json=payload)
+
+    assert resp.status_code == 429
+
+
 async def test_change_password(client):
     password = "1234Abcd!"
     user = factories.UserFactory(password=security.hash_password(password))
@@ -167,9 +471,16 @@ async def test_change_password(client):
         "new_password": "5678Abcd!",
         "old_password": password
     }
+    # Current user is cached without password
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 200
+
     resp = await client.patch(CHANGE_PASSWORD_URL, json=payload)
     assert resp.status_code == 204
 
+    saved_user = await models.User.get(id=user.id)
+    assert await hashing.verify_password(payload["new_password"], saved_user.password)
+
 
 @pytest.mark.parametrize("fields", [
     {"new_password": "123"},
@@ -221,6 +532,19 @@ async def test_forgot_password_invalid_email(redis_code_mock, client, redis_clea
     assert not is_code_created
 
 
+async def test_forgot_password_throttled(client):
+    user = factories.UserFactory()
+    payload = {"email": user.email}
+
+    with patch.object(throttling.forgot_password, "identity_limit", 1):
+        resp = await client.post(FORGOT_PASSWORD_URL, json=payload)
+        assert resp.status_code == 204
+
+        resp = await client.post(FORGOT_PASSWORD_URL, json=payload)
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"]
+
+
 async def test_reset_password(client, redis_cleanup):
     user = factories.UserFactory()
     code = await redis.generate_code(user.id, redis.CodeType.FORGOT_PASSWORD)
@@ -1,10 +1,17 @@
+import typing as t
 from datetime import date, timedelta
+from itertools import product
+from unittest.mock import patch
 
 import pytest
 
 import models
 import schemas.camps
+import schemas.pagination
+import services.camps
+import services.utils
 from tests import factories
+from tests.utils import apply_migration, assert_ordered_by_index, explain_without_sort
 
 DETAIL_URL = "/camps/{camp_id}"
 CREATE_URL = "/camps"
@@ -12,6 +19,45 @@ DELETE_URL = "/camps/{camp_id}"
 FILTER_URL = "/camps"
 TODAY = date.today()
 
+# Days relative to TODAY: camp dates and bounds of date filter around them
+CAMP_DAYS = (None, -10, -5, 0)
+FILTER_DAYS = (None, -12, -10, -7, -5, -2, 0, 3)
+
+
+def shift(days: t.Optional[int]) -> t.Optional[date]:
+    return None if days is None else TODAY + timedelta(days=days)
+
+
+def overlaps(camp: models.Camp, date_from: t.Optional[date], date_till: t.Optional[date]) -> bool:
+    """
+    Date filter before date_range column: either camp date within the range or camp covering whole range
+    """
+    date_from = date_from or date.min
+    date_till = date_till or date.max
+    dates = [one for one in (camp.date_start, camp.date_end) if one is not None]
+
+    if any(date_from <= one <= date_till for one in dates):
+        return True
+
+    return len(dates) == 2 and camp.date_start <= date_from and camp.date_end >= date_till
+
+
+@pytest.fixture()
+def camp_grid() -> list[models.Camp]:
+    # Including reversed camps with date_start > date_end, which API rejects but existing rows may have
+    return [
+        factories.CampFactory(date_start=shift(start), date_end=shift(end), country=None)
+        for start, end in product(CAMP_DAYS, repeat=2)
+    ]
+
+
+def date_filters() -> list[tuple[t.Optional[date], t.Optional[date]]]:
+    return [
+        (shift(start), shift(end))
+        for start, end in product(FILTER_DAYS, repeat=2)
+        if (start is None or end is None or start < end) and (start, end) != (None, None)
+    ]
+
 
 @pytest.fixture()
 def country_list():
@@ -28,6 +74,7 @@ def camp_list(country_list):
         date_start=TODAY - timedelta(days=10),
         date_end=TODAY - timedelta(days=7),
         name="First",
+        description="",
         location=""
     )
     camp2 = factories.CampFactory(
@@ -35,6 +82,7 @@ def camp_list(country_list):
         date_start=TODAY - timedelta(days=10),
         date_end=TODAY - timedelta(days=5),
         name="Second",
+        description="",
         location="lake"
     )
     camp3 = factories.CampFactory(
@@ -42,6 +90,7 @@ def camp_list(country_list):
         date_start=TODAY - timedelta(days=6),
         date_end=TODAY,
         name="Third",
+        description="Canoeing",
         location="lake"
     )
     return [camp1, camp2, camp3]
@@ -116,6 +165,29 @@ async def test_create_permission_denied(client):
     assert resp.status_code == 403
 
 
+async def test_create_permission_denied_by_claims(client):
+    user = factories.UserFactory(role=models.User.Role.BASE)
+    client.authorize_with_claims(user)
+
+    body = {"description": "", "location": "", "name": "test"}
+    with patch.object(models.User, "get_or_none", side_effect=AssertionError("User is loaded")):
+        resp = await client.post(CREATE_URL, json=body)
+
+    assert resp.status_code == 403
+
+
+async def test_create_outdated_token(client):
+    user = factories.UserFactory(role=models.User.Role.ADMIN)
+    client.authorize_with_claims(user)
+
+    user.token_version += 1
+    await user.save()
+
+    body = {"description": "", "location": "", "name": "test"}
+    resp = await client.post(CREATE_URL, json=body)
+    assert resp.status_code == 401
+
+
 async def test_delete(client):
     user = factories.UserFactory(role=models.User.Role.ADMIN)
     client.authorize(user.id)
@@ -161,13 +233,16 @@ async def test_filter_empty(client, camp_list):
         (schemas.camps.FilterOrder.CREATED_AT_DESC.value, range(2, -1, -1)),
 
         (schemas.camps.FilterOrder.DATE_START_ASC.value, range(3)),
-        (schemas.camps.FilterOrder.DATE_START_DESC.value, (2, 0, 1)),
+        (schemas.camps.FilterOrder.DATE_START_DESC.value, range(2, -1, -1)),
 
         (schemas.camps.FilterOrder.NAME_ASC.value, range(3)),
         (schemas.camps.FilterOrder.NAME_DESC.value, range(2, -1, -1)),
 
         (schemas.camps.FilterOrder.COUNTRY_ASC.value, [2, 0, 1]),
-        (schemas.camps.FilterOrder.COUNTRY_DESC.value, range(3)),
+        (schemas.camps.FilterOrder.COUNTRY_DESC.value, [1, 0, 2]),
+
+        # No relevance without search
+        (schemas.camps.FilterOrder.RANK.value, range(3)),
     ],
 )
 async def test_filter_order_by(order_by, indexes, client, camp_list):
@@ -206,6 +281,7 @@ async def test_filter_country_id(country_index, indexes, client, camp_list, coun
         ({"search": "s"}, (0, 1)),
         ({"search": "tHiRd"}, (2,)),
         ({"search": "lake"}, (1, 2)),
+        ({"search": "canoe"}, (2,)),
         ({"date_from": TODAY - timedelta(days=10)}, range(3)),
         ({"date_from": TODAY - timedelta(days=6)}, (1, 2)),
         ({"date_from": TODAY - timedelta(days=4)}, (2,)),
@@ -225,6 +301,138 @@ async def test_filter(query, indexes, client, camp_list):
     data = resp.json()
     assert [one["id"] for one in data["results"]] == camp_ids
 
+
+@pytest.mark.parametrize("order_by", [one.value for one in schemas.camps.FilterOrder])
+async def test_filter_cursor(order_by, client, camp_list):
+    user = factories.UserFactory(role=models.User.Role.BASE)
+    client.authorize(user.id)
+    factories.CampFactory(country=None, date_start=None, date_end=None, name="Fourth")
+    factories.CampFactory(country=None, date_start=None, date_end=None, name="Fifth")
+
+    query = {"order_by": order_by}
+    resp = await client.get(FILTER_URL, params=query)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["total_count"] == 5
+    assert data["next_cursor"] is None
+
+    camp_ids = []
+    query["page_size"] = 2
+
+    while True:
+        resp = await client.get(FILTER_URL, params=query)
+        assert resp.status_code == 200
+        page = resp.json()
+        assert page["total_count"] == 5
+        camp_ids.extend(one["id"] for one in page["results"])
+
+        if page["next_cursor"] is None:
+            break
+
+        query["cursor"] = page["next_cursor"]
+
+    assert camp_ids == [one["id"] for one in data["results"]]
+
+
+# Rank orders by annotation of search
+@pytest.mark.parametrize("order_by", [one for one in schemas.camps.FilterOrder if one != schemas.camps.FilterOrder.RANK])
+async def test_filter_cursor_postgres(order_by, postgres_db, camp_list):
+    # Postgres puts NULLs last in ascending order, the opposite of SQLite
+    factories.CampFactory(country=None, date_start=None, date_end=None, name="Fourth")
+    factories.CampFactory(country=None, date_start=None, date_end=None, name="Fifth")
+
+    ordering = services.camps.Filter().format_order([order_by])
+    queryset = models.Camp.all().select_related("country").order_by(*ordering)
+    orderings = services.utils.get_orderings(queryset)
+    tiebreaker = "-id" if ordering[-1].startswith("-") else "id"
+    expected_ids = await queryset.order_by(*ordering, tiebreaker).values_list("id", flat=True)
+
+    camp_ids = []
+    paginated_query = schemas.pagination.PaginatedQuery(page_size=2)
+
+    while True:
+        page_queryset = services.utils.paginate_queryset(queryset, paginated_query)
+        rows = await page_queryset.values(*(field for field, _ in orderings))
+        camp_ids.extend(one["id"] for one in rows)
+
+        if len(rows) < paginated_query.page_size:
+            break
+
+        cursor = services.utils.encode_cursor(rows[-1], orderings)
+        paginated_query = schemas.pagination.PaginatedQuery(page_size=2, cursor=cursor)
+
+    assert camp_ids == expected_ids
+
+
+async def test_filter_projection(client, camp_list, country_list):
+    user = factories.UserFactory(role=models.User.Role.BASE)
+    client.authorize(user.id)
+    camp = factories.CampFactory(country=None)
+
+    with patch.object(models.Camp, "_init_from_db", side_effect=AssertionError("Model instantiated")):
+        resp = await client.get(FILTER_URL, params={"order_by": schemas.camps.FilterOrder.COUNTRY_ASC.value})
+
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [one["id"] for one in results] == [camp.id, camp_list[2].id, camp_list[0].id, camp_list[1].id]
+    assert results[0]["country"] is None
+    assert results[1]["country"]["id"] == country_list[1].id
+    assert "description" not in results[0]
+
+
+async def test_filter_date_range(client, camp_grid):
+    user = factories.UserFactory(role=models.User.Role.BASE)
+    client.authorize(user.id)
+
+    for date_from, date_till in date_filters():
+        query = {"date_from": date_from, "date_till": date_till, "page_size": len(camp_grid)}
+        resp = await client.get(FILTER_URL, params={key: value for key, value in query.items() if value})
+        assert resp.status_code == 200
+
+        camp_ids = {one.id for one in camp_grid if overlaps(one, date_from, date_till)}
+        assert {one["id"] for one in resp.json()["results"]} == camp_ids, (date_from, date_till)
+
+
+async def test_filter_date_range_postgres(postgres_db, camp_grid):
+    await apply_migration("21_20261018130000_update", models.Camp)
+    service = services.camps.Filter()
+
+    for date_from, date_till in date_filters():
+        queryset = service.filter_date_range(models.Camp.all(), date_from, date_till)
+        legacy = models.Camp.filter(service.format_date_range_filter(date_from, date_till))
+
+        camp_ids = {one.id for one in camp_grid if overlaps(one, date_from, date_till)}
+        assert set(await queryset.values_list("id", flat=True)) == camp_ids, (date_from, date_till)
+        assert set(await legacy.values_list("id", flat=True)) == camp_ids, (date_from, date_till)
+
+    queryset = service.filter_date_range(models.Camp.all(), shift(-7), shift(-2))
+    plan = await explain_without_sort(queryset)
+    assert {"idx_camp_date_range", "idx_camp_reversed_dates"} <= set(plan["indexes"])
+
+
+# Cursor page of nullable ascending key (NULLs last in Postgres) is bounded by a disjunction, not the index scan start
+@pytest.mark.parametrize("order_by,filters,index,seek", [
+    (schemas.camps.FilterOrder.NAME_ASC, {}, "idx_camp_name_5c456c", True),
+    (schemas.camps.FilterOrder.NAME_DESC, {}, "idx_camp_name_5c456c", True),
+    (schemas.camps.FilterOrder.CREATED_AT_ASC, {}, "idx_camp_created_76c27d", True),
+    (schemas.camps.FilterOrder.CREATED_AT_DESC, {}, "idx_camp_created_76c27d", True),
+    (schemas.camps.FilterOrder.DATE_START_ASC, {}, "idx_camp_date_st_2c1b0b", False),
+    (schemas.camps.FilterOrder.DATE_START_DESC, {}, "idx_camp_date_st_2c1b0b", True),
+    (schemas.camps.FilterOrder.NAME_ASC, {"country_id": 1}, "idx_camp_country_f76ce8", True),
+])
+async def test_filter_order_index_postgres(postgres_db, order_by, filters, index, seek):
+    # Cursor of the first row, it's in country 1
+    factories.CampFactory()
+    ordering = services.camps.Filter().format_order([order_by])
+    queryset = models.Camp.filter(**filters).select_related("country").order_by(*ordering)
+    await assert_ordered_by_index(queryset, index, seek=seek)
+
+
+async def test_members_by_role_index_postgres(postgres_db):
+    queryset = models.CampMember.filter(camp_id=1).order_by("role")
+    await assert_ordered_by_index(queryset, "idx_campmember_camp_id_42f5d1")
+
+
 async def test_my_filter():
     # TODO
     pass
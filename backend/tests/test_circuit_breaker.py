@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from conf import settings
+from core import redis
+from core.circuit_breaker import CircuitBreaker, CircuitOpen
+
+
+class Failure(Exception):
+    pass
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise Failure
+
+
+async def hang():
+    await asyncio.sleep(1)
+
+
+def create_breaker() -> CircuitBreaker:
+    return CircuitBreaker("test", failure_threshold=2, reset_timeout=10, call_timeout=0.05, exceptions=(Failure,))
+
+
+async def test_opens_after_threshold():
+    breaker = create_breaker()
+
+    for func, exception in [(fail, Failure), (hang, asyncio.TimeoutError)]:
+        with pytest.raises(exception):
+            await breaker.call(func)
+
+    assert breaker.state == breaker.State.OPEN
+
+    with pytest.raises(CircuitOpen):
+        await breaker.call(succeed)
+
+
+async def test_success_resets_failures():
+    breaker = create_breaker()
+
+    with pytest.raises(Failure):
+        await breaker.call(fail)
+
+    assert await breaker.call(succeed) == "ok"
+
+    with pytest.raises(Failure):
+        await breaker.call(fail)
+
+    assert breaker.state == breaker.State.CLOSED
+
+
+async def test_unexpected_exception_is_not_failure():
+    breaker = create_breaker()
+
+    async def buggy():
+        raise ValueError
+
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(ValueError):
+            await breaker.call(buggy)
+
+    assert breaker.state == breaker.State.CLOSED
+
+
+@pytest.mark.parametrize("probe, state", [
+    (succeed, CircuitBreaker.State.CLOSED),
+    (fail, CircuitBreaker.State.OPEN),
+])
+async def test_half_open_probe(probe, state):
+    breaker = create_breaker()
+
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(Failure):
+            await breaker.call(fail)
+
+    breaker.opened_at -= breaker.reset_timeout
+    assert breaker.state == breaker.State.HALF_OPEN
+
+    try:
+        await breaker.call(probe)
+    except Failure:
+        pass
+
+    assert breaker.state == state
+
+
+async def test_half_open_single_probe():
+    breaker = create_breaker()
+    breaker.call_timeout = 1
+
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(Failure):
+            await breaker.call(fail)
+
+    breaker.opened_at -= breaker.reset_timeout
+    probe = asyncio.create_task(breaker.call(asyncio.sleep, 0.05))
+    await asyncio.sleep(0)
+
+    with pytest.raises(CircuitOpen):
+        await breaker.call(succeed)
+
+    await probe
+    assert breaker.state == breaker.State.CLOSED
+
+
+def test_redis_breaker_settings(monkeypatch):
+    monkeypatch.setattr(redis, "_breakers", {})
+    monkeypatch.setattr(settings(), "REDIS_BREAKER_THRESHOLD", 7)
+
+    # Created on first use, so settings changed after import apply
+    breaker = redis.get_breaker("node-a")
+    assert breaker.failure_threshold == 7
+    assert redis.get_breaker("node-a") is breaker
+    # One per node
+    assert redis.get_breaker("node-b") is not breaker
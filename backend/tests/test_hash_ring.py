@@ -0,0 +1,61 @@
+from collections import Counter
+
+import pytest
+
+from core.hash_ring import HashRing, hash_slot
+
+KEYS = [f"FORGOT_PASSWORD:{index}" for index in range(10000)]
+
+
+def test_keys_spread():
+    ring = HashRing(["a", "b", "c", "d"])
+    counts = Counter(ring.get_node(key) for key in KEYS)
+
+    assert set(counts) == ring.nodes
+    for count in counts.values():
+        assert 0.15 < count / len(KEYS) < 0.35
+
+
+def test_add_node_moves_minimal_share():
+    ring = HashRing(["a", "b", "c", "d"])
+    before = {key: ring.get_node(key) for key in KEYS}
+
+    ring.add_node("e")
+    moved = [key for key in KEYS if ring.get_node(key) != before[key]]
+
+    # Only keys taken over by new node move, about 1/5 of them
+    assert all(ring.get_node(key) == "e" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+
+def test_remove_node_moves_only_its_keys():
+    ring = HashRing(["a", "b", "c", "d"])
+    before = {key: ring.get_node(key) for key in KEYS}
+
+    ring.remove_node("d")
+
+    for key in KEYS:
+        if before[key] != "d":
+            assert ring.get_node(key) == before[key]
+
+
+def test_order_independent():
+    first = HashRing(["a", "b", "c"])
+    second = HashRing(["c", "a", "b"])
+
+    assert all(first.get_node(key) == second.get_node(key) for key in KEYS)
+
+
+@pytest.mark.parametrize("key, slot", [
+    ("CODES:REGISTER:1", "CODES:REGISTER:1"),
+    ("CODES:{1}:REGISTER", "1"),
+    ("CODES:{}:{1}", "CODES:{}:{1}"),
+    ("CODES:{1", "CODES:{1"),
+])
+def test_hash_slot(key, slot):
+    assert hash_slot(key) == slot
+
+
+def test_empty_ring():
+    with pytest.raises(LookupError):
+        HashRing().get_node("key")
@@ -1,3 +1,32 @@
+from core import redis
+from tests import factories
+
+STATS_URL = "/shared/stats"
+
+
 async def test_country_filter():
     # TODO
-    pass
\ No newline at end of file
+    pass
+
+
+async def test_stats(client):
+    user = factories.SuperAdminUserFactory()
+    client.authorize(user.id)
+    # Only pools of initialized nodes are listed, don't rely on other tests touching Redis first
+    redis.get_connections()
+
+    resp = await client.get(STATS_URL)
+    assert resp.status_code == 200
+
+    data = resp.json()
+    assert data["redis_pools"]
+    assert data["db_pools"] == {}  # SQLite has no pool
+    assert "metrics" in data
+
+
+async def test_stats_permission_denied(client):
+    user = factories.AdminUserFactory()
+    client.authorize(user.id)
+
+    resp = await client.get(STATS_URL)
+    assert resp.status_code == 403
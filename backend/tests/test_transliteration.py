@@ -0,0 +1,23 @@
+import pytest
+
+from core import transliteration
+
+
+@pytest.mark.parametrize("text,expected", [
+    # Examples of KMU 2010 table
+    ("Згорани", "zghorany"),
+    ("Їжакевич", "yizhakevych"),
+    ("Юрій", "yurii"),
+    ("Хмельницький", "khmelnytskyi"),
+    ("Розумовський", "rozumovskyi"),
+    ("Щербухи", "shcherbukhy"),
+    ("Знам'янка", "znamianka"),
+    ("Ґалаґан", "galagan"),
+    ("Євгенія Яремчук", "yevheniia yaremchuk"),
+    # Latin is lowercased, diacritics and punctuation dropped
+    ("O'Connor-Gómez", "oconnor gomez"),
+    ("  Scout   #1 ", "scout 1"),
+    ("", ""),
+])
+def test_normalize(text, expected):
+    assert transliteration.normalize(text) == expected
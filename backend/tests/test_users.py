@@ -1,13 +1,26 @@
+import asyncio
+import base64
+import json
 from datetime import date, datetime, timedelta
+from unittest.mock import patch
 
 import pytest
 from dateutil.relativedelta import relativedelta
+from fastapi import HTTPException
+from redis import asyncio as aioredis
+from tortoise.exceptions import IncompleteInstanceError
+from tortoise.expressions import RawSQL
 
+import db
 import models
 import schemas.users
+import services.users
+import services.utils
 from conf import settings
-from core import errors
+from core import cache, errors, metrics, redis, security
+from db import client as db_client
 from tests import factories
+from tests.utils import apply_migration, assert_ordered_by_index, explain_without_sort
 
 ME_URL = "/users/me"
 DETAIL_URL = "/users/{user_id}"
@@ -28,6 +41,157 @@ async def test_me(client):
     assert data["id"] == user.id
 
 
+async def test_me_cached_user(client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 200
+
+    with patch.object(models.User, "get_or_none", side_effect=AssertionError("User is not cached")):
+        resp = await client.get(ME_URL)
+        assert resp.status_code == 200
+
+
+async def test_me_cached_user_invalidated(client):
+    user = factories.UserFactory(nickname="old")
+    client.authorize(user.id)
+
+    resp = await client.get(ME_URL)
+    assert resp.json()["nickname"] == "old"
+
+    user.nickname = "new"
+    await user.save()
+
+    resp = await client.get(ME_URL)
+    assert resp.json()["nickname"] == "new"
+
+
+async def test_cached_user_loaded_from_primary(db, stale_replica):
+    user = factories.UserFactory(role=models.User.Role.ADMIN)
+    await stale_replica()
+    user.role = models.User.Role.BASE
+    await user.save()
+
+    # Reads outside of request are routed to the replica, which has stale role
+    replica_user = await models.User.get(id=user.id)
+    assert replica_user.role == models.User.Role.ADMIN
+
+    cached_user = await security.user_cache.get_or_load(user.id)
+    assert cached_user.role == models.User.Role.BASE
+
+
+async def test_me_cached_user_redis(client, redis_cleanup):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    with patch.object(security.user_cache, "use_redis", True):
+        resp = await client.get(ME_URL)
+        assert resp.status_code == 200
+
+        security.user_cache.clear()
+        with patch.object(models.User, "get_or_none", side_effect=AssertionError("User is not cached")):
+            resp = await client.get(ME_URL)
+            assert resp.status_code == 200
+
+    data = resp.json()
+    assert data["id"] == user.id
+    assert data["date_of_birth"] == user.date_of_birth.isoformat()
+
+
+async def test_cached_user_without_password(client, redis_cleanup):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    with patch.object(security.user_cache, "use_redis", True):
+        resp = await client.get(ME_URL)
+        assert resp.status_code == 200
+
+    key = security.user_cache.redis_key(user.id)
+    row = json.loads(await redis.get_connection(key).get(key))
+    assert row["email"] == user.email
+    assert "password" not in row
+
+    cached_user = await security.user_cache.get_or_load(user.id)
+    with pytest.raises(IncompleteInstanceError):
+        await cached_user.save()
+
+
+async def test_save_cached_user(db):
+    user = factories.UserFactory(nickname="old")
+    cached_user = await security.user_cache.get_or_load(user.id)
+    cached_user.nickname = "new"
+    await cached_user.save(update_fields=["nickname"])
+
+    complete_user = await security.user_cache.load(user.id)
+    assert complete_user.nickname == "new"
+    assert complete_user.password == user.password
+
+    complete_user.nickname = "newer"
+    await complete_user.save()
+
+    saved_user = await models.User.get(id=user.id)
+    assert saved_user.nickname == "newer"
+    assert saved_user.password == user.password
+    cached_user = await security.user_cache.get_or_load(user.id)
+    assert cached_user.nickname == "newer"
+
+
+async def test_cached_user_invalidated_after_redis_failure(db, redis_cleanup, monkeypatch):
+    user = factories.UserFactory(nickname="old")
+    monkeypatch.setattr(security.user_cache, "use_redis", True)
+    monkeypatch.setattr(cache, "INVALIDATE_RETRY_DELAY", 0.01)
+    await security.user_cache.get_or_load(user.id)
+
+    connection = redis.get_connection(security.user_cache.redis_key(user.id))
+    delete = connection.delete
+    calls = []
+
+    async def flaky_delete(*keys):
+        calls.append(keys)
+
+        if len(calls) == 1:
+            raise aioredis.ConnectionError("Redis is down")
+
+        return await delete(*keys)
+
+    with patch.object(connection, "delete", flaky_delete):
+        user.nickname = "new"
+        await user.save()
+        await asyncio.gather(*security.user_cache._retries)
+
+    assert len(calls) == 2
+    security.user_cache.clear()
+    cached_user = await security.user_cache.get_or_load(user.id)
+    assert cached_user.nickname == "new"
+
+
+async def test_me_cached_token(client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 200
+
+    with patch("fastapi_jwt_auth.auth_jwt.jwt.decode", side_effect=AssertionError("Token is not cached")):
+        resp = await client.get(ME_URL)
+        assert resp.status_code == 200
+
+
+async def test_me_cached_token_expired(client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    resp = await client.get(ME_URL)
+    assert resp.status_code == 200
+
+    expired_at = datetime.now().timestamp() + settings().ACCESS_TOKEN_EXPIRES + 1
+    with patch("core.security.time.time", return_value=expired_at), \
+            patch("fastapi_jwt_auth.auth_jwt.jwt.decode", side_effect=ValueError("Signature has expired")):
+        resp = await client.get(ME_URL)
+        assert resp.status_code == 401
+
+
 async def test_detail(client):
     me = factories.UserFactory()
     client.authorize(me.id)
@@ -99,6 +263,62 @@ async def test_filter_search(client):
     assert len(data["results"]) == 3
 
 
+@pytest.mark.parametrize("search,indexes", [
+    ("юрій", (0, 1)),
+    ("Yurii", (0, 1)),
+    ("ЮРІ", (0, 1)),
+    ("shcherbak", (1,)),
+    ("Щербак", (1,)),
+])
+async def test_filter_search_transliteration(search, indexes, client):
+    users = [
+        factories.UserFactory.create(first_name="Юрій", last_name="", nickname=""),
+        factories.UserFactory.create(first_name="Yurii", last_name="Shcherbak", nickname=""),
+        factories.UserFactory.create(first_name="Olena", last_name="", nickname=""),
+    ]
+    client.authorize(users[0].id)
+
+    resp = await client.get(FILTER_URL, params={"search": search, "order_by": "CREATED_AT_ASC"})
+    assert resp.status_code == 200
+    assert [one["id"] for one in resp.json()["results"]] == [users[i].id for i in indexes]
+
+
+@pytest.mark.parametrize("search,indexes", [
+    ("юрій", (0, 1)),
+    ("Yurii", (0, 1)),
+    ("shcherbak", (1,)),
+    ("Щербак", (1,)),
+    ("shcherback", (1,)),
+    ("Оленна", (2,)),
+    ("nonexistent", ()),
+])
+async def test_filter_search_postgres(postgres_db, search, indexes):
+    await apply_migration("19_20261018110000_update", models.User)
+    users = [
+        await models.User.create(first_name="Юрій", last_name="", nickname=""),
+        await models.User.create(first_name="Yurii", last_name="Shcherbak", nickname=""),
+        await models.User.create(first_name="Olena", last_name="Melnyk", nickname=""),
+    ]
+
+    queryset = services.users.Filter().search(models.User.all(), search)
+    user_ids = await queryset.order_by("-search_rank", "id").values_list("id", flat=True)
+    assert user_ids == [users[i].id for i in indexes]
+
+    plan = await explain_without_sort(queryset)
+    assert "idx_user_search_text_trgm" in plan["indexes"]
+
+
+async def test_search_text_on_save(db):
+    user = factories.UserFactory.create(first_name="Олена", last_name="", nickname="")
+    assert user.search_text == "olena"
+
+    user.nickname = "Пташка"
+    await user.save(update_fields=["nickname"])
+
+    user = await models.User.get(id=user.id)
+    assert user.search_text == "olena ptashka"
+
+
 async def test_filter_role(client):
     factories.UserFactory.create_batch(size=2, role=models.User.Role.ADMIN)
     users = factories.BaseUserFactory.create_batch(size=3)
@@ -204,6 +424,218 @@ async def test_filter_order_by(order_by, db_order, client):
     assert ids == user_ids
 
 
+async def fetch_all_pages(client, url, params) -> list[dict]:
+    results = []
+    params = {**params, "page_size": 2}
+
+    while True:
+        resp = await client.get(url, params=params)
+        assert resp.status_code == 200
+
+        data = resp.json()
+        results.extend(data["results"])
+
+        if data["next_cursor"] is None:
+            return results
+
+        params["cursor"] = data["next_cursor"]
+
+
+@pytest.mark.parametrize("count,count_strategy,total_count,total_pages", [
+    (None, "EXACT", 5, 3),
+    ("EXACT", "EXACT", 5, 3),
+    ("WINDOW", "WINDOW", 5, 3),
+    # No planner estimate on SQLite
+    ("ESTIMATE", "EXACT", 5, 3),
+    ("CACHED", "CACHED", 5, 3),
+    ("NONE", "NONE", None, None),
+])
+async def test_filter_count_strategy(count, count_strategy, total_count, total_pages, client):
+    users = factories.UserFactory.create_batch(size=5)
+    client.authorize(users[0].id)
+
+    query = {"page_size": 2}
+    if count:
+        query["count"] = count
+
+    resp = await client.get(FILTER_URL, params=query)
+    assert resp.status_code == 200
+
+    data = resp.json()
+    assert data["count_strategy"] == count_strategy
+    assert data["total_count"] == total_count
+    assert data["total_pages"] == total_pages
+    assert len(data["results"]) == 2
+
+
+@pytest.mark.parametrize("query", [{"role": models.User.Role.BASE.value}, {}])
+async def test_filter_count_default_exact(query, client):
+    users = factories.UserFactory.create_batch(size=5, role=models.User.Role.BASE)
+    client.authorize(users[0].id)
+    query = {**query, "page_size": 2}
+
+    resp = await client.get(FILTER_URL, params=query)
+    factories.UserFactory(role=models.User.Role.BASE)
+
+    # Following cursor page counts the new user too
+    resp = await client.get(FILTER_URL, params={**query, "cursor": resp.json()["next_cursor"]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["count_strategy"] == "EXACT"
+    assert data["total_count"] == 6
+
+
+async def test_filter_count_cached_cursor(client, redis_cleanup):
+    users = factories.UserFactory.create_batch(size=5)
+    client.authorize(users[0].id)
+
+    resp = await client.get(FILTER_URL, params={"page_size": 2, "count": "CACHED"})
+    cursor = resp.json()["next_cursor"]
+
+    # Deeper pages don't count all rows again
+    factories.UserFactory()
+    resp = await client.get(FILTER_URL, params={"page_size": 2, "count": "CACHED", "cursor": cursor})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["count_strategy"] == "CACHED"
+    assert data["total_count"] == 5
+
+
+async def test_filter_count_window_single_query(client):
+    users = factories.UserFactory.create_batch(size=3)
+    client.authorize(users[0].id)
+
+    with patch.object(models.QuerySet, "count", side_effect=AssertionError("Separate count query")):
+        resp = await client.get(FILTER_URL, params={"count": "WINDOW", "page_size": 2})
+
+    assert resp.status_code == 200
+    assert resp.json()["total_count"] == 3
+
+
+@pytest.mark.parametrize("page,use_cursor", [(3, False), (1, True)])
+async def test_filter_count_window_fallback(page, use_cursor, client):
+    users = factories.UserFactory.create_batch(size=3)
+    client.authorize(users[0].id)
+    query = {"count": "WINDOW", "page_size": 2, "page": page}
+
+    if use_cursor:
+        resp = await client.get(FILTER_URL, params=query)
+        query["cursor"] = resp.json()["next_cursor"]
+
+    resp = await client.get(FILTER_URL, params=query)
+    assert resp.status_code == 200
+
+    data = resp.json()
+    assert data["count_strategy"] == "EXACT"
+    assert data["total_count"] == 3
+
+
+async def test_filter_count_cached(client):
+    users = factories.UserFactory.create_batch(size=3, role=models.User.Role.BASE)
+    client.authorize(users[0].id)
+
+    resp = await client.get(FILTER_URL, params={"count": "CACHED"})
+    assert resp.json()["total_count"] == 3
+
+    factories.UserFactory(role=models.User.Role.BASE)
+
+    # Count is cached per filter
+    resp = await client.get(FILTER_URL, params={"count": "CACHED"})
+    assert resp.json()["total_count"] == 3
+    assert len(resp.json()["results"]) == 4
+
+    resp = await client.get(FILTER_URL, params={"count": "CACHED", "role": models.User.Role.BASE.value})
+    assert resp.json()["total_count"] == 4
+
+
+@pytest.mark.parametrize("order_by", [one.value for one in schemas.users.FilterOrder])
+async def test_filter_cursor(order_by, client):
+    country = factories.CountryFactory()
+    user = factories.BaseUserFactory(date_of_birth=None, country=None)
+    factories.BaseUserFactory.create_batch(size=2, date_of_birth=date.today() - timedelta(days=3), country=country)
+    factories.AdminUserFactory(date_of_birth=None, country=country)
+    factories.SuperAdminUserFactory(date_of_birth=date.today(), country=None)
+
+    client.authorize(user.id)
+    resp = await client.get(FILTER_URL, params={"order_by": order_by})
+    assert resp.status_code == 200
+    expected = resp.json()["results"]
+
+    assert await fetch_all_pages(client, FILTER_URL, {"order_by": order_by}) == expected
+
+
+async def test_filter_cursor_other_order(client):
+    users = factories.UserFactory.create_batch(size=3)
+    client.authorize(users[0].id)
+
+    resp = await client.get(FILTER_URL, params={"page_size": 1})
+    cursor = resp.json()["next_cursor"]
+    assert cursor
+
+    query = {"page_size": 1, "cursor": cursor, "order_by": schemas.users.FilterOrder.AGE_ASC.value}
+    resp = await client.get(FILTER_URL, params=query)
+    assert resp.status_code == 400
+
+    resp = await client.get(FILTER_URL, params={"page_size": 1, "cursor": "invalid"})
+    assert resp.status_code == 400
+
+
+async def test_filter_cursor_not_seekable(db):
+    factories.UserFactory.create_batch(size=3)
+    # Float annotation as search_rank on Postgres
+    queryset = models.User.annotate(search_rank=RawSQL('"user"."id" / 3.0')).order_by("-search_rank")
+    query = schemas.users.FilterQuery(page_size=2)
+
+    response = await services.utils.paginate_response(queryset, query, schemas.users.FilterResponse)
+    assert len(response.results) == 2
+    assert response.total_pages == 2
+    assert response.next_cursor is None
+
+    row = {"search_rank": 1 / 3, "id": 1}
+    cursor = services.utils.encode_cursor(row, services.utils.get_orderings(queryset))
+    with pytest.raises(HTTPException) as e:
+        services.utils.paginate_queryset(queryset, schemas.users.FilterQuery(cursor=cursor))
+
+    assert e.value.status_code == 400
+    assert e.value.detail == errors.INVALID_CURSOR
+
+
+@pytest.mark.parametrize("values", [
+    ["2020-01-01T00:00:00", "zz"],
+    ["abc", 1],
+    [[1, 2], 1],
+    [{"datetime": "2020-01-01T00:00:00"}, 1],
+    ["2020-01-01T00:00:00"],
+])
+async def test_filter_cursor_invalid_values(values, client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    payload = json.dumps({"order": ["-created_at", "id"], "values": values})
+    cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+
+    resp = await client.get(FILTER_URL, params={"cursor": cursor})
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == errors.INVALID_CURSOR
+
+
+async def test_filter_statement_timeout(client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+    metrics.reset()
+
+    async def run_query(*args, **kwargs):
+        assert db_client.statement_timeout.get() == settings().DB_FILTER_STATEMENT_TIMEOUT
+        raise db.QueryTimeout()
+
+    with patch.object(services.users.Filter, "get", side_effect=run_query):
+        resp = await client.get(FILTER_URL)
+
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"]
+    assert metrics.snapshot()[f"db.statement_timeout.GET {FILTER_URL}"]["value"] == 1
+
+
 async def test_create(client):
     user = factories.SuperAdminUserFactory()
     client.authorize(user.id)
@@ -219,6 +651,19 @@ async def test_create(client):
     assert created.role == models.User.Role.BASE
 
 
+async def test_create_atomic(client):
+    user = factories.SuperAdminUserFactory()
+    client.authorize(user.id)
+
+    payload = {"email": "user@test.email"}
+    with patch.object(schemas.users.CreateResponse, "from_orm", side_effect=RuntimeError("Serialization failed")):
+        with pytest.raises(RuntimeError):
+            await client.post(CREATE_URL, json=payload)
+
+    is_created = await models.User.filter(email=payload["email"]).exists()
+    assert not is_created
+
+
 async def test_create_permission_denied(client):
     user = factories.AdminUserFactory()
     client.authorize(user.id)
@@ -317,6 +762,22 @@ async def test_membership_empty(client):
     assert data["results"] == []
 
 
+async def test_membership_cursor(client):
+    user = factories.UserFactory()
+    client.authorize(user.id)
+
+    for camp in factories.CampFactory.create_batch(size=3, name="same") + factories.CampFactory.create_batch(size=2):
+        factories.CampMemberFactory(user=user, camp=camp)
+
+    url = MEMBERSHIP_URL.format(user_id=user.id)
+    query = {"order_by": schemas.users.MembershipOrder.NAME_DESC.value}
+    resp = await client.get(url, params=query)
+    assert resp.status_code == 200
+    expected = resp.json()["results"]
+
+    assert await fetch_all_pages(client, url, query) == expected
+
+
 @pytest.mark.parametrize("order_by,db_order", [
     (schemas.users.MembershipOrder.CREATED_AT_ASC.value, "created_at"),
     (schemas.users.MembershipOrder.CREATED_AT_DESC.value, "-created_at"),
@@ -339,7 +800,10 @@ async def test_membership_order_by(client, order_by, db_order):
     factories.CampMemberFactory.create_batch(user=user, size=3)
     factories.CampMemberFactory.create_batch(size=2)
 
-    membership_ids = await models.CampMember.filter(user_id=user.id).order_by(db_order).values_list("id", flat=True)
+    # Ties are ordered by id in direction of the sort key
+    tiebreaker = "-id" if db_order.startswith("-") else "id"
+    queryset = models.CampMember.filter(user_id=user.id).order_by(db_order, tiebreaker)
+    membership_ids = await queryset.values_list("id", flat=True)
 
     query = {"order_by": order_by}
     resp = await client.get(MEMBERSHIP_URL.format(user_id=user.id), params=query)
@@ -348,3 +812,27 @@ async def test_membership_order_by(client, order_by, db_order):
     data = resp.json()
     ids = [one["camp"]["id"] for one in data["results"]]
     assert ids == membership_ids
+
+
+# Cursor page of nullable ascending key (NULLs last in Postgres) is bounded by a disjunction, not the index scan start
+@pytest.mark.parametrize("order_by,filters,index,seek", [
+    (schemas.users.FilterOrder.CREATED_AT_ASC, {}, "idx_user_created_5e2aef", True),
+    (schemas.users.FilterOrder.CREATED_AT_DESC, {}, "idx_user_created_5e2aef", True),
+    (schemas.users.FilterOrder.AGE_ASC, {}, "idx_user_date_of_237bd3", False),
+    (schemas.users.FilterOrder.AGE_DESC, {}, "idx_user_date_of_237bd3", True),
+    (schemas.users.FilterOrder.ROLE, {}, "idx_user_role_065004", True),
+    (schemas.users.FilterOrder.CREATED_AT_DESC, {"role": models.User.Role.ADMIN}, "idx_user_role_759251", True),
+    (schemas.users.FilterOrder.CREATED_AT_DESC, {"country_id": 1}, "idx_user_country_2f2123", True),
+])
+async def test_filter_order_index_postgres(postgres_db, order_by, filters, index, seek):
+    # Cursor of the first row, it's in country 1
+    factories.UserFactory(role=models.User.Role.ADMIN)
+    ordering = services.users.Filter().format_order([order_by])
+    queryset = models.User.filter(**filters).select_related("country").order_by(*ordering)
+    await assert_ordered_by_index(queryset, index, seek=seek)
+
+
+async def test_membership_order_index_postgres(postgres_db):
+    ordering = services.users.Membership().format_order([schemas.users.MembershipOrder.CREATED_AT_DESC])
+    queryset = models.CampMember.filter(user_id=1).select_related("camp__country").order_by(*ordering)
+    await assert_ordered_by_index(queryset, "idx_campmember_user_id_762cf2")
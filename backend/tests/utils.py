@@ -0,0 +1,83 @@
+import importlib.util
+import json
+from pathlib import Path
+
+from tortoise.transactions import in_transaction
+
+import models
+import schemas.pagination
+import services.utils
+
+MIGRATIONS_DIR = Path(__file__).parent.parent / "migrations" / "models"
+
+
+async def apply_migration(name: str, model):
+    """
+    Run upgrade SQL of migration adding objects unknown to models, e.g. generated columns and their indexes
+    :param name: migration file name without extension
+    :param model: any model of the connection to run it on
+    :return:
+    """
+    spec = importlib.util.spec_from_file_location(name, MIGRATIONS_DIR / f"{name}.py")
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    connection = model._meta.db
+    await connection.execute_script(await migration.upgrade(connection))
+
+
+async def explain_without_sort(queryset) -> dict:
+    """
+    Postgres plan of the queryset when sorting and sequential scans are too costly, so that on any table size
+    planner reads rows in order from an index whenever one matches
+    :param queryset:
+    :return: {"nodes": node types, "indexes": names of scanned indexes, "index_conds": index name -> Index Cond}
+    """
+    connection_name = queryset.model._meta.db.connection_name
+
+    async with in_transaction(connection_name) as connection:
+        await connection.execute_script("SET LOCAL enable_sort = off; SET LOCAL enable_seqscan = off")
+        rows = await queryset.using_db(connection).explain()
+
+    nodes, indexes, index_conds = [], [], {}
+    stack = [json.loads(rows[0]["QUERY PLAN"])[0]["Plan"]]
+
+    while stack:
+        node = stack.pop()
+        nodes.append(node["Node Type"])
+        stack.extend(node.get("Plans", ()))
+
+        if "Index Name" in node:
+            indexes.append(node["Index Name"])
+            index_conds[node["Index Name"]] = node.get("Index Cond", "")
+
+    return {"nodes": nodes, "indexes": indexes, "index_conds": index_conds}
+
+
+async def assert_ordered_by_index(queryset: models.QuerySet, index: str, seek: bool = False):
+    """
+    Assert that the page query of the queryset, sorted with tiebreaker as paginated responses are, reads rows in order
+    from the index instead of sorting them
+    :param queryset: filtered and ordered queryset of the endpoint
+    :param index: name of the index
+    :param seek: also check the page after cursor of the first row, index scan has to start at the cursor
+    :return:
+    """
+    paginated_query = schemas.pagination.PaginatedQuery()
+
+    if seek:
+        orderings = services.utils.get_orderings(queryset)
+        first_page = services.utils.paginate_queryset(queryset, paginated_query)
+        row = await first_page.first().values(*(field for field, _ in orderings))
+        paginated_query = schemas.pagination.PaginatedQuery(cursor=services.utils.encode_cursor(row, orderings))
+
+    page_queryset = services.utils.paginate_queryset(queryset, paginated_query)
+
+    plan = await explain_without_sort(page_queryset)
+    assert index in plan["indexes"]
+    assert "Sort" not in plan["nodes"]
+    assert "Incremental Sort" not in plan["nodes"]
+
+    if seek:
+        leading_field = orderings[0][0]
+        assert leading_field in plan["index_conds"][index]
@@ -1,7 +1,13 @@
 #! /usr/bin/bash
 
+# Throttling is keyed by client IP: if X-Forwarded-For of the reverse proxy isn't trusted, all clients share its IP.
+# Set to comma separated IPs of the proxy or '*' if only the proxy can reach the app
+: "${FORWARDED_ALLOW_IPS:?FORWARDED_ALLOW_IPS must be set to IPs of the reverse proxy}"
+
 pybabel compile -d translations/locales
 python manage.py upgrade-zero-migration
 aerich upgrade
+# Users saved before search_text was added or by previous release aren't found by search until it's filled
+python manage.py update-user-search-text --missing-only
 python manage.py create-default-superadmin
-uvicorn main:app --host ${HOST:-0.0.0.0} --port ${PORT:-8000} --proxy-headers --forwarded-allow-ips='*'
\ No newline at end of file
+uvicorn main:app --host ${HOST:-0.0.0.0} --port ${PORT:-8000} --proxy-headers --forwarded-allow-ips="$FORWARDED_ALLOW_IPS"
\ No newline at end of file